@@ -1,15 +1,110 @@
 """Set admin privileges for admin page"""
 
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME, ActionForm
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.template.response import TemplateResponse
 
-from .models import Division, Mission, MissionReport, Employee
+from .bulk import delete_missions, update_missions
+from .models import (ISS_ADMIN_GROUP, Division, Mission, MissionReport, Employee, ReportJob,
+                     SecurityClearance)
+
+
+class MissionActionForm(ActionForm):
+    """Values the bulk mission actions set on the selected missions"""
+    supervisor = forms.ModelChoiceField(
+        Employee.objects.filter(user__groups__name=ISS_ADMIN_GROUP).select_related('user'),
+        required=False)
+    division = forms.ModelChoiceField(Division.objects.all(), required=False)
+    security_clearance = forms.TypedChoiceField(
+        choices=[('', '---------'), *SecurityClearance.choices], coerce=int, required=False,
+        empty_value=None)
+
+
+@admin.register(Mission)
+class MissionAdmin(admin.ModelAdmin):
+    """Missions, with set-based bulk actions for reorganisations"""
+    action_form = MissionActionForm
+    actions = ['delete_with_reports', 'reassign_missions', 'change_clearance']
+    list_display = ('name', 'supervisor', 'division', 'security_clearance')
+    list_filter = ('security_clearance', 'division')
+
+    def get_actions(self, request):
+        # The built-in delete action lists every report and job of the selected missions on
+        # its confirmation page; delete_with_reports counts them instead
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+
+        return actions
+
+    def delete_queryset(self, request, queryset):
+        # Deleted with their reports in a few statements instead of one collection per report
+        counts = delete_missions(queryset)
+
+        self.message_user(request, f"Deleted {counts['missions']} missions and "
+                                   f"{counts['reports']} reports.")
+
+    @admin.action(description="Delete selected missions with their reports",
+                  permissions=['delete'])
+    def delete_with_reports(self, request, queryset):
+        """Delete the selected missions once confirmed, after showing how many rows go"""
+        if request.POST.get('post'):
+            self.delete_queryset(request, queryset)
+            return None
+
+        return TemplateResponse(request, 'admin/missions/mission/delete_with_reports.html', {
+            **self.admin_site.each_context(request),
+            'title': "Are you sure?",
+            'opts': self.opts,
+            'missions': queryset.count(),
+            'reports': MissionReport.objects.filter(mission__in=queryset).count(),
+            'jobs': ReportJob.objects.filter(mission__in=queryset).count(),
+            'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across') == '1',
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        })
+
+    def action_value(self, request, field):
+        """A value chosen in the action form, or None"""
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+
+        return form.cleaned_data.get(field) if form.is_valid() else None
+
+    @admin.action(description="Reassign selected missions to the chosen supervisor or division",
+                  permissions=['change'])
+    def reassign_missions(self, request, queryset):
+        """Set the supervisor and division chosen in the action form"""
+        changes = {field: self.action_value(request, field) for field in ('supervisor', 'division')}
+        changes = {field: value for field, value in changes.items() if value is not None}
+
+        if not changes:
+            self.message_user(request, "Choose a supervisor or division to reassign to.",
+                              messages.WARNING)
+            return
+
+        counts = update_missions(queryset, **changes)
+        self.message_user(request, f"Reassigned {counts['missions']} missions.")
+
+    @admin.action(description="Change security clearance of selected missions",
+                  permissions=['change'])
+    def change_clearance(self, request, queryset):
+        """Set the security clearance chosen in the action form"""
+        security_clearance = self.action_value(request, 'security_clearance')
+
+        if security_clearance is None:
+            self.message_user(request, "Choose a security clearance.", messages.WARNING)
+            return
+
+        counts = update_missions(queryset, security_clearance=security_clearance)
+        self.message_user(request, f"Changed the clearance of {counts['missions']} missions.")
 
 
 admin.site.register(Division)
-admin.site.register(Mission)
 admin.site.register(MissionReport)
+admin.site.register(ReportJob)
 
 
 class EmployeeInline(admin.StackedInline):
@@ -6,3 +6,10 @@ class MissionsConfig(AppConfig):
     """Configure the Missions App"""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'missions'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+        from .notifications import check_broker  # pylint: disable=import-outside-toplevel
+
+        check_broker()
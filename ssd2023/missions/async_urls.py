@@ -0,0 +1,15 @@
+"""URL paths for the Missions App with the async views, used when served over ASGI"""
+from django.urls import path
+
+from . import async_views, urls
+
+urlpatterns = [
+    path("", async_views.index),
+    path("login", async_views.login_endpoint),
+    path("logout", async_views.logout_endpoint),
+    path("mission/<int:mission_id>", async_views.mission_details),
+    path("mission-report/<int:mission_report_id>", async_views.mission_report_details),
+    path("notifications", async_views.notifications),
+    # Every other path is served by the sync views
+    *urls.urlpatterns,
+]
@@ -0,0 +1,241 @@
+"""
+Async versions of the read-heavy views, served in place of the sync ones under ASGI.
+
+Queries go through the async ORM and templates are rendered in a worker thread,
+so a request waiting on the database does not hold a thread of its own.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, logout
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.template.loader import render_to_string
+
+from . import dashboards
+from .caching import acached_fragment
+from .decorators import acache_control, acondition, alogin_required, apermission_required
+from .models import Dashboard, Mission, MissionReport
+from .notifications import employee_channel, get_broker, reaches_workers
+from .pagination import KeysetPaginator, get_page_size
+from .ratelimit import limit_login
+from .roles import aget_roles
+from .routers import pin_to_primary, read_from_replica
+from .views import (MISSION_ORDERING, MISSION_REPORT_ORDERING, aget_updated_at,
+                    get_dashboard_content, get_dashboard_querysets, login_credentials,
+                    login_page, login_rate_limited, login_rejected, login_succeeded, make_etag,
+                    mission_content, mission_etag_parts, mission_fragment, mission_permissions,
+                    mission_report_fragment)
+
+logger = logging.getLogger("ssd2023")
+
+# Seconds between comments keeping idle notification streams open through proxies
+NOTIFICATION_KEEPALIVE = 15
+# Milliseconds browsers wait before reconnecting to a closed notification stream
+NOTIFICATION_RETRY = 5000
+
+
+async def paginate_missions(request, missions):
+    """Keyset paginate a mission queryset by primary key"""
+    paginator = KeysetPaginator(
+        missions, MISSION_ORDERING, page_size=get_page_size(request), prefix='missions_')
+
+    return await paginator.aget_page(request.GET)
+
+
+async def paginate_mission_reports(request, mission_reports):
+    """Keyset paginate a mission report queryset, newest first"""
+    paginator = KeysetPaginator(
+        mission_reports, MISSION_REPORT_ORDERING, page_size=get_page_size(request),
+        prefix='reports_')
+
+    return await paginator.aget_page(request.GET)
+
+
+async def mission_last_modified(request, mission_id):
+    """Last-Modified of the mission details page"""
+    return await aget_updated_at(request, Mission, mission_id)
+
+
+async def mission_etag(request, mission_id):
+    """ETag of the mission details page"""
+    return make_etag(await aget_updated_at(request, Mission, mission_id),
+                     *mission_etag_parts(request))
+
+
+async def mission_report_last_modified(request, mission_report_id):
+    """Last-Modified of the mission report page"""
+    return await aget_updated_at(request, MissionReport, mission_report_id)
+
+
+async def mission_report_etag(request, mission_report_id):
+    """ETag of the mission report page, which is the same for every viewer"""
+    return make_etag(await aget_updated_at(request, MissionReport, mission_report_id))
+
+
+@alogin_required(login_url='/login')
+@read_from_replica
+async def index(request):
+    """View of index page based on access control"""
+    content = {
+        'can_add_mission': request.user.has_perm("missions.add_mission"),
+    }
+    roles = await aget_roles(request.user)
+    dashboard = None
+
+    if dashboards.covers(request, roles):
+        dashboard = await Dashboard.objects.filter(pk=roles.employee_id).afirst()
+
+    dashboard_content = get_dashboard_content(request, roles, dashboard)
+
+    if dashboard_content is not None:
+        content.update(dashboard_content, notifications=reaches_workers())
+        return await sync_to_async(render)(request, 'index.html', content)
+
+    missions, mission_reports = get_dashboard_querysets(request.user, roles)
+
+    if missions is not None:
+        content['missions'] = await paginate_missions(request, missions)
+
+    if mission_reports is not None:
+        content['mission_reports'] = await paginate_mission_reports(request, mission_reports)
+        content['notifications'] = roles.has_employee and reaches_workers()
+
+    return await sync_to_async(render)(request, 'index.html', content)
+
+
+@pin_to_primary
+async def login_endpoint(request):
+    """User login endpoint"""
+    if request.method == 'POST':
+        username, password = login_credentials(request)
+
+        # Checked before authenticate() so that rejected guesses cost no password hash
+        retry_after = await sync_to_async(limit_login)(request, username)
+
+        if retry_after:
+            return await sync_to_async(login_rate_limited)(request, username, retry_after)
+
+        user = await sync_to_async(authenticate)(request, username=username, password=password)
+
+        if user is not None:
+            return await sync_to_async(login_succeeded)(request, user)
+
+        await sync_to_async(login_rejected)(username)
+
+    return await sync_to_async(login_page)(request)
+
+
+@alogin_required(login_url='/login')
+async def logout_endpoint(request):
+    """User logout endpoint"""
+    await sync_to_async(logout)(request)
+
+    return await sync_to_async(render)(request, 'logout.html')
+
+
+@alogin_required(login_url='/login')
+@apermission_required('missions.view_mission')
+@read_from_replica
+@acache_control(private=True, no_cache=True)
+@acondition(etag_func=mission_etag, last_modified_func=mission_last_modified)
+async def mission_details(request, mission_id):
+    """View mission details"""
+    roles = await aget_roles(request.user)
+    mission = await Mission.objects.visible_to(roles).only(
+        'pk', 'division_id', 'supervisor_id').filter(pk=mission_id).afirst()
+
+    if mission is None:
+        raise Http404("No Mission matches the given query.")
+
+    permissions = mission_permissions(request.user)
+
+    async def render_details():
+        details = await Mission.objects.select_related(
+            'division', 'supervisor__user').aget(pk=mission_id)
+        mission_reports = await paginate_mission_reports(
+            request, details.missionreport_set.visible_to(roles))
+
+        return await sync_to_async(render_to_string)('includes/mission-details.html', {
+            'mission': details,
+            'reports': mission_reports,
+        }, request)
+
+    mission_details_html = await acached_fragment(
+        'mission', render=render_details,
+        **mission_fragment(request, roles, mission, permissions))
+
+    return await sync_to_async(render)(
+        request, 'mission.html', mission_content(mission, mission_details_html, permissions))
+
+
+@alogin_required(login_url='/login')
+@apermission_required('missions.view_missionreport')
+@read_from_replica
+@acache_control(private=True, no_cache=True)
+@acondition(etag_func=mission_report_etag, last_modified_func=mission_report_last_modified)
+async def mission_report_details(request, mission_report_id):
+    """View mission report details"""
+    keys = await MissionReport.objects.visible_to(await aget_roles(request.user)).values(
+        'mission_id', 'assigned_to_id').filter(pk=mission_report_id).afirst()
+
+    if keys is None:
+        raise Http404("No MissionReport matches the given query.")
+
+    async def render_page():
+        mission_report = await MissionReport.objects.select_related(
+            'mission', 'assigned_to__user').aget(pk=mission_report_id)
+
+        return await sync_to_async(render_to_string)(
+            'mission-report.html', {'mission_report': mission_report}, request)
+
+    return HttpResponse(await acached_fragment(
+        'mission-report', mission_report_fragment(mission_report_id, keys), render_page))
+
+
+async def notification_events(channel, security_clearance):
+    """Server-sent events of the reports published to a channel, until the stream expires"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'MISSIONS_NOTIFICATION_STREAM_SECONDS', 300)
+    subscription = await get_broker().subscribe(channel)
+
+    try:
+        yield f"retry: {NOTIFICATION_RETRY}\n\n"
+
+        while (remaining := deadline - loop.time()) > 0:
+            message = await subscription.get(min(NOTIFICATION_KEEPALIVE, remaining))
+
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+
+            report = json.loads(message)
+
+            if report.pop('security_clearance') > security_clearance:
+                continue
+
+            yield f"event: report\nid: {report['id']}\ndata: {json.dumps(report)}\n\n"
+    finally:
+        await subscription.close()
+
+
+@alogin_required(login_url='/login')
+@apermission_required('missions.view_missionreport')
+async def notifications(request):
+    """Push the reports assigned to the user from now on, as server-sent events"""
+    roles = await aget_roles(request.user)
+
+    if not roles.has_employee or not reaches_workers():
+        # Tells the browser not to reconnect
+        return HttpResponse(status=204)
+
+    response = StreamingHttpResponse(
+        notification_events(employee_channel(roles.employee_id), roles.security_clearance),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-store'
+    response['X-Accel-Buffering'] = 'no'
+
+    return response
@@ -0,0 +1,59 @@
+"""Authentication backends for the Missions App"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from .roles import get_roles
+
+USER_CACHE_KEY = 'missions:user:v1:{}'
+DEFAULT_USER_CACHE_TIMEOUT = 0
+
+
+def get_user_cache_timeout():
+    """Seconds to keep logged in users in the sessions cache; 0 disables it"""
+    return getattr(settings, 'MISSIONS_USER_CACHE_TIMEOUT', DEFAULT_USER_CACHE_TIMEOUT)
+
+
+def get_user_cache():
+    """The cache of session users, which is the sessions cache"""
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def invalidate_users(*user_ids):
+    """Drop the cached users with the given ids"""
+    get_user_cache().delete_many([USER_CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+class RoleBackend(ModelBackend):
+    """
+    Model backend that answers permission checks from the resolved user roles,
+    and loads the user of each request's session from the sessions cache when
+    MISSIONS_USER_CACHE_TIMEOUT is set
+    """
+
+    def get_user(self, user_id):
+        timeout = get_user_cache_timeout()
+
+        if not timeout:
+            return super().get_user(user_id)
+
+        cache = get_user_cache()
+        key = USER_CACHE_KEY.format(user_id)
+        user = cache.get(key)
+
+        if user is None:
+            try:
+                user = get_user_model()._default_manager.get(pk=user_id)  # pylint: disable=protected-access
+            except get_user_model().DoesNotExist:
+                return None
+
+            cache.set(key, user, timeout)
+
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+
+        return set(get_roles(user_obj).permissions)
@@ -0,0 +1,107 @@
+"""
+Delete, reassign or reclassify many missions at once with set-based queries.
+
+Deleting a mission through the ORM collects each of its reports in Python to
+send their signals, and saving a mission sends its own; over thousands of
+missions that is thousands of round trips. These operations run a handful of
+UPDATE and DELETE statements per batch of missions in one transaction instead,
+and bring the data those signals would have kept in step up to date themselves:
+fragment versions, updated_at columns, the search index, statistics and
+dashboards.
+"""
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from .caching import bump_versions
+from .dashboards import refresh as refresh_dashboards
+from .models import Mission, MissionReport, ReportJob
+from .search import get_backend as get_search_backend
+from .transfer import chunked
+
+DEFAULT_MAX_BULK_MISSIONS = 10000
+
+# Missions per statement, keeping IN lists within every backend's parameter limit
+BATCH_SIZE = 500
+
+
+def get_max_missions():
+    """Most missions one bulk operation may act on"""
+    return getattr(settings, 'MISSIONS_MAX_BULK_MISSIONS', DEFAULT_MAX_BULK_MISSIONS)
+
+
+def affected_employees(mission_ids, using):
+    """Supervisors of the missions and assignees of their reports, whose dashboards list them"""
+    employees = set()
+
+    for batch in chunked(mission_ids, BATCH_SIZE):
+        employees.update(Mission.objects.using(using).filter(
+            pk__in=batch).values_list('supervisor_id', flat=True))
+        employees.update(MissionReport.objects.using(using).filter(
+            mission__in=batch).values_list('assigned_to_id', flat=True).distinct())
+
+    return employees
+
+
+def delete_missions(missions):
+    """Delete missions with their reports and report jobs; returns the number of each deleted"""
+    using = router.db_for_write(Mission)
+    counts = {'missions': 0, 'reports': 0, 'jobs': 0}
+
+    with transaction.atomic(using=using):
+        mission_ids = list(missions.using(using).values_list('pk', flat=True))
+        employees = affected_employees(mission_ids, using)
+        search = get_search_backend(using)
+
+        for batch in chunked(mission_ids, BATCH_SIZE):
+            missions = Mission.objects.using(using).filter(pk__in=batch)
+            reports = MissionReport.objects.using(using).filter(mission__in=batch)
+
+            search.remove_matching(MissionReport, reports)
+            search.remove_matching(Mission, missions)
+
+            # Dependents first, as the cascade would; nothing listens for their deletion
+            # pylint: disable=protected-access
+            counts['jobs'] += ReportJob.objects.using(using).filter(
+                mission__in=batch)._raw_delete(using)
+            counts['reports'] += reports._raw_delete(using)
+            counts['missions'] += missions._raw_delete(using)
+            # pylint: enable=protected-access
+
+        refresh_dashboards(employees, using)
+
+    bump_versions(('stats', 'mission'), ('stats', 'report'),
+                  *(('mission', pk) for pk in mission_ids))
+
+    return counts
+
+
+def update_missions(missions, **changes):
+    """
+    Set fields of many missions, such as their supervisor, division or clearance;
+    returns the number of missions updated and of the reports on them
+    """
+    using = router.db_for_write(Mission)
+    counts = {'missions': 0, 'reports': 0}
+    now = timezone.now()
+
+    with transaction.atomic(using=using):
+        mission_ids = list(missions.using(using).values_list('pk', flat=True))
+        # Those listing the missions before the change, and after it
+        employees = affected_employees(mission_ids, using)
+
+        if changes.get('supervisor') is not None:
+            employees.add(changes['supervisor'].pk)
+
+        for batch in chunked(mission_ids, BATCH_SIZE):
+            counts['missions'] += Mission.objects.using(using).filter(pk__in=batch).update(
+                updated_at=now, **changes)
+            # Report pages are dated by their mission's updated_at as well as their own
+            counts['reports'] += MissionReport.objects.using(using).filter(
+                mission__in=batch).count()
+
+        refresh_dashboards(employees, using)
+
+    bump_versions(('stats', 'mission'), *(('mission', pk) for pk in mission_ids))
+
+    return counts
@@ -0,0 +1,151 @@
+"""Cache rendered mission and report fragments, invalidated through per-object version tokens"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+
+PAGE_CACHE_ALIAS = 'pages'
+DEFAULT_PAGE_CACHE_TIMEOUT = 3600
+
+VERSION_KEY = 'missions:version:{}:{}'
+FRAGMENT_KEY = 'missions:fragment:{}:{}'
+HITS_KEY = 'missions:fragment-cache:hits'
+MISSES_KEY = 'missions:fragment-cache:misses'
+
+
+def get_page_cache():
+    """The cache holding rendered fragments and version tokens"""
+    alias = PAGE_CACHE_ALIAS if PAGE_CACHE_ALIAS in settings.CACHES else 'default'
+
+    return caches[alias]
+
+
+def get_timeout():
+    """Seconds to keep a rendered fragment"""
+    return getattr(settings, 'MISSIONS_PAGE_CACHE_TIMEOUT', DEFAULT_PAGE_CACHE_TIMEOUT)
+
+
+def new_version():
+    """A version token that cannot collide with one issued before"""
+    return time.time_ns()
+
+
+def get_versions(*objects):
+    """
+    Current version tokens of (model name, primary key) pairs.
+
+    A token that is missing, whether never issued or evicted, is replaced by a
+    fresh one, so an eviction can only cause a miss and never a stale hit.
+    """
+    cache = get_page_cache()
+    keys = [VERSION_KEY.format(name, pk) for name, pk in objects]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(*objects):
+    """Current version tokens of (model name, primary key) pairs, read asynchronously"""
+    cache = get_page_cache()
+    keys = [VERSION_KEY.format(name, pk) for name, pk in objects]
+    versions = await cache.aget_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+
+    if missing:
+        await cache.aset_many(missing, None)
+        versions.update(missing)
+
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*objects):
+    """Invalidate every fragment rendered from the given (model name, primary key) pairs"""
+    objects = [(name, pk) for name, pk in objects if pk is not None]
+
+    if objects:
+        get_page_cache().set_many(
+            {VERSION_KEY.format(name, pk): new_version() for name, pk in objects}, None)
+
+
+def _count(key):
+    cache = get_page_cache()
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+async def _acount(key):
+    cache = get_page_cache()
+
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 0, None)
+        await cache.aincr(key)
+
+
+def get_stats():
+    """Fragment cache hit and miss counts"""
+    counts = get_page_cache().get_many([HITS_KEY, MISSES_KEY])
+
+    return {'hits': counts.get(HITS_KEY, 0), 'misses': counts.get(MISSES_KEY, 0)}
+
+
+def fragment_key(name, depends_on, versions, vary_on):
+    """Cache key of a fragment rendered from the given object versions"""
+    parts = [f"{name}:{pk}:{version}" for (name, pk), version in zip(depends_on, versions)]
+    parts.extend(str(value) for value in vary_on)
+
+    return FRAGMENT_KEY.format(name, hashlib.sha256('|'.join(parts).encode()).hexdigest())
+
+
+def cached_fragment(name, depends_on, render, vary_on=()):
+    """
+    Return a rendered fragment from the cache, rendering and storing it on a miss.
+
+    depends_on lists the (model name, primary key) pairs whose version tokens
+    form part of the key; vary_on lists any other values the output depends on,
+    such as the viewer's permission flags or the page of a listing.
+    """
+    key = fragment_key(name, depends_on, get_versions(*depends_on), vary_on)
+
+    cache = get_page_cache()
+    fragment = cache.get(key)
+
+    if fragment is not None:
+        _count(HITS_KEY)
+        return mark_safe(fragment)  # nosec - cached output of the template engine
+
+    _count(MISSES_KEY)
+    fragment = render()
+    cache.set(key, str(fragment), get_timeout())
+
+    return mark_safe(fragment)  # nosec - output of the template engine
+
+
+async def acached_fragment(name, depends_on, render, vary_on=()):
+    """Like cached_fragment, for async views; render is a coroutine function"""
+    key = fragment_key(name, depends_on, await aget_versions(*depends_on), vary_on)
+
+    cache = get_page_cache()
+    fragment = await cache.aget(key)
+
+    if fragment is not None:
+        await _acount(HITS_KEY)
+        return mark_safe(fragment)  # nosec - cached output of the template engine
+
+    await _acount(MISSES_KEY)
+    fragment = await render()
+    await cache.aset(key, str(fragment), get_timeout())
+
+    return mark_safe(fragment)  # nosec - output of the template engine
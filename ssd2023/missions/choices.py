@@ -0,0 +1,89 @@
+"""Cached supervisor and report assignee choices for forms and type-ahead search"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+
+from .models import Employee
+from .roles import ISS_ADMIN_GROUP, NASA_ADMIN_GROUP
+
+CHOICES_CACHE_KEY = 'missions:employee-choices:{}'
+DEFAULT_CHOICES_CACHE_TIMEOUT = 0
+DEFAULT_TYPEAHEAD_THRESHOLD = 500
+
+# Employees offered by each choice field: the group they must belong to and the
+# permissions, any of which lets a user search them
+SUPERVISOR = 'supervisor'
+ASSIGNEE = 'assignee'
+
+EMPLOYEE_ROLES = {
+    SUPERVISOR: (ISS_ADMIN_GROUP, ('missions.add_mission', 'missions.change_mission')),
+    ASSIGNEE: (NASA_ADMIN_GROUP, ('missions.add_missionreport',)),
+}
+
+LABEL_FIELDS = ('pk', 'user__first_name', 'user__last_name', 'user__username')
+
+
+def get_choices_cache_timeout():
+    """Seconds to keep choice lists in the shared cache; 0 disables it"""
+    return getattr(settings, 'MISSIONS_CHOICES_CACHE_TIMEOUT', DEFAULT_CHOICES_CACHE_TIMEOUT)
+
+
+def get_choices_cache():
+    """The cache shared by every process that choice lists are kept in"""
+    return caches[getattr(settings, 'MISSIONS_CHOICES_CACHE', settings.SESSION_CACHE_ALIAS)]
+
+
+def get_typeahead_threshold():
+    """Number of choices above which a select only offers the current one and searches"""
+    return getattr(settings, 'MISSIONS_TYPEAHEAD_THRESHOLD', DEFAULT_TYPEAHEAD_THRESHOLD)
+
+
+def role_employees(role):
+    """Employees that may be chosen for a role"""
+    group, _ = EMPLOYEE_ROLES[role]
+
+    return Employee.objects.filter(user__groups__name=group)
+
+
+def label_choices(rows):
+    """(pk, label) pairs from (pk, first name, last name, username) rows"""
+    return [(pk, Employee.label(first_name, last_name, username))
+            for pk, first_name, last_name, username in rows]
+
+
+def load_employee_choices(role):
+    """(pk, label) pairs of the employees for a role, in one query"""
+    return label_choices(role_employees(role).order_by('pk').values_list(*LABEL_FIELDS))
+
+
+def get_employee_choices(role):
+    """(pk, label) pairs of the employees for a role, from the cache where possible"""
+    timeout = get_choices_cache_timeout()
+    key = CHOICES_CACHE_KEY.format(role)
+    choices = get_choices_cache().get(key) if timeout else None
+
+    if choices is None:
+        choices = load_employee_choices(role)
+
+        if timeout:
+            get_choices_cache().set(key, choices, timeout)
+
+    return choices
+
+
+def invalidate_employee_choices():
+    """Drop every cached choice list"""
+    get_choices_cache().delete_many([CHOICES_CACHE_KEY.format(role) for role in EMPLOYEE_ROLES])
+
+
+def search_employees(role, query):
+    """Employees for a role whose name or username contains every word of a query"""
+    employees = role_employees(role).select_related('user').only(
+        'pk', 'user__first_name', 'user__last_name', 'user__username')
+
+    for term in query.split():
+        employees = employees.filter(
+            Q(user__username__icontains=term) | Q(user__first_name__icontains=term) |
+            Q(user__last_name__icontains=term))
+
+    return employees
@@ -0,0 +1,9 @@
+"""Template context processors for the Missions App"""
+from django.utils.functional import SimpleLazyObject
+
+from .roles import get_roles
+
+
+def roles(request):
+    """Expose the current user's roles to templates without resolving them eagerly"""
+    return {'roles': SimpleLazyObject(lambda: get_roles(request.user))}
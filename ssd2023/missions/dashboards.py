@@ -0,0 +1,412 @@
+"""
+Materialised index pages of employees.
+
+Each employee's Dashboard row holds the first page of the missions they
+supervise, of the reports on those missions and of the reports assigned to
+them, within their clearance, and the totals of each. The index page of an
+ISS or NASA admin is then read with one primary key lookup instead of joins
+that grow with the tables.
+
+Signals keep the rows up to date incrementally: a mission or report created,
+renamed, redated or deleted adds one to or takes one from the totals and is
+inserted into, updated in or removed from the stored pages, in the transaction
+making the change. Only what cannot be worked out from the stored rows is
+rebuilt from the tables once the change commits: a first page a removal leaves
+short of rows that lie beyond it, and employees gaining or losing whole lists,
+through a change of supervisor, assignee or clearance. Saves that change
+nothing a dashboard shows do no dashboard work at all. Pages past the first,
+and superusers, are still queried.
+"""
+import bisect
+import datetime
+import threading
+
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import Dashboard, Employee, Mission, MissionReport
+from .pagination import DEFAULT_PAGE_SIZE, KeysetPaginator, get_page_size
+
+# Employees to rebuild when the transaction commits, per thread and database
+_state = threading.local()
+
+# Total kept alongside each stored list
+COUNTS = {
+    'missions': 'mission_count',
+    'supervised_reports': 'supervised_report_count',
+    'assigned_reports': 'assigned_report_count',
+}
+
+# Fields of each model a dashboard shows or is scoped by; their values as loaded
+# are kept on the instance, so that a save can tell what it changed without a query
+TRACKED_FIELDS = {
+    Mission: ('name', 'supervisor_id', 'security_clearance'),
+    MissionReport: ('title', 'publish_date', 'assigned_to_id', 'mission_id'),
+    Employee: ('security_clearance',),
+}
+LOADED_KEY = '_dashboard_loaded'
+
+
+def get_dashboard_size():
+    """Rows kept per list: a page of the default size and one more to tell if there is another"""
+    return getattr(settings, 'MISSIONS_PAGE_SIZE', DEFAULT_PAGE_SIZE) + 1
+
+
+def employee_querysets(employee_id, security_clearance):
+    """An employee's supervised missions, reports on them and reports assigned to them"""
+    missions = Mission.objects.filter(supervisor=employee_id,
+                                      security_clearance__lte=security_clearance)
+    supervised_reports = MissionReport.objects.filter(mission__in=missions)
+    assigned_reports = MissionReport.objects.filter(
+        assigned_to=employee_id, mission__security_clearance__lte=security_clearance)
+
+    return missions, supervised_reports, assigned_reports
+
+
+def report_row(report_id, title, publish_date):
+    """A report as stored in a dashboard"""
+    if publish_date.tzinfo is not None:
+        publish_date = publish_date.astimezone(datetime.timezone.utc)
+
+    return {'pk': report_id, 'title': title, 'publish_date': publish_date.isoformat()}
+
+
+def report_rows(reports, size):
+    """The newest reports, as stored in a dashboard"""
+    return [report_row(*row) for row in reports.order_by('-publish_date', '-pk').values_list(
+        'pk', 'title', 'publish_date')[:size]]
+
+
+def build(employee_id, security_clearance, using):
+    """Compute an employee's dashboard from the missions and reports tables"""
+    size = get_dashboard_size()
+    missions, supervised_reports, assigned_reports = (
+        queryset.using(using) for queryset in employee_querysets(employee_id, security_clearance))
+
+    return Dashboard(
+        employee_id=employee_id,
+        mission_count=missions.count(),
+        supervised_report_count=supervised_reports.count(),
+        assigned_report_count=assigned_reports.count(),
+        missions=[{'pk': pk, 'name': name} for pk, name in
+                  missions.order_by('pk').values_list('pk', 'name')[:size]],
+        supervised_reports=report_rows(supervised_reports, size),
+        assigned_reports=report_rows(assigned_reports, size),
+    )
+
+
+def rebuild(employee_ids=None, using=None):
+    """Recompute the dashboards of some employees, or of all; returns how many were written"""
+    using = using or router.db_for_write(Dashboard)
+    employees = Employee.objects.using(using).order_by('pk')
+
+    if employee_ids is not None:
+        employee_ids = set(employee_ids)
+        employees = employees.filter(pk__in=employee_ids)
+        # Employees that have gone take their dashboard with them
+        Dashboard.objects.using(using).filter(pk__in=employee_ids).exclude(
+            pk__in=employees.values('pk')).delete()
+
+    count = 0
+
+    for employee_id, security_clearance in employees.values_list('pk', 'security_clearance'):
+        dashboard = build(employee_id, security_clearance, using)
+        dashboard.save(using=using)
+        count += 1
+
+    return count
+
+
+def refresh(employee_ids, using):
+    """
+    Rebuild the dashboards of some employees once the current transaction
+    commits; employees named by several changes in it are rebuilt once
+    """
+    pending = _state.__dict__.setdefault('pending', {}).setdefault(using, set())
+    pending.update(employee_id for employee_id in employee_ids if employee_id is not None)
+
+    def flush():
+        employees = set(pending)
+        pending.clear()
+
+        if employees:
+            rebuild(employees, using)
+
+    # Later callbacks find nothing left to do; after a rollback the employees
+    # are rebuilt with the next commit instead
+    transaction.on_commit(flush, using=using)
+
+
+def remember(instance):
+    """Keep the tracked fields of a loaded or saved instance, to compare the next save with"""
+    instance.__dict__[LOADED_KEY] = {
+        field: instance.__dict__[field] for field in TRACKED_FIELDS[type(instance)]
+        if field in instance.__dict__}
+
+
+def changed_fields(instance, using, update_fields=None):
+    """
+    The tracked fields a save of an existing row changes, with the values they
+    had; a field set on an instance loaded without it is read from the table
+    """
+    loaded = instance.__dict__.get(LOADED_KEY, {})
+    fields = [field.attname for field in instance._meta.concrete_fields
+              if field.attname in TRACKED_FIELDS[type(instance)]
+              and field.attname in instance.__dict__
+              and (update_fields is None or field.name in update_fields)]
+    unknown = [field for field in fields if field not in loaded]
+
+    if unknown and instance.pk is not None:
+        loaded = {**loaded, **(type(instance).objects.using(using).filter(
+            pk=instance.pk).values(*unknown).first() or {})}
+
+    return {field: loaded.get(field) for field in fields
+            if field in loaded and loaded[field] != instance.__dict__[field]}
+
+
+def sort_key(field, row):
+    """Position of a stored row in its list: missions by primary key, reports newest first"""
+    if field == 'missions':
+        return (row['pk'],)
+
+    return (-parse_datetime(row['publish_date']).timestamp(), -row['pk'])
+
+
+def row_index(rows, object_id):
+    """Index of the stored row of an object, or None"""
+    return next((index for index, row in enumerate(rows) if row['pk'] == object_id), None)
+
+
+def insertion_point(field, rows, row):
+    """Where a row goes in a stored list"""
+    return bisect.bisect([sort_key(field, other) for other in rows], sort_key(field, row))
+
+
+def insert(dashboard, field, row):
+    """Count a new row in a list, storing it if it falls on the first page"""
+    rows = getattr(dashboard, field)
+    size = get_dashboard_size()
+    position = insertion_point(field, rows, row)
+
+    setattr(dashboard, COUNTS[field], getattr(dashboard, COUNTS[field]) + 1)
+
+    if position < size:
+        rows.insert(position, row)
+        del rows[size:]
+
+    return True
+
+
+def remove(dashboard, field, row):
+    """
+    Stop counting a row of a list and drop it from the first page; False when
+    that leaves the page a row short of those beyond it
+    """
+    rows = getattr(dashboard, field)
+    count = max(getattr(dashboard, COUNTS[field]) - 1, 0)
+    index = row_index(rows, row['pk'])
+
+    setattr(dashboard, COUNTS[field], count)
+
+    if index is not None:
+        del rows[index]
+
+    return len(rows) >= min(count, get_dashboard_size())
+
+
+def update(dashboard, field, row):
+    """Replace a stored row whose position is unchanged"""
+    rows = getattr(dashboard, field)
+    index = row_index(rows, row['pk'])
+
+    if index is not None:
+        rows[index] = row
+
+    return True
+
+
+def move(dashboard, field, row):
+    """
+    Reposition a row whose sort key changed; False when it moves past the end
+    of a full first page and another row may take its place
+    """
+    rows = getattr(dashboard, field)
+    held_all = getattr(dashboard, COUNTS[field]) <= get_dashboard_size()
+    index = row_index(rows, row['pk'])
+
+    if index is not None:
+        del rows[index]
+    elif held_all:
+        return False
+
+    position = insertion_point(field, rows, row)
+
+    if position < len(rows) or held_all:
+        rows.insert(position, row)
+        del rows[get_dashboard_size():]
+        return True
+
+    return index is None
+
+
+def adjust(edits, using):
+    """
+    Apply edits, {employee: [(function, list, row)]}, to the stored dashboards
+    in the current transaction; employees whose dashboard is missing, or an edit
+    cannot be applied to, are rebuilt once it commits instead
+    """
+    edits = {employee_id: changes for employee_id, changes in edits.items()
+             if employee_id is not None and changes}
+
+    if not edits:
+        return
+
+    stale = set()
+
+    with transaction.atomic(using=using):
+        stored = Dashboard.objects.using(using).select_for_update().in_bulk(list(edits))
+
+        for employee_id, changes in edits.items():
+            dashboard = stored.get(employee_id)
+
+            if dashboard is None or not all(function(dashboard, field, row)
+                                            for function, field, row in changes):
+                stale.add(employee_id)
+            else:
+                dashboard.save(using=using)
+
+    if stale:
+        refresh(stale, using)
+
+
+def clearances(using, *employee_ids):
+    """Security clearance of each of the given employees"""
+    return dict(Employee.objects.using(using).filter(pk__in=[
+        employee_id for employee_id in employee_ids if employee_id is not None]).values_list(
+            'pk', 'security_clearance'))
+
+
+def mission_supervisor(mission, using):
+    """The mission's supervisor, if their clearance lets them see it, or None"""
+    clearance = clearances(using, mission.supervisor_id).get(mission.supervisor_id)
+
+    if clearance is None or mission.security_clearance > clearance:
+        return None
+
+    return mission.supervisor_id
+
+
+def mission_added(mission, using):
+    """A new mission is listed by its supervisor"""
+    adjust({mission_supervisor(mission, using): [
+        (insert, 'missions', {'pk': mission.pk, 'name': mission.name})]}, using)
+
+
+def mission_renamed(mission, using):
+    """A mission's name is shown on its supervisor's first page, if it is there"""
+    adjust({mission.supervisor_id: [
+        (update, 'missions', {'pk': mission.pk, 'name': mission.name})]}, using)
+
+
+def mission_removed(mission, using):
+    """A mission without reports is deleted"""
+    adjust({mission_supervisor(mission, using): [
+        (remove, 'missions', {'pk': mission.pk})]}, using)
+
+
+def report_lists(report, using):
+    """The dashboard lists a report is on, by employee"""
+    if MissionReport._meta.get_field('mission').is_cached(report):
+        mission = (report.mission.security_clearance, report.mission.supervisor_id)
+    else:
+        mission = Mission.objects.using(using).filter(pk=report.mission_id).values_list(
+            'security_clearance', 'supervisor_id').first()
+
+    if mission is None:
+        return {}
+
+    security_clearance, supervisor_id = mission
+    allowed = clearances(using, supervisor_id, report.assigned_to_id)
+    lists = {}
+
+    for employee_id, field in ((supervisor_id, 'supervised_reports'),
+                               (report.assigned_to_id, 'assigned_reports')):
+        if employee_id in allowed and security_clearance <= allowed[employee_id]:
+            lists.setdefault(employee_id, []).append(field)
+
+    return lists
+
+
+def report_changed(report, function, using):
+    """Apply one edit to each dashboard list the report is on"""
+    row = report_row(report.pk, report.title, report.publish_date)
+
+    adjust({employee_id: [(function, field, row) for field in fields]
+            for employee_id, fields in report_lists(report, using).items()}, using)
+
+
+def stored_page(request, paginator, rows, count, make_item):
+    """A page of stored rows, or None if they do not cover the requested page"""
+    if len(rows) < min(count, paginator.page_size + 1):
+        return None
+
+    return paginator.first_page(request.GET, [make_item(row) for row in rows])
+
+
+def mission_item(row):
+    """A stored mission, with the attributes the index page and its cursors use"""
+    return SimpleNamespace(**row)
+
+
+def report_item(row):
+    """A stored report, with the attributes the index page and its cursors use"""
+    return SimpleNamespace(pk=row['pk'], title=row['title'],
+                           publish_date=parse_datetime(row['publish_date']))
+
+
+def covers(request, roles):
+    """Whether the request is for the first pages of an ISS or NASA admin's index page"""
+    paginating = any(param.endswith(('after', 'before')) for param in request.GET)
+
+    return (not roles.is_superuser and roles.has_employee and
+            (roles.is_iss_admin or roles.is_nasa_admin) and not paginating and
+            get_page_size(request) < get_dashboard_size())
+
+
+def index_content(request, roles, dashboard, mission_ordering, report_ordering):
+    """
+    The lists of the index page from a dashboard, as get_dashboard_querysets()
+    would give them, or None if the dashboard cannot serve the request
+    """
+    page_size = get_page_size(request)
+    reports = KeysetPaginator(MissionReport.objects.none(), report_ordering,
+                              page_size=page_size, prefix='reports_')
+
+    if not roles.is_iss_admin:
+        mission_reports = stored_page(request, reports, dashboard.assigned_reports,
+                                      dashboard.assigned_report_count, report_item)
+
+        return None if mission_reports is None else {
+            'mission_reports': mission_reports,
+            'mission_report_count': dashboard.assigned_report_count,
+        }
+
+    missions = stored_page(
+        request, KeysetPaginator(Mission.objects.none(), mission_ordering,
+                                 page_size=page_size, prefix='missions_'),
+        dashboard.missions, dashboard.mission_count, mission_item)
+    mission_reports = stored_page(request, reports, dashboard.supervised_reports,
+                                  dashboard.supervised_report_count, report_item)
+
+    if missions is None or mission_reports is None:
+        return None
+
+    return {
+        'missions': missions,
+        'mission_count': dashboard.mission_count,
+        'mission_reports': mission_reports,
+        'mission_report_count': dashboard.supervised_report_count,
+    }
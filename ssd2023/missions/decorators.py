@@ -0,0 +1,119 @@
+"""
+Async counterparts of Django's view decorators, which in Django 4.2 only wrap
+synchronous views
+"""
+import datetime
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .roles import aget_roles
+
+
+async def aget_user(request):
+    """
+    Resolve the lazy request.user, and with it the session, in a worker thread.
+
+    The user's roles are resolved as well, so later permission checks through
+    request.user.has_perm() are answered from memory rather than the database.
+    """
+    def resolve():
+        request.user.is_authenticated  # pylint: disable=pointless-statement
+
+        return request.user
+
+    user = await sync_to_async(resolve)()
+    await aget_roles(user)
+
+    return user
+
+
+def alogin_required(login_url):
+    """Redirect anonymous users of an async view to the login page"""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            user = await aget_user(request)
+
+            if not user.is_authenticated:
+                return redirect_to_login(request.get_full_path(), login_url)
+
+            return await view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def apermission_required(perm):
+    """Deny users of an async view who lack a permission with a 403"""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            user = await aget_user(request)
+
+            if not user.has_perm(perm):
+                raise PermissionDenied
+
+            return await view_func(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def acache_control(**kwargs):
+    """Add Cache-Control directives to the response of an async view"""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kw):
+            response = await view_func(request, *args, **kw)
+            patch_cache_control(response, **kwargs)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def acondition(etag_func=None, last_modified_func=None):
+    """Conditional GET for an async view, taking coroutine functions like condition() does"""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            res_etag = await etag_func(request, *args, **kwargs) if etag_func else None
+            res_etag = quote_etag(res_etag) if res_etag is not None else None
+
+            last_modified = (await last_modified_func(request, *args, **kwargs)
+                             if last_modified_func else None)
+            res_last_modified = None
+
+            if last_modified:
+                if not timezone.is_aware(last_modified):
+                    last_modified = timezone.make_aware(last_modified, datetime.timezone.utc)
+                res_last_modified = int(last_modified.timestamp())
+
+            response = get_conditional_response(
+                request, etag=res_etag, last_modified=res_last_modified)
+
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+
+            if request.method in ('GET', 'HEAD'):
+                if res_last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(res_last_modified)
+                if res_etag:
+                    response.headers.setdefault('ETag', res_etag)
+
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,88 @@
+"""Model fields for the Missions App"""
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+from django.utils.encoding import force_bytes
+from django_cryptography.fields import get_encrypted_field
+
+
+class Ciphertext(bytes):
+    """An encrypted value as stored in the database, not yet decrypted"""
+
+
+class DecryptOnAccess(DeferredAttribute):
+    """Model attribute that decrypts the stored value the first time it is read"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+
+        value = super().__get__(instance, cls)
+
+        if isinstance(value, Ciphertext):
+            value = self.field.decrypt(value)
+            instance.__dict__[self.field.attname] = value
+
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class LazyEncryptedCharField(get_encrypted_field(models.CharField)):
+    """
+    Encrypted CharField that only decrypts when the attribute is read.
+
+    Rows are stored exactly as by django-cryptography's encrypt(CharField()),
+    but loading a model keeps the ciphertext, so listing employees costs no
+    decryption unless their numbers are shown. Unread values are written back
+    as they were, without being decrypted and encrypted again. Querysets of
+    values() return Ciphertext, which decrypt_many() turns into plain values.
+    """
+
+    descriptor_class = DecryptOnAccess
+
+    # Values are encrypted and decrypted by the field's own FernetBytes, which
+    # django-cryptography creates once per field
+
+    def encrypt(self, value):
+        """Encrypt a single value"""
+        return Ciphertext(self._dump(value))
+
+    def decrypt(self, value):
+        """Decrypt a single stored value, returning Expired if it has outlived the ttl"""
+        return self._load(bytes(value))
+
+    def encrypt_many(self, values):
+        """Encrypt a batch of values, such as those of an import, keeping None as is"""
+        return [None if value is None else self.encrypt(value) for value in values]
+
+    def decrypt_many(self, values):
+        """Decrypt a batch of stored values, such as those of an export"""
+        return [value if value is None or not isinstance(value, Ciphertext)
+                else self.decrypt(value) for value in values]
+
+    def from_db_value(self, value, *args, **kwargs):
+        """Keep the stored value encrypted until it is read"""
+        if value is None:
+            return value
+
+        return Ciphertext(force_bytes(value))
+
+    def pre_save(self, model_instance, add):
+        """Read past the descriptor so that saving does not decrypt unread values"""
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+
+        return super().pre_save(model_instance, add)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        """Encrypt plain values; ciphertext that was never read is stored as it was"""
+        if not isinstance(value, Ciphertext):
+            value = models.Field.get_db_prep_value(self, value, connection, prepared)
+
+            if value is None:
+                return value
+
+            value = self.encrypt(value)
+
+        return connection.Database.Binary(value)
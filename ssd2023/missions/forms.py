@@ -1,14 +1,78 @@
 """Module for custom forms"""
 
 from django import forms
+from django.core.exceptions import ValidationError
 from django.forms import Form, ModelForm, TextInput, DateTimeInput, Select
+from django.forms.models import ModelChoiceIterator
+from django.utils.functional import cached_property
 
-from .models import Mission, Employee
+from .choices import (ASSIGNEE, SUPERVISOR, get_employee_choices, get_typeahead_threshold,
+                      role_employees)
+from .bulk import get_max_missions
+from .models import Division, Mission, SecurityClearance
+
+
+class EmployeeSelect(Select):
+    """Select of employees that only offers the current one when there are too many to list"""
+
+    def __init__(self, role, attrs=None):
+        super().__init__(attrs)
+        self.role = role
+
+    def get_context(self, name, value, attrs):
+        if len(self.choices) > get_typeahead_threshold():
+            selected = set(self.format_value(value))
+            self.choices = [(key, label) for key, label in self.choices
+                            if key == '' or str(key) in selected]
+            # Other employees are found through the type-ahead endpoint
+            attrs = {**(attrs or {}), 'data-typeahead-url': f"/employees?role={self.role}"}
+
+        return super().get_context(name, value, attrs)
+
+
+class EmployeeChoiceIterator(ModelChoiceIterator):
+    """Iterate over the cached (pk, label) choices instead of loading employees"""
+
+    @cached_property
+    def employee_choices(self):
+        """The choices, read once however often the form renders, counts or tests them"""
+        return get_employee_choices(self.field.role)
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+
+        yield from self.employee_choices
+
+    def __len__(self):
+        return len(self.employee_choices) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.employee_choices)
+
+
+class EmployeeChoiceField(forms.ModelChoiceField):
+    """
+    Choice of a supervisor or report assignee.
+
+    Options are rendered from a cached list of labels, built in one query,
+    while submitted values are still checked against the database.
+    """
+
+    iterator = EmployeeChoiceIterator
+
+    def __init__(self, role, **kwargs):
+        self.role = role
+        kwargs.setdefault('widget', EmployeeSelect(role, attrs={'class': 'form-control'}))
+
+        super().__init__(queryset=role_employees(role).select_related('user'), **kwargs)
 
 
 class MissionForm(ModelForm):
     """Form for creating a new mission"""
 
+    supervisor = EmployeeChoiceField(SUPERVISOR, label='Supervisor')
+
     class Meta:
         """Form model, display fields, widgets, and labels"""
         model = Mission
@@ -25,7 +89,6 @@ class MissionForm(ModelForm):
             'name': TextInput(attrs={'class': 'form-control'}),
             'description': TextInput(attrs={'class': 'form-control'}),
             'division': Select(attrs={'class': 'form-control'}),
-            'supervisor': Select(attrs={'class': 'form-control'}),
             'start_date': DateTimeInput(
                 attrs={'class': 'form-control', 'placeholder': 'yyyy-MM-dd HH:MM:SS'}),
             'end_date': DateTimeInput(
@@ -36,7 +99,6 @@ class MissionForm(ModelForm):
             'name': 'Mission Name',
             'description': 'Mission Description',
             'division': 'Division',
-            'supervisor': 'Supervisor',
             'start_date': 'Start Date',
             'end_date': 'End Date',
             'security_clearance': 'Security Clearance',
@@ -46,12 +108,86 @@ class MissionForm(ModelForm):
 class GenerateReportForm(Form):
     """Form for generating a new report for an existing mission."""
 
-    assigned_to = forms.ModelChoiceField(
-        queryset=Employee.objects.filter(user__groups__name='NASA_Admin_User'),
-        required=True,
-        widget=Select(attrs={'class': 'form-control'})
-    )
+    assigned_to = EmployeeChoiceField(ASSIGNEE, required=True)
     report_summary = forms.CharField(
         required=True,
         widget=TextInput(attrs={'class': 'form-control'})
     )
+
+
+class MissionReportExportForm(Form):
+    """Filters for exporting mission reports"""
+
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], required=False)
+    mission = forms.IntegerField(required=False)
+    assigned_to = forms.IntegerField(required=False)
+    published_after = forms.DateTimeField(required=False)
+    published_before = forms.DateTimeField(required=False)
+
+    def filter(self, mission_reports):
+        """Narrow a mission report queryset by the submitted filters"""
+        filters = {
+            'mission': self.cleaned_data['mission'],
+            'assigned_to': self.cleaned_data['assigned_to'],
+            'publish_date__gte': self.cleaned_data['published_after'],
+            'publish_date__lt': self.cleaned_data['published_before'],
+        }
+
+        return mission_reports.filter(
+            **{lookup: value for lookup, value in filters.items() if value is not None})
+
+
+class MissionIdsField(forms.Field):
+    """Primary keys of missions, submitted as a repeated parameter"""
+
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            pks = sorted({int(pk) for pk in value or ()})
+        except (TypeError, ValueError) as error:
+            raise ValidationError("Enter whole numbers.", code='invalid') from error
+
+        if len(pks) > get_max_missions():
+            raise ValidationError(f"Select at most {get_max_missions()} missions.",
+                                  code='max_missions')
+
+        return pks
+
+
+class BulkMissionForm(Form):
+    """Form for deleting, reassigning or changing the clearance of many missions"""
+
+    ACTIONS = [
+        ('delete', 'Delete'),
+        ('reassign', 'Reassign'),
+        ('clearance', 'Change security clearance'),
+    ]
+
+    action = forms.ChoiceField(choices=ACTIONS)
+    missions = MissionIdsField()
+    supervisor = EmployeeChoiceField(SUPERVISOR, required=False)
+    division = forms.ModelChoiceField(Division.objects.all(), required=False)
+    security_clearance = forms.TypedChoiceField(
+        choices=SecurityClearance.choices, coerce=int, required=False, empty_value=None)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        action = cleaned_data.get('action')
+
+        if action == 'reassign' and not (cleaned_data.get('supervisor') or
+                                         cleaned_data.get('division')):
+            raise ValidationError("Choose a supervisor or division to reassign to.")
+
+        if action == 'clearance' and cleaned_data.get('security_clearance') is None:
+            self.add_error('security_clearance', "Choose a security clearance.")
+
+        return cleaned_data
+
+    def changes(self):
+        """Fields to set on the missions for the chosen action"""
+        if self.cleaned_data['action'] == 'clearance':
+            return {'security_clearance': self.cleaned_data['security_clearance']}
+
+        return {field: self.cleaned_data[field] for field in ('supervisor', 'division')
+                if self.cleaned_data[field] is not None}
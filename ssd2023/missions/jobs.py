@@ -0,0 +1,201 @@
+"""
+Database backed queue of report generation jobs.
+
+The generate view only validates and enqueues a job. Workers started with the
+process_report_jobs command claim due jobs with a conditional update, so that
+several workers, threads or processes, never run the same job, and retry
+failed jobs with exponential backoff up to MISSIONS_REPORT_JOB_MAX_ATTEMPTS.
+"""
+import logging
+import threading
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.utils import timezone
+
+from .models import MissionReport, ReportJob
+from .roles import get_roles
+
+logger = logging.getLogger("ssd2023.jobs")
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_SECONDS = 5
+DEFAULT_TIMEOUT_SECONDS = 300
+
+# Due jobs looked at per claim, in case other workers take the first ones
+CLAIM_BATCH = 10
+
+# Shown for jobs whose worker stopped on their last attempt
+LOST_ERROR = "The report took too long to generate"
+
+
+class JobError(Exception):
+    """A job cannot succeed, so it is failed without being retried"""
+
+
+class JobLost(Exception):
+    """A job was reclaimed by another worker while it ran"""
+
+
+def is_queued():
+    """Whether reports are generated by a worker rather than in the request"""
+    return getattr(settings, 'MISSIONS_REPORT_QUEUE', True)
+
+
+def get_max_attempts():
+    """Times a job is run before it is failed"""
+    return getattr(settings, 'MISSIONS_REPORT_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+
+def get_retry_delay(attempts):
+    """Seconds before a job that failed after a number of attempts is run again"""
+    return getattr(settings, 'MISSIONS_REPORT_JOB_RETRY_SECONDS',
+                   DEFAULT_RETRY_SECONDS) * 2 ** (attempts - 1)
+
+
+def get_timeout():
+    """Seconds after which a running job is assumed lost with its worker"""
+    return getattr(settings, 'MISSIONS_REPORT_JOB_TIMEOUT', DEFAULT_TIMEOUT_SECONDS)
+
+
+def enqueue(mission, employee, summary, user):
+    """Queue the generation of a report, or generate it now if the queue is off"""
+    job = ReportJob.objects.create(mission=mission, assigned_to=employee, summary=summary,
+                                   requested_by=user)
+
+    if not is_queued():
+        claimed = claim(job.pk)
+
+        # Unless a worker took it first, and generates the report instead
+        if claimed is not None:
+            run(claimed)
+
+    return job
+
+
+def lost_jobs(now):
+    """Running jobs whose worker is presumed gone"""
+    return ReportJob.objects.filter(status=ReportJob.Status.RUNNING,
+                                    locked_at__lt=now - timedelta(seconds=get_timeout()))
+
+
+def due_jobs(now):
+    """Pending jobs whose time has come, and lost jobs with attempts left"""
+    return ReportJob.objects.filter(
+        models.Q(status=ReportJob.Status.PENDING, run_after__lte=now) |
+        models.Q(pk__in=lost_jobs(now).filter(attempts__lt=get_max_attempts())))
+
+
+def fail_lost_jobs(now):
+    """Fail the lost jobs that have used up their attempts; returns how many"""
+    return lost_jobs(now).filter(attempts__gte=get_max_attempts()).update(
+        status=ReportJob.Status.FAILED, locked_at=None, last_error=LOST_ERROR)
+
+
+def claim(job_id=None):
+    """Take the next due job, or the given one if due, for this worker; None if there is none"""
+    now = timezone.now()
+    fail_lost_jobs(now)
+    jobs = due_jobs(now)
+
+    if job_id is not None:
+        jobs = jobs.filter(pk=job_id)
+
+    for candidate in jobs.order_by('run_after', 'pk').values_list('pk', flat=True)[:CLAIM_BATCH]:
+        # Only one worker's update matches, as the job stops being due once claimed
+        if due_jobs(now).filter(pk=candidate).update(
+                status=ReportJob.Status.RUNNING, locked_at=now,
+                attempts=models.F('attempts') + 1):
+            return ReportJob.objects.select_related('mission', 'assigned_to__user').get(
+                pk=candidate)
+
+    return None
+
+
+def generate(job):
+    """Write the report of a job, as the generate view used to"""
+    if job.assigned_to is None or not get_roles(job.assigned_to.user).is_nasa_admin:
+        raise JobError("The report can only be assigned to a NASA admin")
+
+    with transaction.atomic():
+        # The title is numbered from the mission's report counter when saved
+        report = MissionReport(
+            mission=job.mission,
+            assigned_to=job.assigned_to,
+            publish_date=job.publish_date,
+            summary=job.summary
+        )
+
+        report.save()
+
+        if not ReportJob.objects.filter(
+                pk=job.pk, status=ReportJob.Status.RUNNING, locked_at=job.locked_at).update(
+                    status=ReportJob.Status.DONE, report=report, last_error=''):
+            raise JobLost(f"Job {job.pk} was claimed by another worker")
+
+    return report
+
+
+def fail(job, error, retry):
+    """
+    Record that a job failed, scheduling it again if it may be retried. Only
+    the messages of JobError are kept, to be shown to the user who asked for
+    the report; other errors may reveal internals and are only logged
+    """
+    changes = {'last_error': str(error) if isinstance(error, JobError) else ''}
+
+    if retry:
+        changes.update(status=ReportJob.Status.PENDING, locked_at=None,
+                       run_after=timezone.now() + timedelta(
+                           seconds=get_retry_delay(job.attempts)))
+    else:
+        changes.update(status=ReportJob.Status.FAILED)
+
+    ReportJob.objects.filter(pk=job.pk, status=ReportJob.Status.RUNNING,
+                             locked_at=job.locked_at).update(**changes)
+
+
+def run(job):
+    """Run a claimed job, returning its report or None if it failed"""
+    try:
+        return generate(job)
+    except JobLost as error:
+        logger.warning("%s", error)
+    except JobError as error:
+        logger.warning("Report job %s failed: %s", job.pk, error)
+        fail(job, error, retry=False)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        retry = job.attempts < get_max_attempts()
+        logger.exception("Report job %s failed on attempt %s%s", job.pk, job.attempts,
+                         ", retrying" if retry else "")
+        fail(job, error, retry)
+
+    return None
+
+
+def work(once=False, poll_interval=1.0, stop=None):
+    """Run due jobs until stopped, or until none is due if once; returns the number run"""
+    stop = stop or threading.Event()
+    count = 0
+
+    while not stop.is_set():
+        # Drop connections that have outlived CONN_MAX_AGE or failed, as requests
+        # do, unless run inside a transaction, such as a test's
+        if not transaction.get_connection().in_atomic_block:
+            close_old_connections()
+
+        job = claim()
+
+        if job is None:
+            if once:
+                break
+
+            stop.wait(poll_interval)
+            continue
+
+        run(job)
+        count += 1
+
+    return count
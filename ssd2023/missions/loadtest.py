@@ -0,0 +1,269 @@
+"""
+Scripted load test scenarios for the missions portal.
+
+Scenarios run either in process through Django's test client, which also
+counts the queries each request runs, or over HTTP against a running server
+such as runserver or gunicorn, which reports them in its Server-Timing header
+when run with MISSIONS_SERVER_TIMING=1.
+"""
+import random
+import re
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from http.cookies import SimpleCookie
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .choices import ASSIGNEE, role_employees
+from .models import Mission
+from .roles import ISS_ADMIN_GROUP, NASA_ADMIN_GROUP, get_roles
+from .seeding import SEED_SUPERUSER, SEED_USERNAME_PREFIX
+
+CSRF_TOKEN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+SERVER_TIMING_QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+# Missions and assignees sampled for the scenarios that need one
+TARGET_SAMPLE_SIZE = 100
+
+# Settings turning off the login rate limits, which would reject most repeated logins
+UNLIMITED_LOGINS = {
+    'MISSIONS_LOGIN_RATE_LIMIT_IP': (0, 1),
+    'MISSIONS_LOGIN_RATE_LIMIT_USERNAME': (0, 1),
+}
+
+SUPERUSER = 'superuser'
+ISS_ADMIN = 'iss'
+NASA_ADMIN = 'nasa'
+
+
+class LoadTestError(Exception):
+    """A load test cannot run, for example because a user cannot log in"""
+
+
+class InProcessSession:
+    """A browser session sent through Django's test client, counting queries"""
+
+    def __init__(self, host):
+        self.host = host
+        self.client = Client(HTTP_HOST=host, raise_request_exception=False)
+        self.records = []
+
+    def reset(self):
+        """Forget the session cookies, as a new visitor"""
+        self.client = Client(HTTP_HOST=self.host, raise_request_exception=False)
+
+    def request(self, method, path, data=None, expect=200):
+        """Send a request, record whether it had the expected status, and return its body"""
+        with ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(connection))
+                        for connection in connections.all()]
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data or {})
+            latency = time.perf_counter() - started
+
+        self.records.append((response.status_code == expect, latency,
+                             sum(len(context) for context in contexts)))
+
+        return response.content.decode()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as responses instead of following them"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):  # pylint: disable=too-many-arguments
+        return None
+
+
+class HttpSession:
+    """A browser session sent over HTTP to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(NoRedirect)
+        self.cookies = SimpleCookie()
+        self.records = []
+
+    def reset(self):
+        """Forget the session cookies, as a new visitor"""
+        self.cookies = SimpleCookie()
+
+    def send(self, request):
+        """The status, headers and body of the response to a request, error statuses included"""
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+
+    def request(self, method, path, data=None, expect=200):
+        """Send a request, record whether it had the expected status, and return its body"""
+        body = urllib.parse.urlencode(data or {}).encode() if method == 'post' else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method.upper())
+        # Sent even though the cookies are marked Secure, so plain HTTP servers work
+        request.add_header('Cookie', '; '.join(
+            f"{name}={morsel.value}" for name, morsel in self.cookies.items()))
+
+        started = time.perf_counter()
+        status, headers, content = self.send(request)
+        latency = time.perf_counter() - started
+
+        for header in headers.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+
+        # Queries are only known if the server sends them in its Server-Timing header
+        queries = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+        self.records.append((status == expect, latency,
+                             int(queries.group(1)) if queries else None))
+
+        return content.decode('utf-8', 'replace')
+
+
+def csrf_token(page):
+    """The CSRF token of the first form on a page"""
+    match = CSRF_TOKEN.search(page)
+
+    if match is None:
+        raise LoadTestError("No CSRF token on the page")
+
+    return match.group(1)
+
+
+def log_in(session, username, password):
+    """Log a session in through the login form"""
+    page = session.request('get', '/login')
+    session.request('post', '/login', {
+        'csrfmiddlewaretoken': csrf_token(page),
+        'username': username,
+        'password': password,
+    }, expect=302)
+
+    if not session.records[-1][0]:
+        raise LoadTestError(f"Could not log in as {username}")
+
+
+def login(session, context, rng):  # pylint: disable=unused-argument
+    """A new visitor opens the login page and logs in as a NASA admin"""
+    session.reset()
+    log_in(session, context['users'][NASA_ADMIN], context['password'])
+
+
+def index(session, context, rng):  # pylint: disable=unused-argument
+    """The dashboard"""
+    session.request('get', '/')
+
+
+def mission_details(session, context, rng):
+    """The page of a mission within the ISS admin's clearance"""
+    session.request('get', f"/mission/{rng.choice(context['missions'])}")
+
+
+def report_generation(session, context, rng):
+    """An ISS admin opens a mission and requests a report for it, queueing a job"""
+    mission = rng.choice(context['missions'])
+    page = session.request('get', f"/mission/{mission}")
+    session.request('post', f"/mission-report/generate/{mission}", {
+        'csrfmiddlewaretoken': csrf_token(page),
+        'assigned_to': rng.choice(context['assignees']),
+        'report_summary': 'Load test report',
+    }, expect=302)
+
+
+# Name: (role logged in before the scenario runs, or None, and the scenario)
+SCENARIOS = {
+    'login': (None, login),
+    'index-superuser': (SUPERUSER, index),
+    'index-iss': (ISS_ADMIN, index),
+    'index-nasa': (NASA_ADMIN, index),
+    'mission-details': (ISS_ADMIN, mission_details),
+    'report-generation': (ISS_ADMIN, report_generation),
+}
+
+
+def find_users(superuser=None, iss_admin=None, nasa_admin=None):
+    """Usernames to log in as for each role, defaulting to the seeded users"""
+    seeded = User.objects.filter(username__startswith=SEED_USERNAME_PREFIX + '.',
+                                 employee__isnull=False).order_by('pk')
+    defaults = {
+        SUPERUSER: User.objects.filter(username=SEED_SUPERUSER),
+        ISS_ADMIN: seeded.filter(groups__name=ISS_ADMIN_GROUP),
+        NASA_ADMIN: seeded.filter(groups__name=NASA_ADMIN_GROUP),
+    }
+    users = {SUPERUSER: superuser, ISS_ADMIN: iss_admin, NASA_ADMIN: nasa_admin}
+
+    for role, username in users.items():
+        if username is None:
+            users[role] = defaults[role].values_list('username', flat=True).first()
+
+    return users
+
+
+def find_targets(iss_admin):
+    """Missions the ISS admin may see and employees reports may be assigned to"""
+    user = User.objects.filter(username=iss_admin).first()
+
+    if user is None:
+        return {'missions': [], 'assignees': []}
+
+    return {
+        'missions': list(Mission.objects.visible_to(get_roles(user)).order_by('pk')
+                         .values_list('pk', flat=True)[:TARGET_SAMPLE_SIZE]),
+        'assignees': list(role_employees(ASSIGNEE).order_by('pk')
+                          .values_list('pk', flat=True)[:TARGET_SAMPLE_SIZE]),
+    }
+
+
+def summarise(records, elapsed):
+    """Throughput, latency percentiles in milliseconds and queries per request"""
+    timings = [latency * 1000 for _, latency, _ in records]
+    percentiles = (statistics.quantiles(timings, n=100, method='inclusive')
+                   if len(timings) > 1 else timings * 99)
+    queries = [count for _, _, count in records if count is not None]
+
+    return {
+        'requests': len(records),
+        'errors': sum(1 for ok, _, _ in records if not ok),
+        'throughput': len(records) / elapsed,
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        'p99': percentiles[98],
+        'max': max(timings),
+        'queries': statistics.mean(queries) if queries else None,
+    }
+
+
+def run_scenario(name, make_session, context, iterations, concurrency, random_seed=0):  # pylint: disable=too-many-arguments
+    """Run a scenario from concurrent sessions and summarise its requests"""
+    role, scenario = SCENARIOS[name]
+
+    def work(worker):
+        rng = random.Random(f"{random_seed}:{name}:{worker}")
+        session = make_session()
+
+        try:
+            if role is not None:
+                log_in(session, context['users'][role], context['password'])
+                session.records.clear()
+
+            for _ in range(worker, iterations, concurrency):
+                scenario(session, context, rng)
+        finally:
+            connections.close_all()
+
+        return session.records
+
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = [record for records in executor.map(work, range(concurrency))
+                   for record in records]
+
+    return summarise(records, time.perf_counter() - started)
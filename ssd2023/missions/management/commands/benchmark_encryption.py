@@ -0,0 +1,99 @@
+"""Measure the per-row cost of loading employees with encrypted social security numbers"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django_cryptography.fields import encrypt
+
+from missions.models import Employee, SecurityClearance
+
+SSN_FIELD = 'social_security_number'
+
+
+def per_row(started, rows):
+    """Microseconds per row since a perf_counter() reading"""
+    return (time.perf_counter() - started) * 1e6 / rows
+
+
+class Command(BaseCommand):
+    """Compare eager decryption by django-cryptography with the lazy field"""
+
+    help = ("Insert employees in a transaction that is rolled back, then report the "
+            "per-row cost of loading them when every social security number is "
+            "decrypted on load, as django-cryptography's encrypt() field does, against "
+            "the lazy field with and without reading the numbers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Number of timed runs; the fastest is reported")
+
+    def handle(self, *args, **options):
+        count = max(1, options['employees'])
+        field = Employee._meta.get_field(SSN_FIELD)
+        eager = encrypt(models.CharField(max_length=9))
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.insert(count, field)
+            inserted = per_row(started, count)
+
+            results = {name: min(measure() for _ in range(options['repeat']))
+                       for name, measure in self.measurements(count, field, eager).items()}
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{count} employees, bulk encrypted and inserted at "
+                          f"{inserted:.1f} us per row\n")
+
+        for name, cost in results.items():
+            self.stdout.write(f"  {name:<48}{cost:>8.1f} us per row")
+
+    @staticmethod
+    def insert(count, field):
+        """Insert employees with users and encrypted numbers"""
+        prefix = f"ssn-benchmark-{time.time_ns()}"
+        User.objects.bulk_create(
+            [User(username=f"{prefix}.{number}", password='!') for number in range(count)])
+        users = User.objects.filter(username__startswith=prefix).values_list('pk', flat=True)
+        ssns = field.encrypt_many([f"{number:09d}" for number in range(count)])
+
+        Employee.objects.bulk_create(
+            [Employee(user_id=user, social_security_number=ssn,
+                      security_clearance=SecurityClearance.BASELINE)
+             for user, ssn in zip(users, ssns)], batch_size=1000)
+
+    @staticmethod
+    def measurements(count, field, eager):
+        """Timed loads of the inserted employees, keyed by a short description"""
+        queryset = Employee.objects.order_by('-pk')[:count]
+
+        def load_and_decrypt_eagerly():
+            started = time.perf_counter()
+            for employee in queryset.all():
+                eager._load(bytes(employee.__dict__[SSN_FIELD]))  # pylint: disable=protected-access
+            return per_row(started, count)
+
+        def load_lazily():
+            started = time.perf_counter()
+            list(queryset.all())
+            return per_row(started, count)
+
+        def load_lazily_and_read():
+            started = time.perf_counter()
+            for employee in queryset.all():
+                employee.social_security_number  # pylint: disable=pointless-statement
+            return per_row(started, count)
+
+        def bulk_decrypt():
+            started = time.perf_counter()
+            field.decrypt_many(queryset.values_list(SSN_FIELD, flat=True))
+            return per_row(started, count)
+
+        return {
+            'before: load, decrypting every number': load_and_decrypt_eagerly,
+            'after: load without reading numbers': load_lazily,
+            'after: load and read every number': load_lazily_and_read,
+            'after: bulk decrypt of values_list()': bulk_decrypt,
+        }
@@ -0,0 +1,127 @@
+"""Measure the query plans and latency of the hot listing queries with and without indexes"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from missions.models import Mission, MissionReport
+from missions.seeding import DEFAULT_BATCH_SIZE, seed
+
+PAGE_SIZE = 25
+REPORT_ORDERING = ('-publish_date', '-pk')
+
+
+def hot_queries():
+    """The listing queries the views run, keyed by a short description"""
+    report = MissionReport.objects.order_by('-pk').first()
+    mission = Mission.objects.order_by('-pk').first()
+
+    if report is None or mission is None:
+        raise CommandError("No reports to benchmark; run with --seed first")
+
+    missions = Mission.objects.filter(supervisor=mission.supervisor_id)
+
+    return {
+        'index (NASA): reports assigned to employee':
+            MissionReport.objects.filter(assigned_to=report.assigned_to_id)
+            .order_by(*REPORT_ORDERING)[:PAGE_SIZE + 1],
+        'index (NASA): next page of assigned reports':
+            MissionReport.objects.filter(assigned_to=report.assigned_to_id,
+                                         publish_date__lt=report.publish_date)
+            .order_by(*REPORT_ORDERING)[:PAGE_SIZE + 1],
+        'index (ISS): missions supervised by employee':
+            missions.order_by('pk')[:PAGE_SIZE + 1],
+        'index (ISS): reports of supervised missions':
+            MissionReport.objects.filter(mission__in=missions)
+            .order_by(*REPORT_ORDERING)[:PAGE_SIZE + 1],
+        'index (superuser): all reports':
+            MissionReport.objects.order_by(*REPORT_ORDERING)[:PAGE_SIZE + 1],
+        'mission details: reports of mission':
+            MissionReport.objects.filter(mission=report.mission_id)
+            .order_by(*REPORT_ORDERING)[:PAGE_SIZE + 1],
+    }
+
+
+def time_query(queryset, repeat):
+    """Median and worst latency in milliseconds of evaluating a queryset"""
+    timings = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(timings), max(timings)
+
+
+class Command(BaseCommand):
+    """Benchmark the mission listing queries against the declared model indexes"""
+
+    help = ("Optionally seed synthetic data, then report the query plan and latency of "
+            "the index and mission detail listing queries with and without the "
+            "indexes declared in the missions models.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help="Insert synthetic data before benchmarking")
+        parser.add_argument('--reports', type=int, default=1000000)
+        parser.add_argument('--missions', type=int, default=10000)
+        parser.add_argument('--employees', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Number of timed runs of each query")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            seed(employees=options['employees'], missions=options['missions'],
+                 reports=options['reports'], batch_size=options['batch_size'],
+                 log=self.stdout.write)
+
+        connection = connections[options['database']]
+        queries = {name: queryset.using(options['database'])
+                   for name, queryset in hot_queries().items()}
+
+        with_indexes = self.measure(queries, options['repeat'])
+        without_indexes = self.measure_without_indexes(connection, queries, options['repeat'])
+
+        self.stdout.write(f"\nDatabase: {connection.vendor}, "
+                          f"{MissionReport.objects.using(options['database']).count()} reports\n")
+
+        for name in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+
+            for label, results in (('without indexes', without_indexes),
+                                   ('with indexes', with_indexes)):
+                self.write_result(label, *results[name])
+
+    def write_result(self, label, plan, timings):
+        """Print a query's timings and plan under one of the setups"""
+        median, worst = timings
+        self.stdout.write(f"  {label}: median {median:.2f} ms, max {worst:.2f} ms")
+
+        for line in plan.splitlines():
+            self.stdout.write(f"    {line}")
+
+    def measure_without_indexes(self, connection, queries, repeat):
+        """Explain and time every query with the models' indexes dropped, then restore them"""
+        indexed_models = [model for model in (Mission, MissionReport) if model._meta.indexes]
+
+        with connection.schema_editor() as editor:
+            for model in indexed_models:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+
+        try:
+            return self.measure(queries, repeat)
+        finally:
+            with connection.schema_editor() as editor:
+                for model in indexed_models:
+                    for index in model._meta.indexes:
+                        editor.add_index(model, index)
+
+    def measure(self, queries, repeat):
+        """Explain and time every query"""
+        return {name: (queryset.explain(), time_query(queryset, repeat))
+                for name, queryset in queries.items()}
@@ -0,0 +1,72 @@
+"""Compare login throughput and the queries of authenticated pages across session engines"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from missions.loadtest import (ISS_ADMIN, NASA_ADMIN, UNLIMITED_LOGINS, InProcessSession,
+                               LoadTestError, find_targets, find_users, run_scenario)
+
+# Logging in, and a page hit by a logged in user
+SCENARIOS = ('login', 'index-nasa')
+
+
+class Command(BaseCommand):
+    """Load test logging in and the index page with each session engine"""
+
+    help = ("Run the login and NASA admin index scenarios of loadtest in process with "
+            "each session engine of SESSION_ENGINES, and report requests per second, "
+            "p50 and p95 latency and queries per request. Log in as the users created "
+            "by seed_missions --password, or pass --nasa-user. The user cache is used "
+            "when MISSIONS_USER_CACHE_TIMEOUT is above 0, as it is by default with "
+            "MISSIONS_SESSION_CACHE=redis; login rate limits are turned off.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', action='append', dest='engines',
+                            choices=list(settings.SESSION_ENGINES),
+                            help="Session engine to benchmark; repeat for several. "
+                                 "Defaults to all")
+        parser.add_argument('--iterations', type=int, default=100,
+                            help="Times each scenario is run")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--host', default='localhost',
+                            help="Host header to send; must be in ALLOWED_HOSTS")
+        parser.add_argument('--password', default='password',
+                            help="Password of the user logged in")
+        parser.add_argument('--nasa-user', help="NASA admin to log in as")
+
+    def handle(self, *args, **options):
+        users = find_users(nasa_admin=options['nasa_user'])
+
+        if users[NASA_ADMIN] is None:
+            raise CommandError("No NASA admin to log in as; seed one with seed_missions "
+                               "--password or pass --nasa-user")
+
+        context = {'users': users, 'password': options['password'],
+                   **find_targets(users[ISS_ADMIN])}
+        iterations = max(1, options['iterations'])
+        concurrency = max(1, options['concurrency'])
+
+        self.stdout.write(f"{iterations} iterations per scenario, concurrency {concurrency}, "
+                          f"as {users[NASA_ADMIN]}\n")
+        self.stdout.write(f"{'engine':<16}{'scenario':<12}{'req/s':>10}{'p50 ms':>10}"
+                          f"{'p95 ms':>10}{'queries':>9}{'errors':>8}")
+
+        for engine in options['engines'] or list(settings.SESSION_ENGINES):
+            # Start every engine from cold caches
+            caches['default'].clear()
+            caches[settings.SESSION_CACHE_ALIAS].clear()
+
+            with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[engine],
+                                   **UNLIMITED_LOGINS):
+                for name in SCENARIOS:
+                    try:
+                        summary = run_scenario(
+                            name, lambda: InProcessSession(options['host']), context,
+                            iterations, concurrency)
+                    except LoadTestError as error:
+                        raise CommandError(f"{engine} {name}: {error}") from error
+
+                    self.stdout.write(f"{engine:<16}{name:<12}{summary['throughput']:>10.1f}"
+                                      f"{summary['p50']:>10.1f}{summary['p95']:>10.1f}"
+                                      f"{summary['queries']:>9.1f}{summary['errors']:>8}")
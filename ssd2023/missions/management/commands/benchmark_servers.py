@@ -0,0 +1,211 @@
+"""Compare the throughput and tail latency of the missions pages served over WSGI and ASGI"""
+import asyncio
+import statistics
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from missions.models import Mission, MissionReport
+
+# Handler and URL configuration of each stack
+STACKS = {
+    'wsgi': (WSGIHandler, 'missions.urls'),
+    'asgi-sync': (ASGIHandler, 'missions.urls'),
+    'asgi-async': (ASGIHandler, 'missions.async_urls'),
+}
+
+
+def default_paths():
+    """The index page and the first mission and report pages"""
+    mission = Mission.objects.order_by('pk').values_list('pk', flat=True).first()
+    report = MissionReport.objects.order_by('pk').values_list('pk', flat=True).first()
+
+    if mission is None or report is None:
+        raise CommandError("No missions to request; seed some with benchmark_indexes --seed")
+
+    return ['/', f"/mission/{mission}", f"/mission-report/{report}"]
+
+
+def wsgi_request(handler, host, path, cookie):
+    """Send a GET request through a WSGI handler and return its status and latency"""
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '443',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'https',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+
+    started = time.perf_counter()
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+
+    return int(statuses[0].split()[0]), time.perf_counter() - started
+
+
+async def asgi_request(handler, host, path, cookie):
+    """Send a GET request through an ASGI handler and return its status and latency"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'https',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (host, 443),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    statuses = []
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    started = time.perf_counter()
+    await handler(scope, receive, send)
+
+    return statuses[0], time.perf_counter() - started
+
+
+def run_wsgi(handler, paths, requests, concurrency, *, host, cookie):
+    """Send requests from a pool of threads, as a threaded WSGI server would"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(
+            lambda number: wsgi_request(handler, host, paths[number % len(paths)], cookie),
+            range(requests)))
+
+
+async def run_asgi(handler, paths, requests, concurrency, *, host, cookie):
+    """Send requests as concurrent tasks on one event loop, as an ASGI server would"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(number):
+        async with semaphore:
+            return await asgi_request(handler, host, paths[number % len(paths)], cookie)
+
+    return await asyncio.gather(*(send(number) for number in range(requests)))
+
+
+def benchmark(stack, paths, requests, concurrency, *, host, cookie):
+    """Warm a stack up with a request per path, then load it; returns the summary of the load"""
+    handler_class, urlconf = STACKS[stack]
+
+    with override_settings(ROOT_URLCONF=urlconf):
+        handler = handler_class()
+
+        if handler_class is WSGIHandler:
+            run_wsgi(handler, paths, len(paths), 1, host=host, cookie=cookie)
+            started = time.perf_counter()
+            results = run_wsgi(handler, paths, requests, concurrency, host=host, cookie=cookie)
+        else:
+            asyncio.run(run_asgi(handler, paths, len(paths), 1, host=host, cookie=cookie))
+            started = time.perf_counter()
+            results = asyncio.run(
+                run_asgi(handler, paths, requests, concurrency, host=host, cookie=cookie))
+
+        return summarise(results, time.perf_counter() - started)
+
+
+def session_cookie(username=None):
+    """Cookie header of a session logged in as the user, or the first superuser"""
+    users = User.objects.filter(is_active=True)
+    user = (users.filter(username=username).first() if username
+            else users.filter(is_superuser=True).order_by('pk').first())
+
+    if user is None:
+        raise CommandError("No user to log in as; pass --username")
+
+    client = Client()
+    client.force_login(user)
+    session = client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    return user, f"{settings.SESSION_COOKIE_NAME}={session}"
+
+
+def summarise(results, elapsed):
+    """Throughput and latency percentiles in milliseconds"""
+    timings = [latency * 1000 for _, latency in results]
+    percentiles = (statistics.quantiles(timings, n=100, method='inclusive')
+                   if len(timings) > 1 else timings * 99)
+
+    return {
+        'errors': sum(1 for status, _ in results if not 200 <= status < 300 and status != 304),
+        'throughput': len(results) / elapsed,
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        'p99': percentiles[98],
+        'max': max(timings),
+    }
+
+
+class Command(BaseCommand):
+    """Load test the missions pages through the WSGI and ASGI handlers"""
+
+    help = ("Send concurrent GET requests for the index, mission and report pages as a "
+            "logged in user through Django's WSGI handler with the sync views and its "
+            "ASGI handler with the sync and the async views, and report throughput and "
+            "p50, p95 and p99 latency of each.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username',
+                            help="User to request pages as; defaults to the first superuser")
+        parser.add_argument('--host', default='localhost',
+                            help="Host header to send; must be in ALLOWED_HOSTS")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Path to request; repeat for several. Defaults to the "
+                                 "index page and the first mission and report")
+        parser.add_argument('--stack', action='append', dest='stacks', choices=list(STACKS),
+                            help="Stack to benchmark; repeat for several. Defaults to all")
+
+    def handle(self, *args, **options):
+        user, cookie = session_cookie(options['username'])
+        paths = options['paths'] or default_paths()
+        requests = max(1, options['requests'])
+        concurrency = max(1, options['concurrency'])
+
+        self.stdout.write(f"{requests} requests, concurrency {concurrency}, as {user.username}: "
+                          f"{', '.join(paths)}\n")
+        self.stdout.write(f"{'stack':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+
+        for name in options['stacks'] or list(STACKS):
+            summary = benchmark(name, paths, requests, concurrency, host=options['host'],
+                                cookie=cookie)
+
+            self.stdout.write(f"{name:<12}{summary['throughput']:>10.1f}{summary['p50']:>10.1f}"
+                              f"{summary['p95']:>10.1f}{summary['p99']:>10.1f}"
+                              f"{summary['max']:>10.1f}{summary['errors']:>8}")
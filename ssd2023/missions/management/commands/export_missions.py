@@ -0,0 +1,37 @@
+"""Export divisions, employees, missions or reports as CSV or NDJSON"""
+from django.core.management.base import BaseCommand
+
+from missions.transfer import (DATASETS, DEFAULT_BATCH_SIZE, FORMATS, export_rows, get_columns,
+                               render)
+
+
+class Command(BaseCommand):
+    """Stream a dataset to a file or standard output"""
+
+    help = ("Export a missions dataset as CSV or newline-delimited JSON. Rows are "
+            "streamed in chunks, so memory use does not grow with the table size.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=DATASETS)
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', help="File to write to (default: standard output)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows fetched from the database per round trip")
+        parser.add_argument('--include-ssn', action='store_true',
+                            help="Decrypt and export employee social security numbers")
+
+    def handle(self, *args, **options):
+        dataset = options['dataset']
+        columns = get_columns(dataset, options['include_ssn'])
+        rows = export_rows(dataset, include_ssn=options['include_ssn'],
+                           chunk_size=options['batch_size'])
+
+        lines = render(rows, columns, options['format'])
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            output.writelines(lines)
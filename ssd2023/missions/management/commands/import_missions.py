@@ -0,0 +1,40 @@
+"""Import divisions, employees, missions or reports from CSV or NDJSON"""
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from missions.transfer import (DATASETS, DEFAULT_BATCH_SIZE, FORMATS, TransferError,
+                               import_rows, read_rows)
+
+
+class Command(BaseCommand):
+    """Load a dataset written by export_missions"""
+
+    help = ("Import a missions dataset written by export_missions with batched bulk "
+            "inserts. Import divisions, employees, missions and then reports so that "
+            "foreign keys resolve.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=DATASETS)
+        parser.add_argument('input', nargs='?', help="File to read (default: standard input)")
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows inserted per transaction")
+        parser.add_argument('--ignore-conflicts', action='store_true',
+                            help="Skip rows whose primary key already exists")
+
+    def handle(self, *args, **options):
+        stream = (open(options['input'], encoding='utf-8', newline='')  # pylint: disable=consider-using-with
+                  if options['input'] else sys.stdin)
+
+        try:
+            count = import_rows(options['dataset'], read_rows(stream, options['format']),
+                                batch_size=options['batch_size'],
+                                ignore_conflicts=options['ignore_conflicts'])
+        except TransferError as error:
+            raise CommandError(str(error)) from error
+        finally:
+            if options['input']:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {count} {options['dataset']}"))
@@ -0,0 +1,122 @@
+"""Run the scripted load test scenarios and report throughput, latency and queries"""
+import json
+
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from missions.loadtest import (ISS_ADMIN, NASA_ADMIN, SCENARIOS, SUPERUSER, UNLIMITED_LOGINS,
+                               HttpSession, InProcessSession, LoadTestError, find_targets,
+                               find_users, run_scenario)
+
+# Scenarios that need a mission, or a mission and an assignee, to request
+TARGETS = {
+    'mission-details': ('missions',),
+    'report-generation': ('missions', 'assignees'),
+}
+
+
+class Command(BaseCommand):
+    """Load test the login, index, mission and report generation pages"""
+
+    help = ("Run scripted scenarios from concurrent sessions, in process or against a "
+            "running server given by --url, and report requests per second, p50, p95 "
+            "and p99 latency and queries per request for each. Over HTTP, queries are "
+            "read from the Server-Timing header of a server run with "
+            "MISSIONS_SERVER_TIMING=1, and the server's login rate limits apply; in "
+            "process they are turned off. By default the users created by "
+            "seed_missions --password are logged in. The report-generation scenario "
+            "queues report jobs, so run it against a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help="Base URL of a running server, e.g. http://localhost:8000; "
+                                 "by default requests are sent in process")
+        parser.add_argument('--host', default='localhost',
+                            help="Host header of in process requests; must be in ALLOWED_HOSTS")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=list(SCENARIOS),
+                            help="Scenario to run; repeat for several. Defaults to all")
+        parser.add_argument('--iterations', type=int, default=200,
+                            help="Times each scenario is run")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--password', default='password',
+                            help="Password of the users logged in")
+        parser.add_argument('--superuser', help="Superuser to log in as")
+        parser.add_argument('--iss-user', help="ISS admin to log in as")
+        parser.add_argument('--nasa-user', help="NASA admin to log in as")
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--json', dest='output',
+                            help="Also write the results to this file as JSON")
+
+    def handle(self, *args, **options):
+        users = find_users(options['superuser'], options['iss_user'], options['nasa_user'])
+        context = {
+            'users': users,
+            'password': options['password'],
+            **find_targets(users[ISS_ADMIN]),
+        }
+        iterations = max(1, options['iterations'])
+        concurrency = max(1, options['concurrency'])
+
+        if options['url']:
+            def make_session():
+                return HttpSession(options['url'])
+        else:
+            def make_session():
+                return InProcessSession(options['host'])
+
+        self.stdout.write(f"{iterations} iterations per scenario, concurrency {concurrency}, "
+                          f"{options['url'] or 'in process'}\n")
+        self.stdout.write(f"{'scenario':<20}{'requests':>10}{'req/s':>10}{'p50 ms':>10}"
+                          f"{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'queries':>9}"
+                          f"{'errors':>8}")
+
+        results = {}
+
+        for name in options['scenarios'] or list(SCENARIOS):
+            missing = self.missing(name, context)
+
+            if missing:
+                self.stdout.write(f"{name:<20}skipped: no {missing}")
+                continue
+
+            try:
+                with nullcontext() if options['url'] else override_settings(**UNLIMITED_LOGINS):
+                    summary = run_scenario(name, make_session, context, iterations,
+                                           concurrency, options['random_seed'])
+            except LoadTestError as error:
+                raise CommandError(f"{name}: {error}") from error
+
+            results[name] = summary
+            queries = '-' if summary['queries'] is None else f"{summary['queries']:.1f}"
+            self.stdout.write(f"{name:<20}{summary['requests']:>10}"
+                              f"{summary['throughput']:>10.1f}{summary['p50']:>10.1f}"
+                              f"{summary['p95']:>10.1f}{summary['p99']:>10.1f}"
+                              f"{summary['max']:>10.1f}{queries:>9}{summary['errors']:>8}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump({
+                    'url': options['url'],
+                    'iterations': iterations,
+                    'concurrency': concurrency,
+                    'scenarios': results,
+                }, output, indent=2)
+
+    @staticmethod
+    def missing(name, context):
+        """What a scenario needs that the database does not have, if anything"""
+        role, _ = SCENARIOS[name]
+        role = NASA_ADMIN if role is None else role
+
+        if context['users'][role] is None:
+            return {SUPERUSER: 'superuser', ISS_ADMIN: 'ISS admin',
+                    NASA_ADMIN: 'NASA admin'}[role] + " to log in as"
+
+        for target in TARGETS.get(name, ()):
+            if not context[target]:
+                return target
+
+        return None
@@ -0,0 +1,40 @@
+"""Print grouped statistics over every mission and report as JSON"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from missions.roles import UserRoles
+from missions.stats import (DEFAULT_LIMIT, DEFAULT_WEEKS, MAX_LIMIT, MAX_WEEKS, STATISTICS,
+                            get_statistic)
+
+
+class Command(BaseCommand):
+    """Compute the statistics of the stats endpoint as a superuser sees them"""
+
+    help = ("Print the statistics served at /stats over all missions and reports as JSON, "
+            "from the statistics cache when they are there. With --refresh they are "
+            "recomputed and stored, e.g. from cron to keep a shared cache warm.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stat', action='append', dest='stats', choices=list(STATISTICS),
+                            help="Statistic to compute; repeat for several. Defaults to all")
+        parser.add_argument('--weeks', type=int, default=DEFAULT_WEEKS,
+                            help="Weeks of reports-per-week, up to the current one")
+        parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT,
+                            help="Rows of reports-per-mission and reports-per-assignee")
+        parser.add_argument('--refresh', action='store_true',
+                            help="Recompute the statistics instead of reading the cache")
+        parser.add_argument('--indent', type=int, default=2)
+
+    def handle(self, *args, **options):
+        roles = UserRoles(is_superuser=True)
+        weeks = max(1, min(options['weeks'], MAX_WEEKS))
+        limit = max(1, min(options['limit'], MAX_LIMIT))
+
+        statistics = {
+            name: get_statistic(name, roles, weeks=weeks, limit=limit,
+                                refresh=options['refresh'])
+            for name in options['stats'] or list(STATISTICS)
+        }
+
+        self.stdout.write(json.dumps(statistics, indent=options['indent'] or None))
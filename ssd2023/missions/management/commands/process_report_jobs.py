@@ -0,0 +1,54 @@
+"""Run the worker generating queued mission reports"""
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from missions.jobs import work
+
+
+class Command(BaseCommand):
+    """Generate the reports queued by the generate view"""
+
+    help = ("Claim queued report generation jobs and generate their reports, with "
+            "--concurrency jobs at a time, until interrupted or, with --once, until no "
+            "job is due. Failed jobs are retried with exponential backoff up to "
+            "MISSIONS_REPORT_JOB_MAX_ATTEMPTS times. Several workers may run at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Jobs run at the same time, each in its own thread")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait for a job when none is due")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no job is due instead of waiting for more")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        concurrency = max(1, options['concurrency'])
+
+        def run_worker(_):
+            try:
+                return work(options['once'], options['poll_interval'], stop)
+            finally:
+                connections.close_all()
+
+        try:
+            if concurrency == 1:
+                # In this thread, so that the jobs share its connection and transaction
+                count = work(options['once'], options['poll_interval'], stop)
+            else:
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    try:
+                        count = sum(executor.map(run_worker, range(concurrency)))
+                    except KeyboardInterrupt:
+                        # Let the threads finish their jobs before the pool waits for them
+                        stop.set()
+                        raise
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"Ran {count} report jobs"))
@@ -0,0 +1,53 @@
+"""Rank the statements recorded by query profiling"""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from missions.models import QueryFingerprint
+from missions.profiling import stats
+
+ORDERINGS = {
+    'total': F('total_time').desc(),
+    'count': F('count').desc(),
+    'max': F('max_time').desc(),
+    'mean': (F('total_time') / F('count')).desc(),
+}
+
+
+class Command(BaseCommand):
+    """Report the statements that take the most database time, and the views running them"""
+
+    help = ("List the normalised SQL statements recorded with MISSIONS_QUERY_PROFILING=1, "
+            "with the view that ran them, their count and their total, mean and slowest "
+            "time, ranked by total time by default.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--order-by', choices=list(ORDERINGS), default='total')
+        parser.add_argument('--view', help="Only statements run by this view, e.g. "
+                                           "missions.views.index")
+        parser.add_argument('--full', action='store_true',
+                            help="Print whole statements instead of their first line")
+        parser.add_argument('--reset', action='store_true',
+                            help="Delete the recorded statements after reporting them")
+
+    def handle(self, *args, **options):
+        # Timings gathered by this process, e.g. when called from a test or shell
+        stats.flush(force=True)
+
+        fingerprints = QueryFingerprint.objects.order_by(ORDERINGS[options['order_by']], 'pk')
+
+        if options['view']:
+            fingerprints = fingerprints.filter(view=options['view'])
+
+        self.stdout.write(f"{'#':>3} {'total ms':>10} {'count':>8} {'mean ms':>9} "
+                          f"{'max ms':>9}  view / statement")
+
+        for rank, row in enumerate(fingerprints[:max(1, options['limit'])], start=1):
+            sql = row.sql if options['full'] else row.sql[:120]
+            self.stdout.write(f"{rank:>3} {row.total_time * 1000:>10.1f} {row.count:>8} "
+                              f"{row.total_time * 1000 / row.count:>9.2f} "
+                              f"{row.max_time * 1000:>9.2f}  {row.view}")
+            self.stdout.write(f"    [{row.fingerprint}] {sql}")
+
+        if options['reset']:
+            QueryFingerprint.objects.all().delete()
@@ -0,0 +1,22 @@
+"""Rebuild the materialised index pages of employees"""
+from django.core.management.base import BaseCommand
+
+from missions.dashboards import rebuild
+
+
+class Command(BaseCommand):
+    """Recompute every employee's dashboard, or those of the given employees"""
+
+    help = ("Rebuild the dashboards the index page is served from, e.g. after rows were "
+            "written without sending signals or MISSIONS_PAGE_SIZE was raised.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employee', type=int, action='append', dest='employees',
+                            help="Primary key of an employee to rebuild; repeat for several. "
+                                 "Defaults to all")
+        parser.add_argument('--database', default=None)
+
+    def handle(self, *args, **options):
+        count = rebuild(options['employees'], using=options['database'])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} dashboards"))
@@ -0,0 +1,21 @@
+"""Rebuild the full-text search index"""
+from django.core.management.base import BaseCommand
+
+from missions.search import get_backend
+
+
+class Command(BaseCommand):
+    """Reindex every mission and report"""
+
+    help = ("Rebuild the full-text index over missions and reports, e.g. after rows were "
+            "written without sending signals. The Postgres index needs no rebuild.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=None)
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['database'])
+        backend.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt search index with {type(backend).__name__}"))
@@ -0,0 +1,32 @@
+"""Insert synthetic divisions, employees, missions and reports"""
+from django.core.management.base import BaseCommand
+
+from missions.seeding import DEFAULT_BATCH_SIZE, SEED_SUPERUSER, seed
+
+
+class Command(BaseCommand):
+    """Seed a scratch database for load tests and benchmarks"""
+
+    help = ("Insert configurable numbers of synthetic divisions, employees, missions and "
+            "reports with bulk inserts. The same --random-seed gives the same data. With "
+            "--password, the seeded users and a '" + SEED_SUPERUSER + "' superuser can "
+            "log in, as the loadtest command does.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--divisions', type=int, default=10)
+        parser.add_argument('--employees', type=int, default=1000)
+        parser.add_argument('--missions', type=int, default=10000)
+        parser.add_argument('--reports', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--password',
+                            help="Password of the seeded users; without it they cannot log in")
+
+    def handle(self, *args, **options):
+        counts = seed(divisions=options['divisions'], employees=options['employees'],
+                      missions=options['missions'], reports=options['reports'],
+                      batch_size=options['batch_size'], random_seed=options['random_seed'],
+                      password=options['password'], log=self.stdout.write)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded " + ", ".join(f"{count} {name}" for name, count in counts.items())))
@@ -0,0 +1,242 @@
+"""
+Per-request performance metrics: wall time, database queries and time, template
+render time and response size, aggregated into Prometheus histograms.
+
+Only sampled requests are measured. For the others the query wrapper and
+template backend see no current request and add nothing but a lookup.
+"""
+import threading
+import time
+
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+DEFAULT_SAMPLE_RATE = 1.0
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+# Metrics of the request being handled, if it is sampled
+_current = ContextVar('missions_request_metrics', default=None)
+
+
+def get_sample_rate():
+    """Fraction of requests to measure, between 0 and 1"""
+    return getattr(settings, 'MISSIONS_METRICS_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+
+class RequestMetrics:
+    """Measurements of a single request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+
+    def add_query(self, duration):
+        """Count a query and the seconds it took"""
+        self.queries += 1
+        self.query_time += duration
+
+    def add_template(self, duration):
+        """Add the seconds a template took to render"""
+        self.template_time += duration
+
+
+def timed_call(function, args, record):
+    """Call function(*args), passing the seconds it took to record() even if it raises"""
+    started = time.perf_counter()
+
+    try:
+        return function(*args)
+    finally:
+        record(time.perf_counter() - started)
+
+
+def current():
+    """Metrics of the request being handled, or None if it is not sampled"""
+    return _current.get()
+
+
+def start():
+    """Begin measuring a request, returning a token to pass to stop()"""
+    return _current.set(RequestMetrics())
+
+
+def stop(token):
+    """Finish measuring a request and return its metrics"""
+    metrics = _current.get()
+    metrics.duration = time.perf_counter() - metrics.started
+    _current.reset(token)
+
+    return metrics
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query's time to the current request"""
+    metrics = _current.get()
+
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    return timed_call(execute, (sql, params, many, context), metrics.add_query)
+
+
+class TimedTemplate:
+    """Template that adds its render time to the current request"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        """Render the wrapped template, timing it when the request is sampled"""
+        metrics = _current.get()
+
+        if metrics is None:
+            return self.template.render(context, request)
+
+        return timed_call(self.template.render, (context, request), metrics.add_template)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend whose templates report their render time"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """{name="value",...} from (name, value) pairs"""
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+class Histogram:
+    """Cumulative histogram of observations, per label value"""
+
+    def __init__(self, name, description, buckets, label='view'):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+
+    def observe(self, label_value, value):
+        """Count an observation; the caller holds the registry lock"""
+        series = self.series.setdefault(label_value, [[0] * len(self.buckets), 0, 0])
+
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][number] += 1
+
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        """Lines of the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+
+        for label_value, (counts, total, count) in sorted(self.series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = format_labels([(self.label, label_value), ('le', bound)])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+
+            labels = format_labels([(self.label, label_value), ('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels([(self.label, label_value)])
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+class Counter:
+    """Running total per label value"""
+
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.series = {}
+
+    def inc(self, label_value, amount=1):
+        """Add to a total; the caller holds the registry lock"""
+        self.series[label_value] = self.series.get(label_value, 0) + amount
+
+    def render(self):
+        """Lines of the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+
+        for label_value, total in sorted(self.series.items()):
+            lines.append(f"{self.name}{format_labels([(self.label, label_value)])} {total}")
+
+        return lines
+
+
+class Registry:
+    """The histograms and counters of this process, updated from any thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = []
+        self.counters = {}
+        self.reset()
+
+    def reset(self):
+        """Start again from empty histograms"""
+        self.histograms = [
+            Histogram('missions_request_duration_seconds',
+                      "Wall time of sampled requests", DURATION_BUCKETS),
+            Histogram('missions_request_db_queries',
+                      "Database queries run by sampled requests", QUERY_BUCKETS),
+            Histogram('missions_request_db_duration_seconds',
+                      "Time sampled requests spent in database queries", DURATION_BUCKETS),
+            Histogram('missions_request_template_duration_seconds',
+                      "Time sampled requests spent rendering templates", DURATION_BUCKETS),
+            Histogram('missions_response_size_bytes',
+                      "Body size of sampled non-streaming responses", SIZE_BUCKETS),
+        ]
+        self.counters = {
+            'login_attempts': Counter('missions_login_attempts_total',
+                                      "Login attempts by outcome; rate limited ones are "
+                                      "rejected before the password is hashed", 'outcome'),
+        }
+
+    def observe(self, view, metrics, size):
+        """Add a request's metrics to the histograms"""
+        values = [metrics.duration, metrics.queries, metrics.query_time,
+                  metrics.template_time, size]
+
+        with self.lock:
+            for histogram, value in zip(self.histograms, values):
+                if value is not None:
+                    histogram.observe(view, value)
+
+    def count(self, counter, label_value, amount=1):
+        """Add to one of the counters, e.g. count('login_attempts', 'failed')"""
+        with self.lock:
+            self.counters[counter].inc(label_value, amount)
+
+    def render(self):
+        """The histograms and counters in the Prometheus text exposition format"""
+        with self.lock:
+            return '\n'.join(line for metric in [*self.histograms, *self.counters.values()]
+                             for line in metric.render()) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,79 @@
+"""Middleware for the Missions App"""
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+
+logger = logging.getLogger("ssd2023.performance")
+
+
+def view_name(request):
+    """Dotted path of the view that handled a request"""
+    match = getattr(request, 'resolver_match', None)
+
+    return match.view_name if match is not None else 'unresolved'
+
+
+def finish(request, response, request_metrics):
+    """Log, record and add a Server-Timing header for a measured request"""
+    view = view_name(request)
+    size = None if response.streaming else len(response.content)
+
+    metrics.registry.observe(view, request_metrics, size)
+
+    logger.info(
+        "view=%s method=%s status=%s duration_ms=%.1f db_queries=%d db_ms=%.1f "
+        "template_ms=%.1f bytes=%s", view, request.method, response.status_code,
+        request_metrics.duration * 1000, request_metrics.queries,
+        request_metrics.query_time * 1000, request_metrics.template_time * 1000,
+        '-' if size is None else size)
+
+    if getattr(settings, 'MISSIONS_SERVER_TIMING', False):
+        response['Server-Timing'] = (
+            f"total;dur={request_metrics.duration * 1000:.2f}, "
+            f"db;dur={request_metrics.query_time * 1000:.2f};"
+            f"desc=\"{request_metrics.queries} queries\", "
+            f"template;dur={request_metrics.template_time * 1000:.2f}")
+
+    return response
+
+
+@sync_and_async_middleware
+def performance_middleware(get_response):
+    """
+    Measure a sample of requests: wall time, database queries and time, template
+    render time and response size, logged, aggregated for the metrics endpoint
+    and, if MISSIONS_SERVER_TIMING is on, sent as Server-Timing.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if random.random() >= metrics.get_sample_rate():  # nosec - sampling, not security
+                return await get_response(request)
+
+            token = metrics.start()
+
+            try:
+                response = await get_response(request)
+            finally:
+                request_metrics = metrics.stop(token)
+
+            return finish(request, response, request_metrics)
+    else:
+        def middleware(request):
+            if random.random() >= metrics.get_sample_rate():  # nosec - sampling, not security
+                return get_response(request)
+
+            token = metrics.start()
+
+            try:
+                response = get_response(request)
+            finally:
+                request_metrics = metrics.stop(token)
+
+            return finish(request, response, request_metrics)
+
+    return middleware
@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mission',
+            index=models.Index(fields=['supervisor', 'id'], name='mission_supervisor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='missionreport',
+            index=models.Index(fields=['assigned_to', 'publish_date', 'id'], name='report_assignee_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='missionreport',
+            index=models.Index(fields=['mission', 'publish_date', 'id'], name='report_mission_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='missionreport',
+            index=models.Index(fields=['publish_date', 'id'], name='report_published_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+def number_existing_reports(apps, schema_editor):
+    """Number each mission's reports in publication order and record the count"""
+    # pylint: disable=invalid-name
+    Mission = apps.get_model('missions', 'Mission')
+    MissionReport = apps.get_model('missions', 'MissionReport')
+    db_alias = schema_editor.connection.alias
+
+    for mission in Mission.objects.using(db_alias).iterator():
+        reports = list(MissionReport.objects.using(db_alias)
+                       .filter(mission=mission).order_by('publish_date', 'pk'))
+
+        for sequence, report in enumerate(reports, start=1):
+            report.sequence = sequence
+
+        MissionReport.objects.using(db_alias).bulk_update(reports, ['sequence'])
+        Mission.objects.using(db_alias).filter(pk=mission.pk).update(
+            report_sequence=len(reports))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0002_report_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mission',
+            name='report_sequence',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of reports issued'),
+        ),
+        migrations.AddField(
+            model_name='missionreport',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Report number'),
+        ),
+        migrations.RunPython(number_existing_reports, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='missionreport',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False, verbose_name='Report number'),
+        ),
+        migrations.AddConstraint(
+            model_name='missionreport',
+            constraint=models.UniqueConstraint(fields=('mission', 'sequence'), name='report_mission_sequence_unique'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2 on 2026-10-18 12:40
+
+from django.db import DatabaseError, migrations
+
+SEARCH_TABLE = 'missions_search'
+
+
+def has_fts5(connection):
+    """Whether the SQLite library was built with the FTS5 extension"""
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            return bool(cursor.fetchone()[0])
+        except DatabaseError:
+            return False
+
+
+def search_indexes(apps):
+    """GIN indexes over the same weighted vectors the Postgres search backend queries"""
+    from django.contrib.postgres.indexes import GinIndex  # pylint: disable=import-outside-toplevel
+    from django.contrib.postgres.search import SearchVector  # pylint: disable=import-outside-toplevel
+
+    return [
+        (apps.get_model('missions', 'Mission'), GinIndex(
+            SearchVector('name', weight='A', config='english') +
+            SearchVector('description', weight='B', config='english'),
+            name='mission_search_idx')),
+        (apps.get_model('missions', 'MissionReport'), GinIndex(
+            SearchVector('title', weight='A', config='english') +
+            SearchVector('summary', weight='B', config='english'),
+            name='report_search_idx')),
+    ]
+
+
+def create_sqlite_search_table(schema_editor):
+    """Create the FTS5 table of this migration, with documents keyed by kind and object_id"""
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        "kind UNINDEXED, object_id UNINDEXED, title, body)")
+    schema_editor.execute(
+        f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) "
+        "SELECT 'mission', id, name, COALESCE(description, '') FROM missions_mission")
+    schema_editor.execute(
+        f"INSERT INTO {SEARCH_TABLE} (kind, object_id, title, body) "
+        "SELECT 'report', id, title, summary FROM missions_missionreport")
+
+
+def create_search_index(apps, schema_editor):
+    """Create and populate the full-text index for the database in use"""
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite' and has_fts5(connection):
+        create_sqlite_search_table(schema_editor)
+    elif connection.vendor == 'postgresql':
+        for model, index in search_indexes(apps):
+            schema_editor.add_index(model, index)
+
+
+def drop_search_index(apps, schema_editor):
+    """Remove the full-text index"""
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite' and has_fts5(connection):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    elif connection.vendor == 'postgresql':
+        for model, index in search_indexes(apps):
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0003_report_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0004_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mission',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Last modified'),
+        ),
+        migrations.AddField(
+            model_name='missionreport',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Last modified'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 12:55
+
+from django.db import migrations
+import missions.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='employee',
+            name='social_security_number',
+            field=missions.fields.LazyEncryptedCharField(blank=True, max_length=9),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0006_lazy_ssn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=16)),
+                ('view', models.CharField(max_length=255)),
+                ('sql', models.TextField(verbose_name='Normalised SQL')),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('total_time', models.FloatField(default=0, verbose_name='Total seconds')),
+                ('max_time', models.FloatField(default=0, verbose_name='Slowest seconds')),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='queryfingerprint',
+            constraint=models.UniqueConstraint(fields=('fingerprint', 'view'), name='query_fingerprint_view_unique'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 13:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0008_report_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dashboard',
+            fields=[
+                ('employee', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='missions.employee')),
+                ('mission_count', models.PositiveIntegerField(default=0, verbose_name='Missions supervised')),
+                ('supervised_report_count', models.PositiveIntegerField(default=0, verbose_name='Reports on missions supervised')),
+                ('assigned_report_count', models.PositiveIntegerField(default=0, verbose_name='Reports assigned')),
+                ('missions', models.JSONField(default=list, verbose_name='First missions supervised')),
+                ('supervised_reports', models.JSONField(default=list, verbose_name='Latest reports on missions supervised')),
+                ('assigned_reports', models.JSONField(default=list, verbose_name='Latest reports assigned')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Last rebuilt')),
+            ],
+        ),
+    ]
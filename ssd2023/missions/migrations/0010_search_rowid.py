@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 16:05
+
+from importlib import import_module
+
+from django.db import migrations
+
+# The table this migration replaces, and restores on the way back
+search_0004 = import_module('missions.migrations.0004_search')
+
+SEARCH_TABLE = search_0004.SEARCH_TABLE
+
+
+def has_search_table(connection):
+    """Whether migration 0004 created the SQLite full-text index"""
+    return (connection.vendor == 'sqlite' and
+            SEARCH_TABLE in connection.introspection.table_names())
+
+
+def key_documents_by_rowid(apps, schema_editor):  # pylint: disable=unused-argument
+    """
+    Rebuild the full-text index with each document's rowid derived from its
+    object, primary key times two plus 0 for missions and 1 for reports, so
+    that documents are replaced and removed by rowid rather than by scanning
+    unindexed kind and object_id columns
+    """
+    if not has_search_table(schema_editor.connection):
+        return
+
+    schema_editor.execute(f"DROP TABLE {SEARCH_TABLE}")
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(title, body)")
+    schema_editor.execute(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) "
+        "SELECT id * 2, name, COALESCE(description, '') FROM missions_mission")
+    schema_editor.execute(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) "
+        "SELECT id * 2 + 1, title, summary FROM missions_missionreport")
+
+
+def key_documents_by_object(apps, schema_editor):  # pylint: disable=unused-argument
+    """Rebuild the full-text index with the kind and object_id columns of migration 0004"""
+    if not has_search_table(schema_editor.connection):
+        return
+
+    schema_editor.execute(f"DROP TABLE {SEARCH_TABLE}")
+    search_0004.create_sqlite_search_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('missions', '0009_dashboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_documents_by_rowid, key_documents_by_object),
+    ]
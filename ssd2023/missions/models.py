@@ -1,8 +1,10 @@
 """Database and Class Models for the App"""
-from django.db import models
+from django.db import models, router, transaction
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from django_cryptography.fields import encrypt
+from django.utils import timezone
+
+from .fields import LazyEncryptedCharField
 
 DEFAULT_NAME_LENGTH = 1024
 DEFAULT_DESCRIPTION_LENGTH = 4096
@@ -36,14 +38,75 @@ class Employee(models.Model):
     division = models.ForeignKey(Division, null=True, on_delete=models.SET_NULL)
     address = models.CharField(blank=True, max_length=100)
     phone_number = models.CharField(blank=True, max_length=14)
-    social_security_number = encrypt(models.CharField(blank=True, max_length=9))
+    social_security_number = LazyEncryptedCharField(blank=True, max_length=9)
     security_clearance = models.IntegerField(choices=SecurityClearance.choices)
 
     def __str__(self):
-        if self.user.first_name and self.user.last_name:
-            return self.user.first_name + " " + self.user.last_name
+        return self.label(self.user.first_name, self.user.last_name, self.user.username)
+
+    @staticmethod
+    def label(first_name, last_name, username):
+        """Display name from the user's names, falling back to the username"""
+        if first_name and last_name:
+            return first_name + " " + last_name
+
+        return username
+
+
+# Members of the ISS admin group see every mission and report within their
+# clearance; other employees only those they supervise or are assigned
+ISS_ADMIN_GROUP = 'ISS_Admin_User'
+NASA_ADMIN_GROUP = 'NASA_Admin_User'
+
+
+class MissionQuerySet(models.QuerySet):
+    """Missions filtered by what a user may see"""
+
+    def visible_to(self, roles):
+        """
+        Missions that the holder of the given roles may see, as one SQL predicate.
+
+        Superusers see every mission. Employees see missions at or below their
+        clearance: all of them if they are ISS admins, otherwise those they supervise.
+        """
+        if roles.is_superuser:
+            return self.all()
+
+        if roles.employee_id is None or roles.security_clearance is None:
+            return self.none()
+
+        scope = models.Q()
+
+        if ISS_ADMIN_GROUP not in roles.groups:
+            scope = models.Q(supervisor=roles.employee_id)
+
+        return self.filter(scope, security_clearance__lte=roles.security_clearance)
+
+
+class MissionReportQuerySet(models.QuerySet):
+    """Mission reports filtered by what a user may see"""
 
-        return self.user.username
+    def visible_to(self, roles):
+        """
+        Reports that the holder of the given roles may see, as one SQL predicate.
+
+        Superusers see every report. Employees see reports of missions at or
+        below their clearance: all of them if they are ISS admins, otherwise
+        those assigned to them or of missions they supervise.
+        """
+        if roles.is_superuser:
+            return self.all()
+
+        if roles.employee_id is None or roles.security_clearance is None:
+            return self.none()
+
+        scope = models.Q()
+
+        if ISS_ADMIN_GROUP not in roles.groups:
+            scope = (models.Q(assigned_to=roles.employee_id) |
+                     models.Q(mission__supervisor=roles.employee_id))
+
+        return self.filter(scope, mission__security_clearance__lte=roles.security_clearance)
 
 
 class Mission(models.Model):
@@ -57,6 +120,17 @@ class Mission(models.Model):
     start_date = models.DateTimeField("Date of commencement", blank=True, null=True)
     end_date = models.DateTimeField("Date of completion", blank=True, null=True)
     security_clearance = models.IntegerField(choices=SecurityClearance.choices)
+    report_sequence = models.PositiveIntegerField("Number of reports issued", default=0,
+                                                  editable=False)
+    updated_at = models.DateTimeField("Last modified", auto_now=True)
+
+    objects = MissionQuerySet.as_manager()
+
+    class Meta:
+        """Indexes matching the supervisor's mission list, paginated by primary key"""
+        indexes = [
+            models.Index(fields=['supervisor', 'id'], name='mission_supervisor_idx'),
+        ]
 
     def __str__(self):
         return str(self.name)
@@ -66,6 +140,32 @@ class Mission(models.Model):
             if self.end_date < self.start_date:
                 raise ValidationError("End date-time must be later than start date-time.")
 
+    def save(self, *args, **kwargs):
+        # The report counter is only ever advanced by allocate_report_sequence(),
+        # so never write back a value that may have been read before a report was issued
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'report_sequence'
+            ]
+
+        super().save(*args, **kwargs)
+
+    def allocate_report_sequence(self):
+        """
+        Reserve the next report number for this mission.
+
+        The increment happens in the database, so concurrent writers each get a
+        distinct number; the row stays locked until the surrounding transaction ends.
+        """
+        missions = Mission.objects.db_manager(
+            router.db_for_write(Mission, instance=self)).filter(pk=self.pk)
+
+        missions.update(report_sequence=models.F('report_sequence') + 1)
+        self.report_sequence = missions.values_list('report_sequence', flat=True).get()
+
+        return self.report_sequence
+
 
 class MissionReport(models.Model):
     """A report on a mission."""
@@ -75,6 +175,113 @@ class MissionReport(models.Model):
     assigned_to = models.ForeignKey(Employee, null=True, on_delete=models.SET_NULL)
     publish_date = models.DateTimeField("Date published")
     summary = models.CharField(max_length=DEFAULT_DESCRIPTION_LENGTH)
+    sequence = models.PositiveIntegerField("Report number", editable=False)
+    updated_at = models.DateTimeField("Last modified", auto_now=True)
+
+    objects = MissionReportQuerySet.as_manager()
+
+    class Meta:
+        """Indexes matching report lists, paginated newest first by (publish_date, id)"""
+        indexes = [
+            models.Index(fields=['assigned_to', 'publish_date', 'id'],
+                         name='report_assignee_published_idx'),
+            models.Index(fields=['mission', 'publish_date', 'id'],
+                         name='report_mission_published_idx'),
+            models.Index(fields=['publish_date', 'id'], name='report_published_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['mission', 'sequence'],
+                                    name='report_mission_sequence_unique'),
+        ]
 
     def __str__(self):
         return str(self.title)
+
+    def save(self, *args, **kwargs):
+        if self.sequence is not None:
+            super().save(*args, **kwargs)
+            return
+
+        # Number new reports per mission, defaulting the title to that number
+        with transaction.atomic(using=router.db_for_write(MissionReport, instance=self)):
+            self.sequence = self.mission.allocate_report_sequence()
+
+            if not self.title:
+                self.title = f"{self.mission.name} Report {self.sequence}"
+
+            super().save(*args, **kwargs)
+
+
+class Dashboard(models.Model):
+    """
+    The first page of each list on an employee's index page, with their totals,
+    within the employee's clearance. Kept up to date by signals, see dashboards.py.
+    """
+
+    employee = models.OneToOneField(Employee, primary_key=True, on_delete=models.CASCADE)
+    mission_count = models.PositiveIntegerField("Missions supervised", default=0)
+    supervised_report_count = models.PositiveIntegerField(
+        "Reports on missions supervised", default=0)
+    assigned_report_count = models.PositiveIntegerField("Reports assigned", default=0)
+    missions = models.JSONField("First missions supervised", default=list)
+    supervised_reports = models.JSONField("Latest reports on missions supervised", default=list)
+    assigned_reports = models.JSONField("Latest reports assigned", default=list)
+    updated_at = models.DateTimeField("Last rebuilt", auto_now=True)
+
+    def __str__(self):
+        return f"Dashboard of {self.employee_id}"
+
+
+class ReportJob(models.Model):
+    """A request to generate a mission report, queued for the report worker"""
+
+    class Status(models.TextChoices):
+        """Where a job is in the queue"""
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    mission = models.ForeignKey(Mission, on_delete=models.CASCADE)
+    assigned_to = models.ForeignKey(Employee, null=True, on_delete=models.SET_NULL)
+    requested_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    publish_date = models.DateTimeField("Date published", default=timezone.now)
+    summary = models.CharField(max_length=DEFAULT_DESCRIPTION_LENGTH)
+    status = models.CharField(max_length=7, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField("Not before", default=timezone.now)
+    locked_at = models.DateTimeField("Claimed at", blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    report = models.OneToOneField(MissionReport, blank=True, null=True,
+                                  on_delete=models.SET_NULL, related_name='job')
+
+    class Meta:
+        """Index matching the worker's search for the next due job"""
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='report_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Report on {self.mission_id} ({self.status})"
+
+
+class QueryFingerprint(models.Model):
+    """Accumulated timings of one normalised SQL statement run by one view"""
+
+    fingerprint = models.CharField(max_length=16)
+    view = models.CharField(max_length=255)
+    sql = models.TextField("Normalised SQL")
+    count = models.PositiveBigIntegerField(default=0)
+    total_time = models.FloatField("Total seconds", default=0)
+    max_time = models.FloatField("Slowest seconds", default=0)
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        """One row per statement and view"""
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'view'],
+                                    name='query_fingerprint_view_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.view}: {self.sql}"
@@ -0,0 +1,207 @@
+"""
+Push notifications of new mission reports to their assignees.
+
+Once a report is committed its assignee's channel is published to, and the
+notifications stream of the async views relays the message to the assignee's
+open dashboards as server-sent events, so they no longer need reloading.
+
+The in-process broker only reaches the pages served by the process that saved
+the report. When reports are written by other processes, such as the report
+worker, set MISSIONS_NOTIFICATIONS_BROKER to 'redis' to publish through Redis.
+With the report queue on and the in-process broker no generated report would
+ever be notified, so a warning is logged at startup and dashboards are served
+without the stream.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger("ssd2023.notifications")
+
+DEFAULT_REDIS_URL = 'redis://127.0.0.1:6379'
+
+# Messages kept for a subscriber that is not reading; older ones are dropped
+MAX_PENDING = 100
+
+
+def employee_channel(employee_id):
+    """Channel of the notifications for an employee"""
+    return f"missions:notifications:employee:{employee_id}"
+
+
+class InProcessSubscription:
+    """Messages published to a channel, read from the event loop that subscribed"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, message):
+        """Queue a message on the subscriber's loop; called from any thread"""
+        def put_message():
+            if self.queue.qsize() >= MAX_PENDING:
+                self.queue.get_nowait()
+
+            self.queue.put_nowait(message)
+
+        try:
+            self.loop.call_soon_threadsafe(put_message)
+        except RuntimeError:
+            # The loop was closed without unsubscribing
+            self.broker.remove(self)
+
+    async def get(self, timeout):
+        """The next message, or None if none is published within the timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            # Not the builtin TimeoutError before Python 3.11
+            return None
+
+    async def close(self):
+        """Stop receiving messages"""
+        self.broker.remove(self)
+
+
+class InProcessBroker:
+    """Publish and subscribe between the threads and event loops of this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def publish(self, channel, message):
+        """Send a message to the current subscribers of a channel"""
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    async def subscribe(self, channel):
+        """Start receiving the messages of a channel"""
+        subscription = InProcessSubscription(self, channel)
+
+        with self.lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+
+        return subscription
+
+    def remove(self, subscription):
+        """Forget a subscription"""
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+
+            if not subscriptions:
+                self.subscriptions.pop(subscription.channel, None)
+
+
+class RedisSubscription:
+    """Messages published to a Redis channel"""
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def get(self, timeout):
+        """The next message, or None if none is published within the timeout"""
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+
+        return None if message is None else message['data'].decode()
+
+    async def close(self):
+        """Stop receiving messages"""
+        await self.pubsub.reset()
+
+
+class RedisBroker:
+    """Publish and subscribe through Redis, between every process of the portal"""
+
+    def __init__(self, url):
+        try:
+            import redis  # pylint: disable=import-outside-toplevel
+            import redis.asyncio  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImproperlyConfigured(
+                "MISSIONS_NOTIFICATIONS_BROKER='redis' needs the redis package") from error
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        """Send a message to the subscribers of a channel in any process"""
+        self.client.publish(channel, message)
+
+    async def subscribe(self, channel):
+        """Start receiving the messages of a channel"""
+        pubsub = self.async_client.pubsub()
+        await pubsub.subscribe(channel)
+
+        return RedisSubscription(pubsub)
+
+
+BROKERS = {
+    'memory': InProcessBroker,
+    'redis': lambda: RedisBroker(getattr(settings, 'MISSIONS_NOTIFICATIONS_REDIS_URL',
+                                         DEFAULT_REDIS_URL)),
+}
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    """The configured broker, shared by the whole process"""
+    name = getattr(settings, 'MISSIONS_NOTIFICATIONS_BROKER', 'memory')
+
+    with _brokers_lock:
+        if name not in _brokers:
+            if name not in BROKERS:
+                raise ImproperlyConfigured(f"Unknown notifications broker {name!r}")
+
+            _brokers[name] = BROKERS[name]()
+
+        return _brokers[name]
+
+
+def reaches_workers():
+    """
+    Whether the broker reaches this process from the report worker; the
+    in-process broker cannot while reports are generated there
+    """
+    return not (getattr(settings, 'MISSIONS_REPORT_QUEUE', False) and
+                getattr(settings, 'MISSIONS_NOTIFICATIONS_BROKER', 'memory') == 'memory')
+
+
+def check_broker():
+    """Warn that the notifications stream is turned off when serving it would never notify"""
+    if getattr(settings, 'MISSIONS_ASYNC_VIEWS', False) and not reaches_workers():
+        logger.warning(
+            "Reports generated by the report worker (MISSIONS_REPORT_QUEUE) cannot be "
+            "notified through the in-process broker, so the notifications stream is off; set "
+            "MISSIONS_NOTIFICATIONS_BROKER='redis', or MISSIONS_REPORT_QUEUE=0 to generate "
+            "reports in the web process")
+
+
+def notify_report(report):
+    """Tell a report's assignee about it; the clearance lets streams filter it"""
+    message = json.dumps({
+        'id': report.pk,
+        'title': report.title,
+        'url': "/mission-report/" + str(report.pk),
+        'security_clearance': report.mission.security_clearance,
+    })
+
+    try:
+        get_broker().publish(employee_channel(report.assigned_to_id), message)
+    except Exception:  # pylint: disable=broad-exception-caught
+        # The report is saved either way; its assignee finds it on the dashboard
+        logger.exception("Could not notify employee %s of report %s",
+                         report.assigned_to_id, report.pk)
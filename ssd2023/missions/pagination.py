@@ -0,0 +1,206 @@
+"""Keyset (cursor) pagination for mission and report listings"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 25
+DEFAULT_MAX_PAGE_SIZE = 100
+
+
+def get_page_size(request):
+    """Page size from the request, bounded by the configured maximum"""
+    default = getattr(settings, 'MISSIONS_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = getattr(settings, 'MISSIONS_MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        page_size = default
+
+    return max(1, min(page_size, maximum))
+
+
+class KeysetPage:
+    """A single page of results with cursors to the neighbouring pages"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.next_url = None
+        self.previous_url = None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_next(self):
+        """Whether there is a page after this one"""
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        """Whether there is a page before this one"""
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by seeking past the last seen ordering key.
+
+    Unlike offset pagination, the cost of fetching a page does not grow with
+    its position in the table, provided the ordering is backed by an index.
+    The ordering must end in a unique field (normally the primary key).
+    """
+
+    def __init__(self, queryset, ordering, page_size=DEFAULT_PAGE_SIZE, prefix=''):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+        self.prefix = prefix
+
+    @property
+    def after_param(self):
+        """Query parameter holding the cursor of the next page"""
+        return self.prefix + 'after'
+
+    @property
+    def before_param(self):
+        """Query parameter holding the cursor of the previous page"""
+        return self.prefix + 'before'
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _key(self, obj):
+        return [getattr(obj, name) for name, _ in self._fields()]
+
+    def encode_cursor(self, obj):
+        """Serialise the ordering key of an object into an opaque cursor"""
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value
+                  for value in self._key(obj)]
+
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Parse a cursor back into ordering values, or None if it is invalid"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            return None
+
+        fields = self._fields()
+
+        if not isinstance(values, list) or len(values) != len(fields):
+            return None
+
+        model = self.queryset.model
+        parsed = []
+
+        for (name, _), value in zip(fields, values):
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+            try:
+                parsed.append(field.to_python(value))
+            except Exception:  # pylint: disable=broad-except
+                return None
+
+        return parsed
+
+    def _seek(self, values, forward):
+        """Build the predicate selecting rows strictly past the given key"""
+        predicate = Q()
+        equal = {}
+
+        for (name, descending), value in zip(self._fields(), values):
+            lookup = 'lt' if descending == forward else 'gt'
+            predicate |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+
+        return predicate
+
+    def _order(self, forward):
+        if forward:
+            return self.ordering
+
+        return tuple(name[1:] if name.startswith('-') else '-' + name
+                     for name in self.ordering)
+
+    def _query(self, params):
+        """The queryset fetching one row past the page, its cursor and its direction"""
+        after = params.get(self.after_param)
+        before = params.get(self.before_param)
+
+        cursor = self.decode_cursor(after or before) if (after or before) else None
+        forward = cursor is None or not before
+
+        queryset = self.queryset.order_by(*self._order(forward))
+
+        if cursor is not None:
+            queryset = queryset.filter(self._seek(cursor, forward))
+
+        return queryset[:self.page_size + 1], cursor, forward
+
+    def _page(self, params, items, cursor, forward):
+        """Build the page from the fetched rows"""
+        has_more = len(items) > self.page_size
+        items = items[:self.page_size]
+
+        if not forward:
+            items.reverse()
+
+        if not items:
+            return KeysetPage(items)
+
+        if forward:
+            has_next, has_previous = has_more, cursor is not None
+        else:
+            has_next, has_previous = cursor is not None, has_more
+
+        page = KeysetPage(
+            items,
+            next_cursor=self.encode_cursor(items[-1]) if has_next else None,
+            prev_cursor=self.encode_cursor(items[0]) if has_previous else None,
+        )
+        page.next_url = self._url(params, self.after_param, page.next_cursor)
+        page.previous_url = self._url(params, self.before_param, page.prev_cursor)
+
+        return page
+
+    def get_page(self, params):
+        """Return the page selected by the cursor in the given query parameters"""
+        queryset, cursor, forward = self._query(params)
+
+        return self._page(params, list(queryset), cursor, forward)
+
+    def first_page(self, params, items):
+        """
+        The first page built from rows fetched in advance, which must include the
+        row after the page if there is one
+        """
+        return self._page(params, list(items[:self.page_size + 1]), None, True)
+
+    async def aget_page(self, params):
+        """Return the page selected by the cursor, fetching it with the async ORM"""
+        queryset, cursor, forward = self._query(params)
+
+        return self._page(params, [obj async for obj in queryset], cursor, forward)
+
+    def _url(self, params, param, cursor):
+        if cursor is None:
+            return None
+
+        query = params.copy()
+        query.pop(self.after_param, None)
+        query.pop(self.before_param, None)
+        query[param] = cursor
+
+        return '?' + query.urlencode()
@@ -0,0 +1,212 @@
+"""
+Opt-in query profiling: SQL run by views is normalised into fingerprints whose
+count, total and slowest times are accumulated per view, and statements slower
+than a threshold are logged with their query plan.
+
+Timings are gathered in memory and added to the QueryFingerprint table every
+few seconds, so that the query_report command can rank them across processes.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import IntegrityError, models, transaction
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import timed_call
+from .models import QueryFingerprint
+
+logger = logging.getLogger("ssd2023.queries")
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_FLUSH_SECONDS = 10
+
+# Literals and placeholders are replaced, then runs of them in lists collapsed
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER = re.compile(r"%s|\?")
+VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+ROW_LIST = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+WHITESPACE = re.compile(r"\s+")
+
+# The view handling the current request, set only while profiling
+_view = ContextVar('missions_profiled_view', default=None)
+# Set while a plan is explained, so that the EXPLAIN itself is not profiled
+_explaining = ContextVar('missions_explaining', default=False)
+
+
+def is_enabled():
+    """Whether query profiling is switched on"""
+    return getattr(settings, 'MISSIONS_QUERY_PROFILING', False)
+
+
+def get_slow_query_threshold():
+    """Seconds above which a query is logged with its plan"""
+    return getattr(settings, 'MISSIONS_SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS) / 1000
+
+
+def get_flush_interval():
+    """Seconds between writes of the accumulated timings to the database"""
+    return getattr(settings, 'MISSIONS_QUERY_PROFILE_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+
+
+def normalise(sql):
+    """SQL with its literals and parameters replaced, so that similar statements match"""
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER.sub('?', sql)
+    sql = VALUE_LIST.sub('(...)', sql)
+    sql = ROW_LIST.sub('(...)', sql)
+
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalised_sql):
+    """Short stable identifier of a normalised statement"""
+    return hashlib.sha256(normalised_sql.encode()).hexdigest()[:16]
+
+
+class QueryStats:
+    """Timings accumulated in this process and not yet written to the database"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+
+    def add(self, view, sql, duration):
+        """Count one run of a statement by a view"""
+        normalised = normalise(sql)
+        key = (fingerprint(normalised), view)
+
+        with self.lock:
+            _, count, total, maximum = self.pending.get(key, (None, 0, 0.0, 0.0))
+            self.pending[key] = (normalised, count + 1, total + duration, max(maximum, duration))
+
+    def take(self, force=False):
+        """Remove and return the pending timings if the flush interval has passed"""
+        with self.lock:
+            if not force and time.monotonic() - self.flushed_at < get_flush_interval():
+                return {}
+
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+
+        return pending
+
+    def flush(self, force=False):
+        """Add the pending timings to the QueryFingerprint table"""
+        now = timezone.now()
+
+        for (key, view), (sql, count, total, maximum) in self.take(force).items():
+            rows = QueryFingerprint.objects.filter(fingerprint=key, view=view)
+            changes = {
+                'count': models.F('count') + count,
+                'total_time': models.F('total_time') + total,
+                'max_time': models.Case(
+                    models.When(max_time__lt=maximum, then=models.Value(maximum)),
+                    default=models.F('max_time')),
+                'last_seen': now,
+            }
+
+            if rows.update(**changes):
+                continue
+
+            try:
+                with transaction.atomic():
+                    QueryFingerprint.objects.create(
+                        fingerprint=key, view=view, sql=sql, count=count, total_time=total,
+                        max_time=maximum, last_seen=now)
+            except IntegrityError:
+                # Another process created the row first
+                rows.update(**changes)
+
+
+stats = QueryStats()
+
+
+def view_name(request):
+    """Dotted path of the view a request's URL resolves to"""
+    try:
+        return resolve(request.path_info, getattr(request, 'urlconf', None)).view_name
+    except Resolver404:
+        return 'unresolved'
+
+
+def explain(connection, sql, params):
+    """The query plan of a SELECT statement, one line per step"""
+    token = _explaining.set(True)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    finally:
+        _explaining.reset(token)
+
+
+def profile_query(execute, sql, params, many, context):
+    """Database execute wrapper timing the queries of profiled requests"""
+    view = _view.get()
+
+    if view is None or _explaining.get():
+        return execute(sql, params, many, context)
+
+    def record(duration):
+        stats.add(view, sql, duration)
+
+        if duration >= get_slow_query_threshold():
+            log_slow_query(context['connection'], view, sql, params, many, duration)
+
+    return timed_call(execute, (sql, params, many, context), record)
+
+
+def log_slow_query(connection, view, sql, params, many, duration):  # pylint: disable=too-many-arguments
+    """Log a slow statement, with its plan if it is a single SELECT"""
+    plan = ''
+
+    if not many and sql.lstrip().upper().startswith('SELECT'):
+        try:
+            plan = explain(connection, sql, params)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            plan = f"(no plan: {error})"
+
+    logger.warning("Slow query, %.1f ms in %s: %s\n%s", duration * 1000, view, sql, plan)
+
+
+@sync_and_async_middleware
+def query_profiling_middleware(get_response):
+    """Attribute queries to the view that runs them, when MISSIONS_QUERY_PROFILING is on"""
+    if not is_enabled():
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _view.set(view_name(request))
+
+            try:
+                return await get_response(request)
+            finally:
+                _view.reset(token)
+                await sync_to_async(stats.flush)()
+    else:
+        def middleware(request):
+            token = _view.set(view_name(request))
+
+            try:
+                return get_response(request)
+            finally:
+                _view.reset(token)
+                stats.flush()
+
+    return middleware
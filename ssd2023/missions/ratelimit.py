@@ -0,0 +1,197 @@
+"""
+Sliding window rate limits on login attempts, per client address and per username.
+
+Each scope allows a burst of attempts per window, the time its refill rate
+per minute takes to make up a burst. Attempts are counted per window, and
+those of the previous window are weighed by how much of it still overlaps the
+last window's length, so that the limit slides rather than resetting at once.
+An attempt over the limit of its address, or of failed attempts for its
+username, is rejected without checking the password, so that a burst of
+guesses costs a cache lookup rather than a password hash.
+
+Counters live in the 'ratelimit' cache and are only changed with its atomic
+add(), incr() and decr(), so that processes sharing it through Redis do not
+overwrite each other's attempts. It is local to each process by default, in
+which case each process allows its own burst.
+"""
+import hashlib
+import ipaddress
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+RATE_LIMIT_CACHE = 'ratelimit'
+COUNTER_KEY = 'missions:ratelimit:v2:{}:{}:{}'
+
+# Scope: (setting of its burst and refill rate per minute, and their defaults)
+DEFAULT_LIMITS = {
+    'ip': ('MISSIONS_LOGIN_RATE_LIMIT_IP', (20, 10)),
+    'username': ('MISSIONS_LOGIN_RATE_LIMIT_USERNAME', (5, 5)),
+}
+
+
+def get_limit(scope):
+    """Burst and positive refill rate per minute of a scope's limit; a burst of 0 disables it"""
+    setting, default = DEFAULT_LIMITS[scope]
+
+    return getattr(settings, setting, default)
+
+
+def counter_key(scope, key, window):
+    """Cache key of the attempts counted for a key in a window"""
+    # Hashed so that any username makes a valid cache key
+    return COUNTER_KEY.format(scope, hashlib.sha256(key.encode()).hexdigest(), window)
+
+
+def get_window(scope, key, now):
+    """
+    The burst and window length of a scope, the seconds into the current window,
+    and the cache keys of a key's attempts in it and in the previous one
+    """
+    burst, per_minute = get_limit(scope)
+    length = burst * 60 / per_minute
+    window, elapsed = int(now // length), now % length
+
+    return (burst, length, elapsed, counter_key(scope, key, window),
+            counter_key(scope, key, window - 1))
+
+
+def wait_time(burst, length, previous, current, elapsed):
+    """Seconds until one more attempt is within the limit, if no others are made"""
+    room = burst - current - 1
+
+    if room >= 0 and previous:
+        # The previous window's attempts weigh less as the current one goes on
+        return max(0.0, length * (1 - room / previous) - elapsed)
+
+    # Not before the next window, in which this one is the previous
+    return length - elapsed + length * (1 - (burst - 1) / current)
+
+
+def peek(scope, key, now=None):
+    """
+    Seconds until an attempt will be within the limit, or 0 if one is now,
+    without counting one
+    """
+    if get_limit(scope)[0] <= 0:
+        return 0
+
+    now = time.time() if now is None else now
+    burst, length, elapsed, current_key, previous_key = get_window(scope, key, now)
+    counts = caches[RATE_LIMIT_CACHE].get_many([current_key, previous_key])
+    current, previous = counts.get(current_key, 0), counts.get(previous_key, 0)
+
+    if previous * (1 - elapsed / length) + current + 1 <= burst:
+        return 0
+
+    return wait_time(burst, length, previous, current, elapsed)
+
+
+def take(scope, key, now=None):
+    """
+    Count an attempt, returning 0 if it is within the limit, or else the
+    seconds until one will be, without counting it
+    """
+    if get_limit(scope)[0] <= 0:
+        return 0
+
+    now = time.time() if now is None else now
+    burst, length, elapsed, current_key, previous_key = get_window(scope, key, now)
+    cache = caches[RATE_LIMIT_CACHE]
+    # Kept while it is the current or the previous window
+    timeout = math.ceil(2 * length)
+
+    cache.add(current_key, 0, timeout)
+
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.add(current_key, 1, timeout)
+        current = 1
+
+    previous = cache.get(previous_key, 0)
+
+    if previous * (1 - elapsed / length) + current <= burst:
+        return 0
+
+    cache.decr(current_key)
+
+    return wait_time(burst, length, previous, current - 1, elapsed)
+
+
+def get_trusted_proxies():
+    """Addresses or networks of the reverse proxies whose X-Forwarded-For header is believed"""
+    return [ipaddress.ip_network(proxy, strict=False)
+            for proxy in getattr(settings, 'MISSIONS_TRUSTED_PROXIES', ())]
+
+
+def is_trusted(address, proxies):
+    """Whether an address is one of the trusted proxies"""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+
+    return any(address in network for network in proxies)
+
+
+def client_address(request):
+    """
+    Address of the client: the server's peer, or when that is a trusted proxy,
+    the nearest address X-Forwarded-For gives that is not one
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    proxies = get_trusted_proxies()
+
+    if not is_trusted(address, proxies):
+        return address
+
+    # Each proxy appends the address it was reached from; those left of the
+    # first untrusted one could have been sent by the client
+    forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+
+    for hop in reversed([hop for hop in forwarded if hop]):
+        address = hop
+
+        if not is_trusted(hop, proxies):
+            break
+
+    return address
+
+
+def username_key(username):
+    """A username as counted, whatever its case or surrounding spaces"""
+    return username.strip().lower()
+
+
+def limit_login(request, username):
+    """
+    Seconds the client must wait before trying to log in again, or 0 if this
+    attempt may go ahead; rejected attempts are counted in the metrics.
+
+    Every attempt counts towards its address's limit, but only failed ones
+    towards its username's, with login_failed(), so that attempts made while
+    the username has room left, such as the user's own, do not use it up.
+    """
+    wait = take('ip', client_address(request))
+
+    if wait:
+        metrics.registry.count('login_attempts', 'limited_ip')
+        return wait
+
+    wait = peek('username', username_key(username))
+
+    if wait:
+        metrics.registry.count('login_attempts', 'limited_username')
+
+    return wait
+
+
+def login_failed(username):
+    """Count a failed attempt towards its username's limit"""
+    take('username', username_key(username))
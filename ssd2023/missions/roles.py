@@ -0,0 +1,168 @@
+"""Resolve a user's employee profile, groups and permissions once per request"""
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.db.models import Q
+
+from .models import ISS_ADMIN_GROUP, NASA_ADMIN_GROUP, Employee
+
+ROLE_CACHE_KEY = 'missions:roles:v2:{}'
+DEFAULT_ROLE_CACHE_TIMEOUT = 0
+
+# Attribute on the user object that memoises the roles for the current request
+USER_ROLES_ATTRIBUTE = '_missions_roles'
+
+
+class UserRoles:
+    """
+    The access control facts about a user that views and templates need.
+
+    Only identifiers and flags are held so that the object can be cached
+    without leaking employee details such as the social security number.
+    """
+
+    def __init__(self, *, employee_id=None, division_id=None, security_clearance=None,
+                 groups=frozenset(), permissions=frozenset(), is_superuser=False):
+        self.is_superuser = is_superuser
+        self.employee_id = employee_id
+        self.division_id = division_id
+        self.security_clearance = security_clearance
+        self.groups = frozenset(groups)
+        self.permissions = frozenset(permissions)
+
+    @property
+    def has_employee(self):
+        """Whether the user has an employee profile (superusers may not)"""
+        return self.employee_id is not None
+
+    @property
+    def is_iss_admin(self):
+        """Whether the user belongs to the ISS admin group"""
+        return ISS_ADMIN_GROUP in self.groups
+
+    @property
+    def is_nasa_admin(self):
+        """Whether the user belongs to the NASA admin group"""
+        return NASA_ADMIN_GROUP in self.groups
+
+    def has_perm(self, perm):
+        """Whether the user holds the given 'app_label.codename' permission"""
+        return perm in self.permissions
+
+
+def get_role_cache_timeout():
+    """
+    Seconds to keep roles in the sessions cache between requests; 0, the
+    default unless that cache is shared by every process, keeps them for the
+    request only, as invalidating them would not reach the other processes
+    """
+    return getattr(settings, 'MISSIONS_ROLE_CACHE_TIMEOUT', DEFAULT_ROLE_CACHE_TIMEOUT)
+
+
+def get_role_cache():
+    """The cache of roles between requests, which is the sessions cache"""
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def role_querysets(user):
+    """Queries for the employee profile, group names and permissions of a user"""
+    employee = Employee.objects.filter(user=user).values(
+        'pk', 'division_id', 'security_clearance')
+
+    groups = user.groups.values_list('name', flat=True)
+
+    if user.is_superuser:
+        permissions = Permission.objects.all()
+    else:
+        permissions = Permission.objects.filter(Q(user=user) | Q(group__user=user))
+
+    permissions = permissions.values_list(
+        'content_type__app_label', 'codename').order_by().distinct()
+
+    return employee, groups, permissions
+
+
+def make_roles(employee, groups, permissions, is_superuser=False):
+    """Build roles from the rows of the role queries"""
+    employee = employee or {}
+
+    return UserRoles(
+        is_superuser=is_superuser,
+        employee_id=employee.get('pk'),
+        division_id=employee.get('division_id'),
+        security_clearance=employee.get('security_clearance'),
+        groups=groups,
+        permissions={f"{app_label}.{codename}" for app_label, codename in permissions},
+    )
+
+
+def load_roles(user):
+    """Load the roles of a user from the database"""
+    employee, groups, permissions = role_querysets(user)
+
+    return make_roles(employee.first(), list(groups), list(permissions), user.is_superuser)
+
+
+async def aload_roles(user):
+    """Load the roles of a user from the database with the async ORM"""
+    employee, groups, permissions = role_querysets(user)
+
+    return make_roles(await employee.afirst(),
+                      [name async for name in groups],
+                      [permission async for permission in permissions],
+                      user.is_superuser)
+
+
+def get_roles(user):
+    """Return the roles of a user, memoised on the user object and, if enabled, in the cache"""
+    if not user.is_authenticated:
+        return UserRoles()
+
+    roles = getattr(user, USER_ROLES_ATTRIBUTE, None)
+
+    if roles is not None:
+        return roles
+
+    timeout = get_role_cache_timeout()
+    key = ROLE_CACHE_KEY.format(user.pk)
+    roles = get_role_cache().get(key) if timeout else None
+
+    if roles is None:
+        roles = load_roles(user)
+
+        if timeout:
+            get_role_cache().set(key, roles, timeout)
+
+    setattr(user, USER_ROLES_ATTRIBUTE, roles)
+
+    return roles
+
+
+async def aget_roles(user):
+    """Return the roles of an already resolved user without blocking the event loop"""
+    if not user.is_authenticated:
+        return UserRoles()
+
+    roles = getattr(user, USER_ROLES_ATTRIBUTE, None)
+
+    if roles is not None:
+        return roles
+
+    timeout = get_role_cache_timeout()
+    key = ROLE_CACHE_KEY.format(user.pk)
+    roles = await get_role_cache().aget(key) if timeout else None
+
+    if roles is None:
+        roles = await aload_roles(user)
+
+        if timeout:
+            await get_role_cache().aset(key, roles, timeout)
+
+    setattr(user, USER_ROLES_ATTRIBUTE, roles)
+
+    return roles
+
+
+def invalidate_roles(*user_ids):
+    """Drop the cached roles of the given users"""
+    get_role_cache().delete_many([ROLE_CACHE_KEY.format(user_id) for user_id in user_ids])
@@ -0,0 +1,117 @@
+"""Route the reads of read-only views to replicas and everything else to the primary"""
+import asyncio
+import random
+import time
+
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+# Cookie holding the time until which a browser that has just written reads the primary
+PIN_COOKIE = 'missions_primary_until'
+
+_use_replica = ContextVar('missions_use_replica', default=False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads made inside a read_from_replica view to a random replica.
+
+    All writes, and reads anywhere else, go to the primary, so views that read
+    and then write see the latest data.
+    """
+    # pylint: disable=unused-argument
+
+    def db_for_read(self, model, **hints):
+        """A replica inside read-only views, otherwise the primary"""
+        replicas = getattr(settings, 'MISSIONS_READ_REPLICAS', [])
+
+        if replicas and _use_replica.get():
+            return random.choice(replicas)  # nosec - load balancing, not security
+
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        """Always the primary"""
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Every alias holds the same data"""
+        return True
+
+    def allow_migrate(self, using, app_label, model_name=None, **hints):
+        """Replicas share the schema, so a local replica file can be migrated too"""
+        return True
+
+
+def is_pinned(request):
+    """Whether the browser wrote recently enough that a replica may not have caught up"""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def read_from_replica(view_func):
+    """
+    Let a sync or async view read from the replicas, unless its user has just
+    written. Apply it inside login_required and permission checks, so that the
+    session, user and roles are read from the primary
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _use_replica.set(not is_pinned(request))
+
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = _use_replica.set(not is_pinned(request))
+
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
+
+
+def pin(request, response):
+    """Set the pin cookie on the response of a write view that redirects or answers a POST"""
+    lag = getattr(settings, 'MISSIONS_REPLICA_LAG', 0)
+
+    written = (response.status_code in (301, 302, 303) or
+               (request.method == 'POST' and response.status_code == 200))
+
+    if (written and lag
+            and getattr(settings, 'MISSIONS_READ_REPLICAS', [])):
+        response.set_cookie(PIN_COOKIE, str(time.time() + lag), max_age=lag,
+                            secure=settings.SESSION_COOKIE_SECURE, httponly=True,
+                            samesite='Strict')
+
+    return response
+
+
+def pin_to_primary(view_func):
+    """Make the browser read from the primary for a while after a sync or async write view"""
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            return pin(request, await view_func(request, *args, **kwargs))
+
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return pin(request, view_func(request, *args, **kwargs))
+
+    return wrapper
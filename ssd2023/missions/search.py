@@ -0,0 +1,298 @@
+"""Full-text search over mission names and descriptions and mission report titles and summaries"""
+import re
+import sqlite3
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, router
+from django.db.models import F, FloatField, Q, Value
+
+from .models import Mission, MissionReport
+
+SEARCH_TABLE = 'missions_search'
+
+MISSION = 'mission'
+MISSION_REPORT = 'report'
+
+# Documents are keyed by rowid, the object's primary key times two plus its
+# kind's number, so that an object's document is found without a scan
+KIND_NUMBERS = {MISSION: 0, MISSION_REPORT: 1}
+KINDS = {number: kind for kind, number in KIND_NUMBERS.items()}
+
+# Relative weight of title matches over body matches when ranking
+TITLE_WEIGHT = 10.0
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def search_documents(model, instances):
+    """(rowid, title, body) rows indexed for mission or report instances"""
+    if model is Mission:
+        return [(document_id(MISSION, obj.pk), obj.name, obj.description or '')
+                for obj in instances]
+
+    return [(document_id(MISSION_REPORT, obj.pk), obj.title, obj.summary) for obj in instances]
+
+
+def model_kind(model):
+    """The document kind stored for a model"""
+    return MISSION if model is Mission else MISSION_REPORT
+
+
+def document_id(kind, object_id):
+    """Rowid of the document of an object"""
+    return object_id * 2 + KIND_NUMBERS[kind]
+
+
+def document_object(rowid):
+    """Kind and primary key of the object of a document"""
+    return KINDS[rowid % 2], rowid // 2
+
+
+def tokenize(query):
+    """Split a user query into search terms, dropping any query syntax"""
+    return TOKEN_PATTERN.findall(query)
+
+
+class SearchResult:
+    """A mission or mission report matching a search"""
+
+    def __init__(self, kind, obj, rank):
+        self.kind = kind
+        self.object = obj
+        self.rank = rank
+
+    @property
+    def url(self):
+        """Link to the matching object"""
+        if self.kind == MISSION:
+            return f"/mission/{self.object.pk}"
+
+        return f"/mission-report/{self.object.pk}"
+
+    @property
+    def title(self):
+        """Name of the matching object"""
+        return str(self.object)
+
+
+def load_results(ranked, missions, mission_reports):
+    """Fetch the objects for ranked (kind, id, rank) rows, keeping the ranking"""
+    objects = {
+        MISSION: missions.in_bulk([pk for kind, pk, _ in ranked if kind == MISSION]),
+        MISSION_REPORT: mission_reports.in_bulk(
+            [pk for kind, pk, _ in ranked if kind == MISSION_REPORT]),
+    }
+
+    return [SearchResult(kind, objects[kind][pk], rank)
+            for kind, pk, rank in ranked if pk in objects[kind]]
+
+
+class SearchBackend:
+    """Fallback search using substring matches; correct everywhere but not indexed"""
+
+    def __init__(self, using):
+        self.using = using
+
+    def index(self, model, instances):
+        """Add or refresh documents for mission or report instances"""
+
+    def remove(self, model, pks):
+        """Remove documents for deleted missions or reports"""
+
+    def remove_matching(self, model, queryset):
+        """Remove documents for the missions or reports of a queryset, before deleting them"""
+
+    def rebuild(self):
+        """Reindex every mission and report"""
+
+    def search(self, query, missions, mission_reports, *, limit, offset=0):
+        """
+        Rank the missions and reports matching every term of the query.
+
+        Only objects in the given querysets are returned, so callers scope the
+        search by passing querysets restricted to what the user may see.
+        """
+        terms = tokenize(query)
+
+        if not terms:
+            return []
+
+        mission_filter = Q()
+        report_filter = Q()
+
+        for term in terms:
+            mission_filter &= Q(name__icontains=term) | Q(description__icontains=term)
+            report_filter &= Q(title__icontains=term) | Q(summary__icontains=term)
+
+        ranked = (
+            missions.filter(mission_filter).annotate(
+                kind=Value(MISSION), rank=Value(0.0, output_field=FloatField()))
+            .values_list('kind', 'pk', 'rank')
+            .union(mission_reports.filter(report_filter).annotate(
+                kind=Value(MISSION_REPORT), rank=Value(0.0, output_field=FloatField()))
+                .values_list('kind', 'pk', 'rank'), all=True)
+            .order_by('kind', '-pk')[offset:offset + limit]
+        )
+
+        return load_results(list(ranked), missions, mission_reports)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """Search backed by an SQLite FTS5 virtual table kept in sync by signals"""
+
+    def index(self, model, instances):
+        documents = search_documents(model, instances)
+
+        if not documents:
+            return
+
+        # Replaces the documents of objects already indexed by their rowid
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, title, body) "
+                "VALUES (%s, %s, %s)", documents)
+
+    def remove(self, model, pks):
+        rowids = [document_id(model_kind(model), pk) for pk in pks]
+
+        if not rowids:
+            return
+
+        placeholders = ', '.join(['%s'] * len(rowids))
+
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", rowids)
+
+    def remove_matching(self, model, queryset):
+        documents = self.documents(model_kind(model), queryset)
+
+        if documents is None:
+            return
+
+        sql, params = documents
+
+        # Looked up by rowid, however large the index
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({sql})", params)
+
+    def rebuild(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+        for model in (Mission, MissionReport):
+            batch = []
+
+            for obj in model.objects.using(self.using).iterator(chunk_size=2000):
+                batch.append(obj)
+
+                if len(batch) == 2000:
+                    self.index(model, batch)
+                    batch = []
+
+            self.index(model, batch)
+
+    def documents(self, kind, queryset):
+        """SQL selecting the rowids of the documents of a queryset's objects of one kind"""
+        queryset = queryset.annotate(
+            document=F('pk') * 2 + KIND_NUMBERS[kind]).values('document')
+
+        try:
+            return queryset.query.get_compiler(using=self.using).as_sql()
+        except EmptyResultSet:
+            return None
+
+    def search(self, query, missions, mission_reports, *, limit, offset=0):
+        terms = tokenize(query)
+        scopes = [scope for scope in (self.documents(MISSION, missions),
+                                      self.documents(MISSION_REPORT, mission_reports)) if scope]
+
+        if not terms or not scopes:
+            return []
+
+        match = ' '.join('"' + term + '"' for term in terms)
+        # Unary plus keeps SQLite from looking up each visible rowid instead of
+        # filtering what the full-text query matches
+        scope_sql = ' OR '.join(f"+rowid IN ({sql})" for sql, _ in scopes)
+        scope_params = [param for _, params in scopes for param in params]
+
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({SEARCH_TABLE}, %s, 1.0) AS rank "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND ({scope_sql}) "
+                "ORDER BY rank LIMIT %s OFFSET %s",
+                [TITLE_WEIGHT, match, *scope_params, limit, offset])
+            ranked = [(*document_object(rowid), rank) for rowid, rank in cursor.fetchall()]
+
+        return load_results(ranked, missions, mission_reports)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Search over tsvector expressions backed by GIN indexes"""
+
+    @staticmethod
+    def vectors():
+        """Weighted search vectors, matching the GIN indexes created by migration 0004"""
+        # pylint: disable=import-outside-toplevel
+        from django.contrib.postgres.search import SearchVector
+
+        return {
+            Mission: SearchVector('name', weight='A', config='english') +
+            SearchVector('description', weight='B', config='english'),
+            MissionReport: SearchVector('title', weight='A', config='english') +
+            SearchVector('summary', weight='B', config='english'),
+        }
+
+    def search(self, query, missions, mission_reports, *, limit, offset=0):
+        # pylint: disable=import-outside-toplevel
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        terms = tokenize(query)
+
+        if not terms:
+            return []
+
+        search_query = SearchQuery(' '.join(terms), config='english')
+        vectors = self.vectors()
+
+        def ranked(queryset, model, kind):
+            return (queryset.annotate(document=vectors[model])
+                    .filter(document=search_query)
+                    .annotate(kind=Value(kind), rank=SearchRank(F('document'), search_query))
+                    .values_list('kind', 'pk', 'rank'))
+
+        results = (ranked(missions, Mission, MISSION)
+                   .union(ranked(mission_reports, MissionReport, MISSION_REPORT), all=True)
+                   .order_by('-rank')[offset:offset + limit])
+
+        return load_results(list(results), missions, mission_reports)
+
+
+def sqlite_has_fts5():
+    """Whether the SQLite library Django uses was built with the FTS5 extension"""
+    connection = sqlite3.connect(':memory:')
+
+    try:
+        return bool(connection.execute(
+            "SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+    finally:
+        connection.close()
+
+
+_backends = {}
+
+
+def get_backend(using=None):
+    """The search backend for a database alias"""
+    using = using or router.db_for_write(Mission)
+
+    if using not in _backends:
+        vendor = connections[using].vendor
+
+        if vendor == 'sqlite' and sqlite_has_fts5():
+            _backends[using] = SQLiteSearchBackend(using)
+        elif vendor == 'postgresql':
+            _backends[using] = PostgresSearchBackend(using)
+        else:
+            _backends[using] = SearchBackend(using)
+
+    return _backends[using]
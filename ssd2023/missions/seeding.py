@@ -0,0 +1,135 @@
+"""Generate synthetic divisions, employees, missions and reports for benchmarking"""
+import random
+
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission, User
+from django.db import transaction
+from django.utils import timezone
+
+from .choices import invalidate_employee_choices
+from .dashboards import rebuild as rebuild_dashboards
+from .models import Division, Employee, Mission, MissionReport, SecurityClearance
+from .roles import ISS_ADMIN_GROUP, NASA_ADMIN_GROUP
+from .search import get_backend as get_search_backend
+
+SEED_USERNAME_PREFIX = 'seed'
+SEED_SUPERUSER = 'seed-admin'
+DEFAULT_BATCH_SIZE = 10000
+
+# Permissions of each group, as set up by the admin on the deployed site
+GROUP_PERMISSIONS = {
+    ISS_ADMIN_GROUP: ['add_mission', 'change_mission', 'delete_mission', 'view_mission',
+                      'add_missionreport', 'view_missionreport'],
+    NASA_ADMIN_GROUP: ['view_missionreport'],
+}
+
+
+def batched(total, batch_size):
+    """Yield (start, stop) ranges covering total in steps of batch_size"""
+    for start in range(0, total, batch_size):
+        yield start, min(start + batch_size, total)
+
+
+def seed_groups():
+    """Create the ISS and NASA admin groups with their permissions, keyed by name"""
+    groups = {}
+
+    for name, codenames in GROUP_PERMISSIONS.items():
+        groups[name], _ = Group.objects.get_or_create(name=name)
+        groups[name].permissions.add(*Permission.objects.filter(
+            content_type__app_label='missions', codename__in=codenames))
+
+    return groups
+
+
+def seed(divisions=10, employees=1000, missions=10000, reports=100000,  # pylint: disable=too-many-arguments,too-many-locals
+         batch_size=DEFAULT_BATCH_SIZE, random_seed=0, password=None, log=None):
+    """
+    Insert synthetic data with bulk inserts and return the created counts.
+
+    Half of the employees are ISS admins who supervise the missions, the other
+    half NASA admins who are assigned the reports. Seeded users have usernames
+    starting with 'seed.' and unusable passwords, unless a password is given,
+    in which case a 'seed-admin' superuser with that password is created too.
+    """
+    rng = random.Random(random_seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+    # Hashed once: every seeded user shares the same password and salt
+    password_hash = make_password(password) if password else '!'
+
+    groups = seed_groups()
+    iss_admins, nasa_admins = groups[ISS_ADMIN_GROUP], groups[NASA_ADMIN_GROUP]
+    run = User.objects.filter(username__startswith=SEED_USERNAME_PREFIX + '.').count()
+
+    if password and not User.objects.filter(username=SEED_SUPERUSER).exists():
+        User.objects.create_superuser(SEED_SUPERUSER, password=password)
+
+    with transaction.atomic():
+        division_rows = Division.objects.bulk_create([
+            Division(name=f"Division {number}") for number in range(divisions)
+        ])
+        log(f"Created {len(division_rows)} divisions")
+
+        users = User.objects.bulk_create([
+            User(username=f"{SEED_USERNAME_PREFIX}.{run + number}",
+                 first_name='Seed', last_name=str(run + number), password=password_hash)
+            for number in range(employees)
+        ], batch_size=batch_size)
+
+        employee_rows = Employee.objects.bulk_create([
+            Employee(user=user, division=rng.choice(division_rows),
+                     security_clearance=rng.choice(SecurityClearance.values))
+            for user in users
+        ], batch_size=batch_size)
+
+        supervisors = employee_rows[::2]
+        assignees = employee_rows[1::2] or supervisors
+
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=e.user_id, group_id=iss_admins.pk) for e in supervisors] +
+            [User.groups.through(user_id=e.user_id, group_id=nasa_admins.pk) for e in assignees],
+            batch_size=batch_size, ignore_conflicts=True)
+        invalidate_employee_choices()
+        log(f"Created {len(employee_rows)} employees")
+
+        mission_rows = Mission.objects.bulk_create([
+            Mission(name=f"Mission {number}", description='Seeded mission',
+                    division=rng.choice(division_rows), supervisor=rng.choice(supervisors),
+                    start_date=now - timedelta(days=rng.randint(30, 720)),
+                    security_clearance=rng.choice(SecurityClearance.values))
+            for number in range(missions)
+        ], batch_size=batch_size)
+        get_search_backend().index(Mission, mission_rows)
+        log(f"Created {len(mission_rows)} missions")
+
+    for start, stop in batched(reports, batch_size):
+        batch = []
+
+        for _ in range(start, stop):
+            mission = rng.choice(mission_rows)
+            mission.report_sequence += 1
+            batch.append(MissionReport(
+                title=f"{mission.name} Report {mission.report_sequence}",
+                mission=mission, sequence=mission.report_sequence,
+                assigned_to=rng.choice(assignees),
+                publish_date=now - timedelta(seconds=rng.randint(0, 3 * 10 ** 7)),
+                summary='Seeded report'))
+
+        with transaction.atomic():
+            MissionReport.objects.bulk_create(batch)
+            get_search_backend().index(MissionReport, batch)
+        log(f"Created {stop} of {reports} reports")
+
+    # Bulk inserts bypass the report counter, so bring it up to date
+    Mission.objects.bulk_update(mission_rows, ['report_sequence'], batch_size=batch_size)
+    log(f"Rebuilt {rebuild_dashboards()} dashboards")
+
+    return {
+        'divisions': len(division_rows),
+        'employees': len(employee_rows),
+        'missions': len(mission_rows),
+        'reports': reports,
+    }
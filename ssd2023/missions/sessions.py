@@ -0,0 +1,53 @@
+"""
+Cached database sessions whose cached copy is trusted for a limited time.
+
+Django's cached_db engine keeps a session in the cache for as long as the
+session lasts. With a cache local to each process, a session ended in one
+process, by logging out, could still be used in the others until it expired.
+Here cached copies expire after MISSIONS_SESSION_CACHE_TIMEOUT seconds and are
+then read from the database again. It is only the default engine when the
+sessions cache is shared by every process, with MISSIONS_SESSION_CACHE=redis.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+DEFAULT_SESSION_CACHE_TIMEOUT = 300
+
+
+def get_session_cache_timeout():
+    """Seconds to trust a cached session before reading it from the database again"""
+    return getattr(settings, 'MISSIONS_SESSION_CACHE_TIMEOUT', DEFAULT_SESSION_CACHE_TIMEOUT)
+
+
+class CappedCache:
+    """A cache whose entries are kept no longer than a maximum timeout"""
+
+    def __init__(self, cache, timeout):
+        self.cache = cache
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Store a value for at most the maximum timeout"""
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            timeout = self.timeout
+        else:
+            timeout = min(timeout, self.timeout)
+
+        self.cache.set(key, value, timeout, version)
+
+
+class SessionStore(cached_db.SessionStore):
+    """Database sessions read from the cache for up to MISSIONS_SESSION_CACHE_TIMEOUT"""
+
+    cache_key_prefix = 'missions.sessions'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = CappedCache(self._cache, get_session_cache_timeout())
@@ -0,0 +1,372 @@
+"""Signal handlers keeping cached data in step with the database"""
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .backends import invalidate_users
+from .caching import bump_versions
+from .choices import invalidate_employee_choices
+from . import dashboards
+from .metrics import record_query
+from .profiling import is_enabled as is_profiling_enabled, profile_query
+from .models import Division, Employee, Mission, MissionReport
+from .notifications import notify_report
+from .roles import invalidate_roles
+from .search import get_backend as get_search_backend
+from .stats import TABLES as STATS_TABLES
+
+# Relation changes are handled after adds and removes, but before a clear while
+# the rows that are about to disappear can still be queried
+INVALIDATING_ACTIONS = ('post_add', 'post_remove', 'pre_clear')
+
+# Instance attributes carrying dashboard changes from pre_ to post_ signals
+CHANGES_KEY = '_dashboard_changes'
+ASSIGNEES_KEY = '_dashboard_assignees'
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):  # pylint: disable=unused-argument
+    """Apply the configured PRAGMAs, such as WAL journaling, to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'MISSIONS_SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):  # pylint: disable=unused-argument
+    """Count and time the queries of sampled requests on each new connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def profile_queries(sender, connection, **kwargs):  # pylint: disable=unused-argument
+    """Fingerprint the queries of each new connection when query profiling is on"""
+    if is_profiling_enabled() and profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee_roles(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Employee profile changed"""
+    invalidate_roles(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_roles(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Superuser or active status, or the password checked against sessions, may have changed"""
+    invalidate_roles(instance.pk)
+    invalidate_users(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_membership_roles(sender, instance, action, pk_set, **kwargs):  # pylint: disable=unused-argument
+    """Group membership or direct permissions changed, from either side"""
+    if action not in INVALIDATING_ACTIONS:
+        return
+
+    if isinstance(instance, User):
+        invalidate_roles(instance.pk)
+    elif pk_set:
+        invalidate_roles(*pk_set)
+    else:
+        invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permission_roles(sender, instance, action, pk_set, **kwargs):  # pylint: disable=unused-argument
+    """Permissions granted to a group changed; every member is affected"""
+    if action not in INVALIDATING_ACTIONS:
+        return
+
+    if isinstance(instance, Group):
+        groups = [instance.pk]
+    elif isinstance(instance, Permission) and pk_set is None:
+        groups = list(instance.group_set.values_list('pk', flat=True))
+    else:
+        groups = pk_set
+
+    invalidate_roles(*User.objects.filter(groups__in=groups).values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_group_roles(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Deleting a group removes it from every member"""
+    invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_choices(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """An employee was added or removed, or a group renamed or deleted"""
+    invalidate_employee_choices()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_choices(sender, instance, update_fields=None, **kwargs):  # pylint: disable=unused-argument
+    """The user's name may label an employee choice"""
+    if update_fields is not None and set(update_fields) <= {'last_login', 'password'}:
+        return
+
+    invalidate_employee_choices()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_membership_choices(sender, action, **kwargs):  # pylint: disable=unused-argument
+    """Group membership decides who may supervise missions or be assigned reports"""
+    if action in INVALIDATING_ACTIONS:
+        invalidate_employee_choices()
+
+
+@receiver(post_save, sender=Mission)
+@receiver(post_save, sender=MissionReport)
+def index_search_document(sender, instance, raw=False, using=None, **kwargs):  # pylint: disable=unused-argument
+    """Keep the full-text index in step with saved missions and reports"""
+    if raw:
+        return
+
+    get_search_backend(using).index(sender, [instance])
+
+
+@receiver(post_delete, sender=Mission)
+@receiver(post_delete, sender=MissionReport)
+def remove_search_document(sender, instance, using=None, **kwargs):  # pylint: disable=unused-argument
+    """Drop deleted missions and reports from the full-text index"""
+    get_search_backend(using).remove(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Mission)
+@receiver(post_delete, sender=Mission)
+def invalidate_mission_fragments(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Mission details and the reports that name the mission"""
+    bump_versions(('mission', instance.pk))
+
+
+@receiver(post_save, sender=MissionReport)
+@receiver(post_delete, sender=MissionReport)
+def invalidate_mission_report_fragments(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """The report itself and the report list of its mission"""
+    bump_versions(('report', instance.pk), ('mission', instance.mission_id))
+
+
+@receiver(post_save, sender=Division)
+@receiver(post_delete, sender=Division)
+def invalidate_division_fragments(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Missions showing the division name"""
+    bump_versions(('division', instance.pk))
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee_fragments(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Missions and reports naming the employee as supervisor or assignee"""
+    bump_versions(('employee', instance.pk))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_fragments(sender, instance, update_fields=None, **kwargs):  # pylint: disable=unused-argument
+    """Employees are labelled with their user's name"""
+    if update_fields is not None and set(update_fields) <= {'last_login', 'password'}:
+        return
+
+    bump_versions(*(('employee', pk) for pk in
+                    Employee.objects.filter(user=instance).values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=Mission)
+@receiver(post_delete, sender=Mission)
+@receiver(post_save, sender=MissionReport)
+@receiver(post_delete, sender=MissionReport)
+@receiver(post_save, sender=Division)
+@receiver(post_delete, sender=Division)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_statistics(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Statistics reading the changed table are recomputed on their next request"""
+    bump_versions(('stats', STATS_TABLES[sender]))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_statistics(sender, instance, update_fields=None, **kwargs):  # pylint: disable=unused-argument
+    """Assignees are labelled with their user's name"""
+    if update_fields is not None and set(update_fields) <= {'last_login', 'password'}:
+        return
+
+    bump_versions(('stats', 'employee'))
+
+
+# Detail pages answer conditional requests from their updated_at column, and a
+# report page from its mission's as well, so changes to anything else those pages
+# show are folded into them with set-based updates
+
+@receiver(post_save, sender=MissionReport)
+@receiver(post_delete, sender=MissionReport)
+def touch_report_mission(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """A mission page lists its reports"""
+    Mission.objects.filter(pk=instance.mission_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Division)
+@receiver(post_delete, sender=Division)
+def touch_division_missions(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """A mission page names its division"""
+    Mission.objects.filter(division_id=instance.pk).update(updated_at=timezone.now())
+
+
+def touch_employee_pages(employees):
+    """Mission and report pages name their supervisor and assignee"""
+    now = timezone.now()
+
+    Mission.objects.filter(supervisor__in=employees).update(updated_at=now)
+    MissionReport.objects.filter(assigned_to__in=employees).update(updated_at=now)
+
+
+@receiver(post_save, sender=Employee)
+def touch_employee_missions(sender, instance, created, raw=False, **kwargs):  # pylint: disable=unused-argument
+    """Employee profile changed"""
+    if not created and not raw:
+        touch_employee_pages([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def touch_user_missions(sender, instance, created, update_fields=None, **kwargs):  # pylint: disable=unused-argument
+    """Employees are labelled with their user's name"""
+    if created or (update_fields is not None and
+                   set(update_fields) <= {'last_login', 'password'}):
+        return
+
+    touch_employee_pages(Employee.objects.filter(user=instance).values('pk'))
+
+
+@receiver(post_save, sender=MissionReport)
+def notify_assignee(sender, instance, created, raw=False, using=None, **kwargs):  # pylint: disable=unused-argument
+    """Push a new report to its assignee once it is committed"""
+    if raw or not created or instance.assigned_to_id is None:
+        return
+
+    transaction.on_commit(lambda: notify_report(instance), using=using)
+
+
+# Dashboards are edited in place for what a save or delete adds, removes or
+# renames, and rebuilt only for employees whose lists change as a whole. Tracked
+# fields are remembered as loaded, so updates that change none of them do no
+# dashboard work, and the values they had are read only for fields set on an
+# instance loaded without them
+
+@receiver(post_init, sender=Mission)
+@receiver(post_init, sender=MissionReport)
+@receiver(post_init, sender=Employee)
+def remember_dashboard_fields(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Keep what a dashboard shows of a loaded row, to compare saves with"""
+    if instance.pk is not None:
+        dashboards.remember(instance)
+
+
+@receiver(pre_save, sender=Mission)
+@receiver(pre_save, sender=MissionReport)
+@receiver(pre_save, sender=Employee)
+def compare_dashboard_fields(sender, instance, raw=False, using=None, update_fields=None, **kwargs):  # pylint: disable=unused-argument
+    """Work out what a save of an existing row changes, before the row is written"""
+    if not raw:
+        instance.__dict__[CHANGES_KEY] = dashboards.changed_fields(instance, using, update_fields)
+
+
+def saved_changes(instance):
+    """The tracked fields the save changed; resets the comparison"""
+    changes = instance.__dict__.pop(CHANGES_KEY, {})
+    dashboards.remember(instance)
+    return changes
+
+
+@receiver(post_save, sender=Mission)
+def adjust_mission_dashboards(sender, instance, created, raw=False, using=None, **kwargs):  # pylint: disable=unused-argument
+    """The supervisor lists the mission, and its clearance decides who sees its reports"""
+    changes = saved_changes(instance)
+
+    if raw:
+        return
+
+    if created:
+        dashboards.mission_added(instance, using)
+    elif 'security_clearance' in changes:
+        dashboards.refresh({instance.supervisor_id, changes.get('supervisor_id'), *(
+            MissionReport.objects.using(using).filter(mission=instance).values_list(
+                'assigned_to_id', flat=True).distinct())}, using)
+    elif 'supervisor_id' in changes:
+        dashboards.refresh({instance.supervisor_id, changes['supervisor_id']}, using)
+    elif 'name' in changes:
+        dashboards.mission_renamed(instance, using)
+
+
+@receiver(pre_delete, sender=Mission)
+def remember_mission_assignees(sender, instance, using=None, **kwargs):  # pylint: disable=unused-argument
+    """Collect everyone the mission's reports are assigned to before they are deleted with it"""
+    instance.__dict__[ASSIGNEES_KEY] = list(MissionReport.objects.using(using).filter(
+        mission=instance).values_list('assigned_to_id', flat=True).distinct())
+
+
+@receiver(post_delete, sender=Mission)
+def adjust_deleted_mission_dashboards(sender, instance, using=None, **kwargs):  # pylint: disable=unused-argument
+    """The mission leaves its supervisor's list, and its reports every list they were on"""
+    assignees = instance.__dict__.pop(ASSIGNEES_KEY, [])
+
+    if assignees:
+        dashboards.refresh({instance.supervisor_id, *assignees}, using)
+    else:
+        dashboards.mission_removed(instance, using)
+
+
+def is_mission_delete(origin):
+    """Whether a delete was started on missions, whose reports go with them"""
+    return isinstance(origin, Mission) or getattr(origin, 'model', None) is Mission
+
+
+@receiver(post_save, sender=MissionReport)
+def adjust_report_dashboards(sender, instance, created, raw=False, using=None, **kwargs):  # pylint: disable=unused-argument
+    """The assignee and the mission's supervisor list the report"""
+    changes = saved_changes(instance)
+
+    if raw:
+        return
+
+    if created:
+        dashboards.report_changed(instance, dashboards.insert, using)
+    elif 'assigned_to_id' in changes or 'mission_id' in changes:
+        dashboards.refresh({instance.assigned_to_id, changes.get('assigned_to_id'), *(
+            Mission.objects.using(using).filter(pk__in=[
+                instance.mission_id, changes.get('mission_id')]).values_list(
+                    'supervisor_id', flat=True))}, using)
+    elif 'publish_date' in changes:
+        dashboards.report_changed(instance, dashboards.move, using)
+    elif 'title' in changes:
+        dashboards.report_changed(instance, dashboards.update, using)
+
+
+@receiver(post_delete, sender=MissionReport)
+def adjust_deleted_report_dashboards(sender, instance, origin=None, using=None, **kwargs):  # pylint: disable=unused-argument
+    """The report leaves its lists; deleting a mission rebuilds them once instead"""
+    if not is_mission_delete(origin):
+        dashboards.report_changed(instance, dashboards.remove, using)
+
+
+@receiver(post_save, sender=Employee)
+def refresh_employee_dashboard(sender, instance, created, raw=False, using=None, **kwargs):  # pylint: disable=unused-argument
+    """The employee's clearance decides what their dashboard lists"""
+    changes = saved_changes(instance)
+
+    if not raw and (created or changes):
+        dashboards.refresh([instance.pk], using)
@@ -0,0 +1,18 @@
+// Show reports assigned to the user as they are created, without reloading the page
+$(function () {
+  var container = $('#report-notifications');
+
+  if (!container.length || !window.EventSource) {
+    return;
+  }
+
+  var events = new EventSource(container.data('url'));
+
+  events.addEventListener('report', function (event) {
+    var report = JSON.parse(event.data);
+    var link = $('<a class="alert-link">').attr('href', report.url).text(report.title);
+
+    container.prepend($('<div class="alert alert-info" role="status">')
+      .append('New report assigned to you: ').append(link));
+  });
+});
@@ -0,0 +1,26 @@
+// Searchable selects for choice fields with too many options to list in full
+$(function () {
+  $('select[data-typeahead-url]').each(function () {
+    var select = $(this);
+    var search = $('<input type="search" class="form-control mb-1" placeholder="Search">');
+    var pending = null;
+
+    search.insertBefore(select);
+
+    search.on('input', function () {
+      clearTimeout(pending);
+      pending = setTimeout(function () {
+        $.getJSON(select.data('typeahead-url'), { q: search.val() }, function (page) {
+          var selected = select.find('option:selected');
+
+          select.find('option').not(selected).not('[value=""]').remove();
+          $.each(page.results, function (_, choice) {
+            if (String(choice.id) !== selected.val()) {
+              select.append($('<option>').val(choice.id).text(choice.label));
+            }
+          });
+        });
+      }, 250);
+    });
+  });
+});
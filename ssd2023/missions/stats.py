@@ -0,0 +1,213 @@
+"""
+Grouped statistics over the missions and reports a user may see, for charting.
+
+Each statistic is computed by the database with GROUP BY queries, so only the
+groups travel to Python. Results are cached per statistic, parameters and
+visibility scope for MISSIONS_STATS_CACHE_TIMEOUT seconds. Their keys hold the
+version tokens of the tables each statistic reads, which signals bump, so a new
+report recomputes the statistics over reports and leaves the others cached.
+"""
+import hashlib
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min, Q
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from .caching import get_page_cache, get_versions
+from .models import Division, Employee, Mission, MissionReport, SecurityClearance
+
+STATS_KEY = 'missions:stats:{}:{}'
+DEFAULT_STATS_CACHE_TIMEOUT = 300
+
+# Version token of each model's table, bumped by signals when its rows change
+TABLES = {
+    Mission: 'mission',
+    MissionReport: 'report',
+    Division: 'division',
+    Employee: 'employee',
+}
+
+DEFAULT_WEEKS = 12
+MAX_WEEKS = 520
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def get_timeout():
+    """Seconds to keep a computed statistic; 0 disables the cache"""
+    return getattr(settings, 'MISSIONS_STATS_CACHE_TIMEOUT', DEFAULT_STATS_CACHE_TIMEOUT)
+
+
+def get_int_param(params, name, default, maximum):
+    """A positive integer parameter, bounded by a maximum"""
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        value = default
+
+    return max(1, min(value, maximum))
+
+
+def days(duration):
+    """A duration in days, to one decimal place"""
+    return None if duration is None else round(duration.total_seconds() / 86400, 1)
+
+
+def week_start(now, weeks):
+    """Midnight on the Monday starting the earliest of the last given number of weeks"""
+    today = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    return today - timedelta(days=today.weekday(), weeks=weeks - 1)
+
+
+def reports_per_week(missions, reports, weeks, limit):  # pylint: disable=unused-argument
+    """Reports published each week by division, over the last given number of weeks"""
+    rows = reports.filter(publish_date__gte=week_start(timezone.now(), weeks)).annotate(
+        week=TruncWeek('publish_date')).values(
+            'week', 'mission__division', 'mission__division__name').annotate(
+                reports=Count('pk')).order_by('week', 'mission__division')
+
+    return [{
+        'week': row['week'].date().isoformat(),
+        'division_id': row['mission__division'],
+        'division': row['mission__division__name'],
+        'reports': row['reports'],
+    } for row in rows]
+
+
+def reports_per_mission(missions, reports, weeks, limit):  # pylint: disable=unused-argument
+    """Missions with the most reports"""
+    rows = reports.values('mission', 'mission__name').annotate(
+        reports=Count('pk')).order_by('-reports', 'mission')[:limit]
+
+    return [{'mission_id': row['mission'], 'mission': row['mission__name'],
+             'reports': row['reports']} for row in rows]
+
+
+def reports_per_division(missions, reports, weeks, limit):  # pylint: disable=unused-argument
+    """Reports on the missions of each division"""
+    rows = reports.values('mission__division', 'mission__division__name').annotate(
+        reports=Count('pk')).order_by('mission__division')
+
+    return [{'division_id': row['mission__division'], 'division': row['mission__division__name'],
+             'reports': row['reports']} for row in rows]
+
+
+def reports_per_assignee(missions, reports, weeks, limit):  # pylint: disable=unused-argument
+    """Employees assigned the most reports"""
+    rows = reports.values(
+        'assigned_to', 'assigned_to__user__first_name', 'assigned_to__user__last_name',
+        'assigned_to__user__username').annotate(
+            reports=Count('pk')).order_by('-reports', 'assigned_to')[:limit]
+
+    return [{
+        'employee_id': row['assigned_to'],
+        'employee': None if row['assigned_to'] is None else Employee.label(
+            row['assigned_to__user__first_name'], row['assigned_to__user__last_name'],
+            row['assigned_to__user__username']),
+        'reports': row['reports'],
+    } for row in rows]
+
+
+def mission_duration(missions, reports, weeks, limit):  # pylint: disable=unused-argument
+    """Days from start to end of the completed missions of each division"""
+    completed = Q(start_date__isnull=False, end_date__isnull=False)
+    rows = missions.annotate(duration=ExpressionWrapper(
+        F('end_date') - F('start_date'), output_field=DurationField())).values(
+            'division', 'division__name').annotate(
+                missions=Count('pk'), completed=Count('pk', filter=completed),
+                average=Avg('duration', filter=completed),
+                shortest=Min('duration', filter=completed),
+                longest=Max('duration', filter=completed)).order_by('division')
+
+    return [{
+        'division_id': row['division'],
+        'division': row['division__name'],
+        'missions': row['missions'],
+        'completed': row['completed'],
+        'average_days': days(row['average']),
+        'shortest_days': days(row['shortest']),
+        'longest_days': days(row['longest']),
+    } for row in rows]
+
+
+def clearance_distribution(missions, reports, weeks, limit):  # pylint: disable=unused-argument
+    """Missions and reports at each security clearance"""
+    mission_counts = dict(missions.values_list('security_clearance').annotate(
+        count=Count('pk')).order_by())
+    report_counts = dict(reports.values_list('mission__security_clearance').annotate(
+        count=Count('pk')).order_by())
+
+    return [{
+        'security_clearance': value,
+        'label': label,
+        'missions': mission_counts.get(value, 0),
+        'reports': report_counts.get(value, 0),
+    } for value, label in SecurityClearance.choices]
+
+
+# Name: (function, tables whose changes invalidate it, parameters it takes)
+STATISTICS = {
+    'reports-per-week': (reports_per_week, ('mission', 'report', 'division'), ('weeks',)),
+    'reports-per-mission': (reports_per_mission, ('mission', 'report'), ('limit',)),
+    'reports-per-division': (reports_per_division, ('mission', 'report', 'division'), ()),
+    'reports-per-assignee': (reports_per_assignee, ('mission', 'report', 'employee'), ('limit',)),
+    'mission-duration': (mission_duration, ('mission', 'division'), ()),
+    'clearance-distribution': (clearance_distribution, ('mission', 'report'), ()),
+}
+
+
+def stats_scope(roles):
+    """What the holder of the given roles sees of missions and reports, as a cache key part"""
+    if roles.is_superuser:
+        return 'all'
+
+    if roles.employee_id is None or roles.security_clearance is None:
+        return 'none'
+
+    if roles.is_iss_admin:
+        return f"clearance:{roles.security_clearance}"
+
+    return f"employee:{roles.employee_id}:{roles.security_clearance}"
+
+
+def stats_key(name, roles, options):
+    """Cache key of a statistic over the current versions of the tables it reads"""
+    _, tables, params = STATISTICS[name]
+    versions = get_versions(*(('stats', table) for table in tables))
+    parts = [stats_scope(roles), *(f"{param}={options[param]}" for param in params),
+             *(str(version) for version in versions)]
+
+    return STATS_KEY.format(name, hashlib.sha256('|'.join(parts).encode()).hexdigest())
+
+
+def compute(name, roles, weeks=DEFAULT_WEEKS, limit=DEFAULT_LIMIT):
+    """Run a statistic's queries over the missions and reports visible with the given roles"""
+    function, _, _ = STATISTICS[name]
+
+    return {
+        'generated_at': timezone.now().isoformat(),
+        'rows': function(Mission.objects.visible_to(roles),
+                         MissionReport.objects.visible_to(roles), weeks, limit),
+    }
+
+
+def get_statistic(name, roles, weeks=DEFAULT_WEEKS, limit=DEFAULT_LIMIT, refresh=False):
+    """A statistic from the cache, computing and storing it on a miss or when refreshing"""
+    timeout = get_timeout()
+
+    if not timeout:
+        return compute(name, roles, weeks, limit)
+
+    cache = get_page_cache()
+    key = stats_key(name, roles, {'weeks': weeks, 'limit': limit})
+    statistic = None if refresh else cache.get(key)
+
+    if statistic is None:
+        statistic = compute(name, roles, weeks, limit)
+        cache.set(key, statistic, timeout)
+
+    return statistic
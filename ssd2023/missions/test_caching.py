@@ -0,0 +1,591 @@
+"""Tests of caching, conditional requests, replicas and query budgets"""
+import re
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connection, models, router
+from django.http import HttpResponse, HttpResponseRedirect
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import AnonymousUser, User, Permission
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.functional import SimpleLazyObject
+from django_cryptography.core.signing import BadSignature
+from django_cryptography.fields import encrypt
+
+from . import views
+from .models import (Division, Mission, MissionReport, Employee, SecurityClearance, ISS_ADMIN_GROUP,
+                     NASA_ADMIN_GROUP)
+from .backends import RoleBackend
+from .caching import get_stats
+from .fields import Ciphertext
+from .roles import get_roles
+from .routers import PIN_COOKIE, pin_to_primary, read_from_replica
+from .testcases import StaffMixin
+
+
+class QueryBudgetTestCase(StaffMixin, TestCase):
+    """
+    Pin the number of queries each endpoint may run.
+
+    Fixtures are sized so that any per-row lazy load shows up as a budget overrun.
+    """
+
+    EMPLOYEES = 30
+    MISSIONS = 20
+    REPORTS = 60
+
+    def setUp(self):
+        """Set up groups, a realistic number of staff, missions and reports"""
+        # Bulk inserts bypass the signals that invalidate cached roles and fragments
+        cache.clear()
+        caches['pages'].clear()
+        self.client = Client()
+
+        iss_admins, nasa_admins = self.create_groups(
+            iss_permissions=['add_mission', 'change_mission', 'delete_mission', 'view_mission',
+                             'add_missionreport', 'view_missionreport'],
+            nasa_permissions=['view_missionreport'])
+        self.iss_user = self.create_user('juan.mortyme', ISS_ADMIN_GROUP)
+        self.nasa_user = self.create_user('ella.vader', NASA_ADMIN_GROUP)
+        self.create_superuser()
+
+        division = Division.objects.create(name='Operations')
+        supervisor = Employee.objects.create(
+            user=self.iss_user, division=division,
+            security_clearance=SecurityClearance.TOP_SECRET)
+        self.assignee = Employee.objects.create(
+            user=self.nasa_user, division=division,
+            security_clearance=SecurityClearance.TOP_SECRET)
+
+        staff = User.objects.bulk_create([
+            User(username=f"staff.{number}", first_name='Staff', last_name=str(number))
+            for number in range(self.EMPLOYEES)
+        ])
+        for user in staff[::2]:
+            user.groups.add(nasa_admins)
+        for user in staff[1::2]:
+            user.groups.add(iss_admins)
+        employees = Employee.objects.bulk_create([
+            Employee(user=user, division=division,
+                     security_clearance=SecurityClearance.SECRET)
+            for user in staff
+        ])
+
+        self.missions = Mission.objects.bulk_create([
+            Mission(name=f"Mission {number}", division=division,
+                    supervisor=supervisor if number % 2 else employees[1],
+                    security_clearance=SecurityClearance.BASELINE)
+            for number in range(self.MISSIONS)
+        ])
+
+        publish_date = timezone.now()
+        self.reports = MissionReport.objects.bulk_create([
+            MissionReport(title=f"Report {number}",
+                          mission=self.missions[number % 2], sequence=number + 1,
+                          assigned_to=self.assignee if number % 3 else employees[0],
+                          publish_date=publish_date - timedelta(minutes=number),
+                          summary='Summary')
+            for number in range(self.REPORTS)
+        ])
+
+    def assertMaxQueries(self, budget, path, data=None, method='get'):  # pylint: disable=invalid-name
+        """Request a path and fail if it runs more than the given number of queries"""
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data)
+
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(
+            len(context), budget,
+            f"{path} ran {len(context)} queries:\n" +
+            "\n".join(query['sql'] for query in context.captured_queries))
+
+        return response
+
+    def test_index_query_budget(self):
+        """Test query count of the index page for each role"""
+        for username in ('admin', 'juan.mortyme', 'ella.vader'):
+            self.client.login(username=username, password='password')
+            self.assertMaxQueries(10, '/')
+
+    def test_mission_details_query_budget(self):
+        """Test query count of the mission details page"""
+        self.client.login(username='juan.mortyme', password='password')
+        self.assertMaxQueries(13, f"/mission/{self.missions[1].pk}")
+
+    def test_mission_create_query_budget(self):
+        """Test query count of the mission creation form"""
+        self.client.login(username='juan.mortyme', password='password')
+        self.assertMaxQueries(10, '/mission/create')
+
+    def test_mission_update_query_budget(self):
+        """Test query count of the mission update form"""
+        self.client.login(username='juan.mortyme', password='password')
+        self.assertMaxQueries(11, f"/mission/{self.missions[1].pk}/update")
+
+    def test_mission_report_details_query_budget(self):
+        """Test query count of the mission report details page"""
+        self.client.login(username='ella.vader', password='password')
+        self.assertMaxQueries(8, f"/mission-report/{self.reports[1].pk}")
+
+    def test_mission_report_generate_query_budget(self):
+        """Test query count of generating a mission report"""
+        self.client.login(username='juan.mortyme', password='password')
+        self.assertMaxQueries(18, f"/mission-report/generate/{self.missions[1].pk}", {
+            'assigned_to': self.assignee.pk,
+            'report_summary': 'Summary',
+        }, method='post')
+
+
+@override_settings(MISSIONS_ROLE_CACHE_TIMEOUT=300)
+class RoleResolutionTestCase(StaffMixin, TestCase):
+    """Test cases for the per-request and cached role resolver"""
+
+    def setUp(self):
+        """Set up an ISS admin with an employee profile"""
+        caches['sessions'].clear()
+        self.client = Client()
+
+        self.iss_admins, _ = self.create_groups(iss_permissions=['add_mission'])
+        self.user = self.create_user('juan.mortyme', ISS_ADMIN_GROUP)
+        self.employee = Employee.objects.create(
+            user=self.user,
+            security_clearance=SecurityClearance.SECRET
+        )
+
+    def fresh_user(self):
+        """The user as a new request would load it"""
+        return User.objects.get(pk=self.user.pk)
+
+    def test_should_resolve_employee_groups_and_permissions(self):
+        """Test that the resolved roles reflect the database"""
+        roles = get_roles(self.fresh_user())
+
+        self.assertEqual(roles.employee_id, self.employee.pk)
+        self.assertEqual(roles.security_clearance, SecurityClearance.SECRET)
+        self.assertTrue(roles.is_iss_admin)
+        self.assertFalse(roles.is_nasa_admin)
+        self.assertTrue(roles.has_perm('missions.add_mission'))
+
+    def test_should_serve_repeat_lookups_from_cache(self):
+        """Test that permission checks reuse the resolved roles"""
+        get_roles(self.fresh_user())
+
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('missions.add_mission'))
+            self.assertFalse(user.has_perm('missions.delete_mission'))
+            self.assertTrue(get_roles(user).is_iss_admin)
+
+    @override_settings(MISSIONS_ROLE_CACHE_TIMEOUT=0)
+    def test_should_only_keep_roles_for_the_request_by_default(self):
+        """Test that without a role cache each request resolves the roles once"""
+        get_roles(self.fresh_user())
+
+        user = self.fresh_user()
+        with self.assertNumQueries(3):
+            get_roles(user)
+            self.assertTrue(user.has_perm('missions.add_mission'))
+
+    def test_should_invalidate_on_group_membership_change(self):
+        """Test that leaving a group is visible on the next request"""
+        get_roles(self.fresh_user())
+
+        self.iss_admins.user_set.remove(self.user)
+
+        roles = get_roles(self.fresh_user())
+        self.assertFalse(roles.is_iss_admin)
+        self.assertFalse(roles.has_perm('missions.add_mission'))
+
+    def test_should_invalidate_on_group_permission_change(self):
+        """Test that a permission granted to a group reaches its members"""
+        get_roles(self.fresh_user())
+
+        self.iss_admins.permissions.add(Permission.objects.get(codename='delete_mission'))
+
+        self.assertTrue(get_roles(self.fresh_user()).has_perm('missions.delete_mission'))
+
+    def test_should_invalidate_on_employee_change(self):
+        """Test that a clearance change is visible on the next request"""
+        get_roles(self.fresh_user())
+
+        self.employee.security_clearance = SecurityClearance.TOP_SECRET
+        self.employee.save()
+
+        self.assertEqual(get_roles(self.fresh_user()).security_clearance,
+                         SecurityClearance.TOP_SECRET)
+
+
+class FragmentCacheTestCase(StaffMixin, TestCase):
+    """Test cases for cached mission and report detail fragments"""
+
+    def setUp(self):
+        """Set up a superuser with a mission and a report"""
+        caches['pages'].clear()
+        self.client = Client()
+
+        admin = self.create_superuser()
+        self.division = Division.objects.create(name='Operations')
+        self.employee = Employee.objects.create(
+            user=admin, division=self.division, security_clearance=SecurityClearance.TOP_SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', division=self.division, supervisor=self.employee,
+            security_clearance=SecurityClearance.BASELINE)
+        self.report = MissionReport.objects.create(
+            mission=self.mission, assigned_to=self.employee,
+            publish_date=timezone.now(), summary='Summary')
+
+        self.client.login(username='admin', password='password')
+
+    def get(self, path):
+        """Fetch a page and return its content"""
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+
+        return response.content.decode()
+
+    def test_should_serve_repeat_views_from_cache(self):
+        """Test that a second view of a report is a cache hit that skips the join"""
+        admin = User.objects.get(username='admin')
+        get_roles(admin)
+        RoleBackend().get_user(admin.pk)
+
+        with CaptureQueriesContext(connection) as cold:
+            self.get(f"/mission-report/{self.report.pk}")
+        before = get_stats()
+
+        with CaptureQueriesContext(connection) as warm:
+            self.get(f"/mission-report/{self.report.pk}")
+
+        self.assertEqual(get_stats()['hits'], before['hits'] + 1)
+        self.assertEqual(len(warm), len(cold) - 1)
+
+    def test_should_invalidate_report_when_mission_renamed(self):
+        """Test that a report page names the mission's current name"""
+        self.get(f"/mission-report/{self.report.pk}")
+
+        self.mission.name = 'Renamed mission'
+        self.mission.save()
+
+        self.assertIn('Renamed mission', self.get(f"/mission-report/{self.report.pk}"))
+
+    def test_should_invalidate_mission_when_report_added(self):
+        """Test that new reports appear on a cached mission page"""
+        self.get(f"/mission/{self.mission.pk}")
+
+        MissionReport.objects.create(
+            mission=self.mission, title='Fresh report',
+            publish_date=timezone.now(), summary='Summary')
+
+        self.assertIn('Fresh report', self.get(f"/mission/{self.mission.pk}"))
+
+    def test_should_invalidate_mission_when_division_or_supervisor_changes(self):
+        """Test that related names shown on a mission page stay current"""
+        self.get(f"/mission/{self.mission.pk}")
+
+        self.division.name = 'Logistics'
+        self.division.save()
+        self.employee.user.first_name, self.employee.user.last_name = 'Ada', 'Admin'
+        self.employee.user.save()
+
+        content = self.get(f"/mission/{self.mission.pk}")
+        self.assertIn('Logistics', content)
+        self.assertIn('Ada Admin', content)
+
+    def test_should_not_cache_csrf_token(self):
+        """Test that each session gets its own CSRF token on a cached mission page"""
+        first = self.get(f"/mission/{self.mission.pk}")
+
+        other = Client()
+        other.login(username='admin', password='password')
+        second = other.get(f"/mission/{self.mission.pk}").content.decode()
+
+        token = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+        self.assertNotEqual(token.search(first).group(1), token.search(second).group(1))
+
+
+class ConditionalRequestTestCase(StaffMixin, TestCase):
+    """Test cases for ETag and Last-Modified handling on detail pages"""
+
+    def setUp(self):
+        """Set up a superuser with a mission and a report"""
+        self.client = Client()
+
+        admin = self.create_superuser()
+        self.employee = Employee.objects.create(
+            user=admin, security_clearance=SecurityClearance.TOP_SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', supervisor=self.employee,
+            security_clearance=SecurityClearance.BASELINE)
+        self.report = MissionReport.objects.create(
+            mission=self.mission, assigned_to=self.employee,
+            publish_date=timezone.now(), summary='Summary')
+
+        self.client.login(username='admin', password='password')
+
+    def revalidate(self, path):
+        """Fetch a page, then fetch it again with its validators"""
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+
+        return response, self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_should_answer_unchanged_report_with_not_modified(self):
+        """Test a 304 without rendering for an unchanged report"""
+        first, second = self.revalidate(f"/mission-report/{self.report.pk}")
+
+        self.assertIn('Last-Modified', first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+    def test_should_honour_if_modified_since(self):
+        """Test revalidation by modification time alone"""
+        first = self.client.get(f"/mission-report/{self.report.pk}")
+
+        response = self.client.get(f"/mission-report/{self.report.pk}",
+                                   HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_should_send_fresh_report_after_mission_renamed(self):
+        """Test that a change to the mission shown on a report page changes its ETag"""
+        first = self.client.get(f"/mission-report/{self.report.pk}")
+
+        self.mission.name = 'Renamed mission'
+
+        # The report's own row is left alone; its page is dated by its mission too
+        with CaptureQueriesContext(connection) as context:
+            self.mission.save()
+
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('UPDATE "missions_missionreport"')])
+
+        second = self.client.get(f"/mission-report/{self.report.pk}",
+                                 HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertContains(second, 'Renamed mission')
+        self.assertEqual(second['Last-Modified'], http_date(
+            Mission.objects.get(pk=self.mission.pk).updated_at.timestamp()))
+
+    def test_should_send_fresh_mission_after_report_added(self):
+        """Test that a new report changes the mission page's ETag"""
+        self.client.get(f"/mission/{self.mission.pk}")
+        first, second = self.revalidate(f"/mission/{self.mission.pk}")
+        self.assertEqual(second.status_code, 304)
+
+        MissionReport.objects.create(
+            mission=self.mission, publish_date=timezone.now(), summary='Summary')
+
+        third = self.client.get(f"/mission/{self.mission.pk}", HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, 200)
+
+    def test_should_vary_mission_etag_by_viewer(self):
+        """Test that two sessions never share a mission page validator"""
+        first = self.client.get(f"/mission/{self.mission.pk}")
+
+        other = Client()
+        other.login(username='admin', password='password')
+        other.get(f"/mission/{self.mission.pk}")
+
+        response = other.get(f"/mission/{self.mission.pk}", HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MISSIONS_READ_REPLICAS=['replica_1'], MISSIONS_REPLICA_LAG=5)
+class DatabaseRouterTestCase(StaffMixin, TestCase):
+    """Test cases for routing read-only views to replicas"""
+
+    def setUp(self):
+        """Set up a request factory"""
+        self.factory = RequestFactory()
+
+    @staticmethod
+    @read_from_replica
+    def read_view(request):  # pylint: disable=unused-argument
+        """Report where a read-only view reads missions from"""
+        return HttpResponse(router.db_for_read(Mission))
+
+    def test_should_read_from_replica_only_in_read_only_views(self):
+        """Test reads go to the primary outside read-only views, and writes always do"""
+        response = self.read_view(self.factory.get('/'))
+
+        self.assertEqual(response.content, b'replica_1')
+        self.assertEqual(router.db_for_read(Mission), 'default')
+        self.assertEqual(router.db_for_write(Mission), 'default')
+
+    def test_should_pin_browser_to_primary_after_write(self):
+        """Test a redirect from a write view makes that browser read the primary"""
+        write_view = pin_to_primary(lambda request: HttpResponseRedirect('/mission/1'))
+        response = write_view(self.factory.post('/mission/create'))
+
+        request = self.factory.get('/mission/1')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+
+        self.assertEqual(self.read_view(request).content, b'default')
+
+    def test_should_load_session_users_from_primary(self):
+        """Test read-only views check their user before reading from replicas"""
+        aliases = []
+
+        def load_user():
+            aliases.append(router.db_for_read(User))
+            return AnonymousUser()
+
+        for view, args in ((views.index, ()), (views.mission_details, (1,)),
+                           (views.mission_report_details, (1,)), (views.statistics, ())):
+            request = self.factory.get('/')
+            request.user = SimpleLazyObject(load_user)
+
+            self.assertEqual(view(request, *args).status_code, 302)
+
+        self.assertEqual(aliases, ['default'] * 4)
+
+    def test_should_pin_browser_after_logging_in(self):
+        """Test logging in makes the browser read its new session from the primary"""
+        self.create_user('ella.vader')
+
+        for urlconf in ('ssd2023.urls', 'missions.async_urls'):
+            with override_settings(ROOT_URLCONF=urlconf):
+                response = Client().post('/login', {'username': 'ella.vader',
+                                                    'password': 'password'})
+
+            self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_should_not_pin_when_view_does_not_redirect(self):
+        """Test that rendering a form does not pin the browser"""
+        write_view = pin_to_primary(lambda request: HttpResponse('form'))
+
+        self.assertNotIn(PIN_COOKIE, write_view(self.factory.get('/mission/create')).cookies)
+
+
+class LazyEncryptedFieldTestCase(StaffMixin, TestCase):
+    """Test cases for the lazily decrypted social security number"""
+
+    def setUp(self):
+        """Set up an employee with a social security number"""
+        self.field = Employee._meta.get_field('social_security_number')
+        self.employee = Employee.objects.create(
+            user=self.create_user('ella.vader'),
+            social_security_number='123456789',
+            security_clearance=SecurityClearance.TOP_SECRET)
+
+    def stored(self):
+        """The raw column value"""
+        return bytes(Employee.objects.filter(pk=self.employee.pk).values_list(
+            'social_security_number', flat=True).get())
+
+    def test_should_decrypt_only_when_read(self):
+        """Test loading keeps the ciphertext until the attribute is read"""
+        employee = Employee.objects.get(pk=self.employee.pk)
+
+        self.assertIsInstance(employee.__dict__['social_security_number'], Ciphertext)
+        self.assertEqual(employee.social_security_number, '123456789')
+        self.assertEqual(employee.__dict__['social_security_number'], '123456789')
+
+    def test_should_read_and_write_django_cryptography_tokens(self):
+        """Test values stay readable by, and can be read from, encrypt() fields"""
+        eager = encrypt(models.CharField(max_length=9))
+
+        # pylint: disable=protected-access
+        self.assertEqual(eager._load(self.stored()), '123456789')
+        self.assertEqual(self.field.decrypt(eager._dump('987654321')), '987654321')
+
+    def test_should_save_unread_value_unchanged(self):
+        """Test saving an employee does not re-encrypt a number that was not read"""
+        before = self.stored()
+
+        employee = Employee.objects.get(pk=self.employee.pk)
+        employee.address = '1 Launch Pad'
+        employee.save()
+
+        self.assertEqual(self.stored(), before)
+
+        employee.social_security_number = '987654321'
+        employee.save()
+
+        self.assertEqual(Employee.objects.get(pk=self.employee.pk).social_security_number,
+                         '987654321')
+
+    def test_should_encrypt_and_decrypt_in_bulk(self):
+        """Test the batch helpers used by imports and exports"""
+        tokens = self.field.encrypt_many(['111111111', None, ''])
+
+        self.assertIsNone(tokens[1])
+        self.assertEqual(self.field.decrypt_many(tokens), ['111111111', None, ''])
+        self.assertEqual(self.field.decrypt_many(Employee.objects.values_list(
+            'social_security_number', flat=True)), ['123456789'])
+
+    def test_should_reject_tampered_values(self):
+        """Test a modified token fails authentication"""
+        token = bytearray(self.stored())
+        token[20] ^= 1
+
+        with self.assertRaises(BadSignature):
+            self.field.decrypt(Ciphertext(token))
+
+
+@override_settings(SESSION_ENGINE='missions.sessions', MISSIONS_USER_CACHE_TIMEOUT=300)
+class SessionCacheTestCase(StaffMixin, TestCase):
+    """Test cases for the cached sessions and users of authenticated requests"""
+
+    def setUp(self):
+        """Set up a logged in superuser, from cold caches"""
+        cache.clear()
+        caches['sessions'].clear()
+        self.client = Client()
+        self.admin = self.create_superuser()
+        self.client.login(username='admin', password='password')
+
+    def auth_queries(self, path='/search'):
+        """Queries of a request that read the session or the user"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(path)
+
+        return [query['sql'] for query in queries
+                if 'django_session' in query['sql'] or '"auth_user"' in query['sql']]
+
+    def test_should_read_session_and_user_from_cache(self):
+        """Test that after the first request neither the session nor the user is queried"""
+        self.auth_queries()
+
+        self.assertEqual(self.auth_queries(), [])
+
+    @override_settings(MISSIONS_SESSION_CACHE_TIMEOUT=0, MISSIONS_USER_CACHE_TIMEOUT=0)
+    def test_should_query_every_request_without_caching(self):
+        """Test the session and user are read from the database when caching is off"""
+        # Logging in cached the session before caching was turned off
+        caches['sessions'].clear()
+        self.auth_queries()
+
+        self.assertEqual(len(self.auth_queries()), 2)
+
+    def test_should_log_out_deactivated_users(self):
+        """Test that deactivating a cached user ends their sessions"""
+        self.auth_queries()
+        self.admin.is_active = False
+        self.admin.save()
+
+        self.assertEqual(self.client.get('/search').status_code, 302)
+
+    def test_should_not_reuse_cached_session_after_logout(self):
+        """Test a session ended by logging out cannot be used again"""
+        self.auth_queries()
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.client.get('/logout')
+
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session
+        self.assertRedirects(self.client.get('/search'), '/login?next=/search',
+                             fetch_redirect_response=False)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_should_log_in_with_signed_cookie_sessions(self):
+        """Test sessions can be kept in the browser, without a session query"""
+        client = Client()
+        response = client.post('/login', {'username': 'admin', 'password': 'password'})
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.client = client
+        self.assertEqual([sql for sql in self.auth_queries() if 'django_session' in sql], [])
@@ -0,0 +1,214 @@
+"""Tests of the benchmark, load test and import and export commands"""
+import json
+import os
+import tempfile
+
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Division, Mission, MissionReport, Employee, ReportJob, SecurityClearance
+from .testcases import StaffMixin
+from .transfer import TransferError, import_rows
+
+
+class BenchmarkIndexesCommandTestCase(TransactionTestCase):
+    """Test cases for the index benchmark management command"""
+
+    def test_should_seed_and_report_plans_with_and_without_indexes(self):
+        """Test that the command seeds data, reports both runs and restores the indexes"""
+        output = StringIO()
+
+        call_command('benchmark_indexes', '--seed', '--reports', '50', '--missions', '5',
+                     '--employees', '4', '--repeat', '1', stdout=output)
+
+        self.assertEqual(MissionReport.objects.count(), 50)
+        self.assertIn('without indexes', output.getvalue())
+        self.assertIn('report_assignee_published_idx', output.getvalue())
+
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(
+                cursor, MissionReport._meta.db_table)
+        self.assertIn('report_mission_published_idx', indexes)
+
+
+class ImportExportCommandTestCase(TestCase):
+    """Test cases for the streaming import and export management commands"""
+
+    DATASETS = ('divisions', 'employees', 'missions', 'reports')
+
+    def setUp(self):
+        """Set up one record of each kind"""
+        division = Division.objects.create(name='Operations')
+        supervisor = Employee.objects.create(
+            user=User.objects.create_user('juan.mortyme', first_name='Juan', last_name='Mortyme'),
+            division=division, social_security_number='123456789',
+            security_clearance=SecurityClearance.SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', description='Description, "quoted"', division=division,
+            supervisor=supervisor, start_date=timezone.now(),
+            security_clearance=SecurityClearance.BASELINE)
+        MissionReport.objects.create(
+            mission=self.mission, assigned_to=supervisor,
+            publish_date=timezone.now(), summary='Summary')
+
+    def export(self, dataset, file_format, *args):
+        """Export a dataset to a string"""
+        output = StringIO()
+        call_command('export_missions', dataset, '--format', file_format, *args, stdout=output)
+
+        return output.getvalue()
+
+    def round_trip(self, file_format):
+        """Export everything, empty the tables and import it again"""
+        exported = {dataset: self.export(dataset, file_format) for dataset in self.DATASETS}
+
+        Division.objects.all().delete()
+        Employee.objects.all().delete()
+
+        with tempfile.TemporaryDirectory() as directory:
+            for dataset in self.DATASETS:
+                path = os.path.join(directory, dataset)
+
+                with open(path, 'w', encoding='utf-8', newline='') as file:
+                    file.write(exported[dataset])
+
+                call_command('import_missions', dataset, path, '--format', file_format,
+                             '--batch-size', '1', stdout=StringIO())
+
+        return exported
+
+    def assert_restored(self):
+        """Check that every record came back intact"""
+        mission = Mission.objects.select_related('division', 'supervisor__user').get()
+        report = MissionReport.objects.get()
+
+        self.assertEqual(mission.pk, self.mission.pk)
+        self.assertEqual(mission.description, self.mission.description)
+        self.assertEqual(mission.start_date, self.mission.start_date)
+        self.assertEqual(mission.division.name, 'Operations')
+        self.assertEqual(mission.supervisor.user.username, 'juan.mortyme')
+        self.assertEqual(mission.report_sequence, 1)
+        self.assertEqual((report.mission_id, report.sequence), (mission.pk, 1))
+
+    def test_should_round_trip_ndjson(self):
+        """Test exporting and re-importing newline-delimited JSON"""
+        self.round_trip('ndjson')
+        self.assert_restored()
+
+    def test_should_round_trip_csv(self):
+        """Test exporting and re-importing CSV"""
+        self.round_trip('csv')
+        self.assert_restored()
+
+    def test_should_only_export_ssn_on_request(self):
+        """Test that social security numbers are left encrypted unless asked for"""
+        self.assertNotIn('123456789', self.export('employees', 'csv'))
+        self.assertIn('123456789', self.export('employees', 'csv', '--include-ssn'))
+
+    def test_should_report_invalid_rows(self):
+        """Test that a malformed row aborts the import with a command error"""
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as file:
+            file.write(json.dumps({'id': 'x', 'name': 'Bad'}) + '\n')
+
+        try:
+            with self.assertRaises(CommandError):
+                call_command('import_missions', 'divisions', file.name, stdout=StringIO())
+        finally:
+            os.unlink(file.name)
+
+
+    def test_should_report_conflicts_and_committed_batches(self):
+        """Test a batch that breaks a constraint is rolled back, keeping earlier batches"""
+        rows = [{'id': 900, 'name': 'Science'}, {'id': self.mission.division_id, 'name': 'Taken'}]
+
+        with self.assertRaisesMessage(TransferError, '1 batches (1 rows) before it were committed'):
+            import_rows('divisions', rows, batch_size=1)
+
+        self.assertEqual(Division.objects.get(pk=900).name, 'Science')
+        self.assertEqual(Division.objects.get(pk=self.mission.division_id).name, 'Operations')
+
+    def test_should_not_keep_users_of_failed_employee_batches(self):
+        """Test users created for a batch of employees go with it when it fails"""
+        rows = [{'id': 900, 'user__username': 'ella.vader', 'security_clearance': '1'},
+                {'id': 901, 'security_clearance': '1'}]
+
+        with self.assertRaisesMessage(TransferError, "missing column 'user__username'"):
+            import_rows('employees', rows)
+
+        self.assertFalse(User.objects.filter(username='ella.vader').exists())
+
+
+class BenchmarkServersCommandTestCase(StaffMixin, TransactionTestCase):
+    """Test cases for the WSGI and ASGI load test command"""
+
+    def test_should_report_latency_of_each_stack(self):
+        """Test that every stack serves the pages without errors"""
+        self.create_superuser()
+        employee = Employee.objects.create(
+            user=self.create_user('ella.vader'),
+            security_clearance=SecurityClearance.TOP_SECRET)
+        mission = Mission.objects.create(
+            name='Mission 1', supervisor=employee, security_clearance=SecurityClearance.BASELINE)
+        MissionReport.objects.create(
+            mission=mission, assigned_to=employee, publish_date=timezone.now(), summary='Summary')
+
+        output = StringIO()
+        call_command('benchmark_servers', '--requests', '6', '--concurrency', '3',
+                     '--host', 'testserver', stdout=output)
+
+        rows = {line.split()[0]: line.split() for line in output.getvalue().splitlines()[2:]}
+
+        self.assertEqual(set(rows), {'wsgi', 'asgi-sync', 'asgi-async'})
+        self.assertTrue(all(row[-1] == '0' for row in rows.values()))
+
+
+class LoadTestCommandTestCase(TransactionTestCase):
+    """Test cases for the seeding and scripted load test commands"""
+
+    def test_should_run_every_scenario_against_seeded_data(self):
+        """Test the seeded users can log in and every scenario runs without errors"""
+        call_command('seed_missions', '--divisions', '2', '--employees', '4', '--missions', '6',
+                     '--reports', '12', '--password', 'password', stdout=StringIO())
+
+        self.assertTrue(User.objects.get(username='seed-admin').is_superuser)
+        self.assertEqual(MissionReport.objects.count(), 12)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('loadtest', '--iterations', '2', '--concurrency', '1',
+                         '--host', 'testserver', '--json', path, stdout=StringIO())
+
+            with open(path, encoding='utf-8') as results:
+                scenarios = json.load(results)['scenarios']
+
+        self.assertEqual(set(scenarios), {'login', 'index-superuser', 'index-iss', 'index-nasa',
+                                          'mission-details', 'report-generation'})
+        self.assertTrue(all(summary['errors'] == 0 for summary in scenarios.values()))
+        self.assertTrue(all(summary['queries'] > 0 for summary in scenarios.values()))
+        self.assertEqual(ReportJob.objects.count(), 2)
+
+
+class BenchmarkLoginsCommandTestCase(TransactionTestCase):
+    """Test cases for the login benchmark across session engines"""
+
+    def test_should_benchmark_every_session_engine(self):
+        """Test the seeded NASA admin logs in without errors with each engine"""
+        call_command('seed_missions', '--divisions', '1', '--employees', '2', '--missions', '2',
+                     '--reports', '2', '--password', 'password', stdout=StringIO())
+        output = StringIO()
+
+        call_command('benchmark_logins', '--iterations', '1', '--concurrency', '1',
+                     '--host', 'testserver', stdout=output)
+
+        rows = [line.split() for line in output.getvalue().splitlines()[2:]]
+
+        self.assertEqual({(row[0], row[1]) for row in rows},
+                         {(engine, scenario) for engine in settings.SESSION_ENGINES
+                          for scenario in ('login', 'index-nasa')})
+        self.assertTrue(all(row[-1] == '0' for row in rows))
@@ -0,0 +1,368 @@
+"""Tests of the materialised dashboards and bulk mission changes"""
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import dashboards
+from .models import (Dashboard, Division, Mission, MissionReport, Employee, ReportJob,
+                     SecurityClearance, ISS_ADMIN_GROUP, NASA_ADMIN_GROUP)
+from .testcases import StaffMixin
+
+
+class DashboardTestCase(StaffMixin, TestCase):
+    """Test cases for the materialised index pages of employees"""
+
+    def setUp(self):
+        """Set up a SECRET ISS admin supervising missions either side of their clearance"""
+        cache.clear()
+        caches['pages'].clear()
+
+        juan, ella = self.create_staff(iss_permissions=['view_mission', 'view_missionreport'],
+                                       nasa_permissions=['view_missionreport'])
+        alan = self.create_user('al.beback', NASA_ADMIN_GROUP)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.supervisor = Employee.objects.create(
+                user=juan, security_clearance=SecurityClearance.SECRET)
+            self.ella = Employee.objects.create(
+                user=ella, security_clearance=SecurityClearance.SECRET)
+            self.alan = Employee.objects.create(
+                user=alan, security_clearance=SecurityClearance.SECRET)
+
+            self.open = Mission.objects.create(
+                name='Open', supervisor=self.supervisor,
+                security_clearance=SecurityClearance.BASELINE)
+            self.classified = Mission.objects.create(
+                name='Classified', supervisor=self.supervisor,
+                security_clearance=SecurityClearance.TOP_SECRET)
+            self.report = self.create_report(self.open, self.ella)
+            self.create_report(self.classified, self.ella)
+
+    def create_report(self, mission, assigned_to):
+        """Create a report published now"""
+        return MissionReport.objects.create(
+            mission=mission, assigned_to=assigned_to, publish_date=timezone.now(),
+            summary='Summary')
+
+    def titles(self, employee, field):
+        """Titles or names listed on an employee's dashboard"""
+        return [row.get('title', row.get('name')) for row in
+                getattr(Dashboard.objects.get(pk=employee.pk), field)]
+
+    def test_should_serve_index_from_dashboard(self):
+        """Test the index lists come from one dashboard lookup, within clearance"""
+        self.client.login(username='juan.mortyme', password='password')
+        self.client.get('/')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/')
+
+        self.assertContains(response, 'Mission List (1)')
+        self.assertContains(response, f'<a href="/mission/{self.open.pk}">Open</a>', html=True)
+        self.assertContains(response, 'Open Report 1')
+        self.assertNotContains(response, 'Classified')
+        self.assertEqual([query['sql'] for query in context.captured_queries
+                          if 'missions_mission' in query['sql']], [])
+        self.assertEqual(len([query for query in context.captured_queries
+                              if 'missions_dashboard' in query['sql']]), 1)
+
+    @override_settings(ROOT_URLCONF='missions.async_urls', MISSIONS_REPORT_QUEUE=False)
+    async def test_should_serve_async_index_from_dashboard(self):
+        """Test the async index page reads the same dashboard"""
+        await sync_to_async(self.async_client.force_login)(self.ella.user)
+
+        response = await self.async_client.get('/')
+
+        self.assertContains(response, 'Mission Report List (1)')
+        self.assertContains(response, 'Open Report 1')
+        self.assertContains(response, 'data-url="/notifications"')
+
+    def test_should_follow_report_changes(self):
+        """Test creating, reassigning and deleting a report updates both dashboards"""
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.create_report(self.open, self.ella)
+
+        self.assertEqual(self.titles(self.ella, 'assigned_reports'),
+                         ['Open Report 2', 'Open Report 1'])
+        self.assertEqual(Dashboard.objects.get(pk=self.supervisor.pk).supervised_report_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report.assigned_to = self.alan
+            report.save()
+
+        self.assertEqual(self.titles(self.ella, 'assigned_reports'), ['Open Report 1'])
+        self.assertEqual(self.titles(self.alan, 'assigned_reports'), ['Open Report 2'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report.delete()
+
+        self.assertEqual(self.titles(self.alan, 'assigned_reports'), [])
+        self.assertEqual(self.titles(self.supervisor, 'supervised_reports'), ['Open Report 1'])
+
+    def test_should_follow_mission_changes(self):
+        """Test a mission raised above clearance, then deleted, leaves every dashboard"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.open.security_clearance = SecurityClearance.TOP_SECRET
+            self.open.save()
+
+        self.assertEqual(self.titles(self.supervisor, 'missions'), [])
+        self.assertEqual(self.titles(self.ella, 'assigned_reports'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ella.security_clearance = SecurityClearance.TOP_SECRET
+            self.ella.save()
+
+        self.assertEqual(Dashboard.objects.get(pk=self.ella.pk).assigned_report_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.open.delete()
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.titles(self.ella, 'assigned_reports'), ['Classified Report 1'])
+
+    def assertStored(self, *employees):  # pylint: disable=invalid-name
+        """Assert the stored dashboards match ones computed from the tables"""
+        for employee in employees:
+            employee.refresh_from_db()
+            built = dashboards.build(employee.pk, employee.security_clearance, 'default')
+            stored = Dashboard.objects.get(pk=employee.pk)
+
+            for field in ('mission_count', 'supervised_report_count', 'assigned_report_count',
+                          'missions', 'supervised_reports', 'assigned_reports'):
+                self.assertEqual(getattr(stored, field), getattr(built, field), field)
+
+    def test_should_skip_changes_dashboards_do_not_show(self):
+        """Test saving a mission's description does no dashboard work"""
+        mission = Mission.objects.get(pk=self.open.pk)
+
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks() as callbacks:
+                mission.description = 'Changed'
+                mission.save()
+
+        self.assertFalse([query for query in context.captured_queries
+                          if 'missions_dashboard' in query['sql']
+                          or 'missions_employee' in query['sql']])
+        self.assertEqual(callbacks, [])
+
+    def test_should_apply_deltas_in_place(self):
+        """Test adding, renaming and redating rows edits the stored lists without recounting"""
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks() as callbacks:
+                report = self.create_report(self.open, self.ella)
+                report.title = 'Renamed'
+                report.publish_date = timezone.now() - timezone.timedelta(days=1)
+                report.save()
+                self.open.name = 'Renamed'
+                self.open.save()
+                Mission.objects.create(name='Another', supervisor=self.supervisor,
+                                       security_clearance=SecurityClearance.SECRET)
+
+        self.assertFalse([callback for callback in callbacks if callback.__name__ == 'flush'])
+        self.assertFalse([query for query in context.captured_queries
+                          if 'COUNT(' in query['sql']])
+        self.assertEqual(self.titles(self.ella, 'assigned_reports'),
+                         ['Open Report 1', 'Renamed'])
+        self.assertStored(self.supervisor, self.ella, self.alan)
+
+    @override_settings(MISSIONS_PAGE_SIZE=1)
+    def test_should_refill_pages_left_short(self):
+        """Test removing a row from a full first page rebuilds it from the rows beyond"""
+        with self.captureOnCommitCallbacks(execute=True):
+            second, _ = [Mission.objects.create(
+                name=name, supervisor=self.supervisor,
+                security_clearance=SecurityClearance.SECRET) for name in ('Second', 'Third')]
+
+        self.assertEqual(self.titles(self.supervisor, 'missions'), ['Open', 'Second'])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            second.delete()
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.titles(self.supervisor, 'missions'), ['Open', 'Third'])
+        self.assertStored(self.supervisor)
+
+    def test_should_follow_reports_after_failed_mission_delete(self):
+        """Test a mission delete that rolls back leaves later report changes followed"""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Mission.objects.get(pk=self.open.pk).delete()
+                raise RuntimeError('Rolled back')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.report.title = 'Renamed'
+            self.report.save()
+
+        self.assertEqual(self.titles(self.ella, 'assigned_reports'), ['Renamed'])
+        self.assertStored(self.supervisor, self.ella)
+
+    @override_settings(MISSIONS_PAGE_SIZE=1)
+    def test_should_query_pages_past_the_first(self):
+        """Test stored pages carry the same cursors as queried ones, which serve later pages"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Mission.objects.create(name='Second', supervisor=self.supervisor,
+                                   security_clearance=SecurityClearance.SECRET)
+
+        self.client.login(username='juan.mortyme', password='password')
+        next_url = self.client.get('/').context['missions'].next_url
+        Dashboard.objects.all().delete()
+
+        self.assertEqual(self.client.get('/').context['missions'].next_url, next_url)
+
+        response = self.client.get('/' + next_url)
+
+        self.assertContains(response, 'Second')
+        self.assertNotContains(response, 'Mission List (')
+
+    def test_should_rebuild_dashboards(self):
+        """Test the command restores dashboards of rows written without signals"""
+        Dashboard.objects.all().delete()
+        MissionReport.objects.bulk_create([
+            MissionReport(title='Bulk', mission=self.open, sequence=10, assigned_to=self.alan,
+                          publish_date=timezone.now(), summary='Summary')
+        ])
+        out = StringIO()
+
+        call_command('rebuild_dashboards', '--employee', str(self.alan.pk), stdout=out)
+
+        self.assertIn('Rebuilt 1 dashboards', out.getvalue())
+        self.assertEqual(self.titles(self.alan, 'assigned_reports'), ['Bulk'])
+
+        call_command('rebuild_dashboards', stdout=out)
+
+        self.assertEqual(Dashboard.objects.count(), 3)
+
+
+class BulkMissionTestCase(StaffMixin, TestCase):
+    """Test cases for deleting, reassigning and reclassifying many missions at once"""
+
+    def setUp(self):
+        """Set up two SECRET ISS admins, one supervising missions with reports and a job"""
+        cache.clear()
+        caches['pages'].clear()
+
+        juan, ella = self.create_staff(
+            iss_permissions=['change_mission', 'delete_mission', 'view_mission'])
+        anna = self.create_user('anna.lyst', ISS_ADMIN_GROUP)
+        self.create_superuser()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.supervisor = Employee.objects.create(
+                user=juan, security_clearance=SecurityClearance.SECRET)
+            self.other = Employee.objects.create(
+                user=anna, security_clearance=SecurityClearance.SECRET)
+            self.assignee = Employee.objects.create(
+                user=ella, security_clearance=SecurityClearance.TOP_SECRET)
+            self.division = Division.objects.create(name='Operations')
+
+            self.missions = [Mission.objects.create(
+                name=f"Mission {number}", supervisor=self.supervisor,
+                security_clearance=SecurityClearance.BASELINE) for number in range(3)]
+            self.classified = Mission.objects.create(
+                name='Classified', supervisor=self.supervisor,
+                security_clearance=SecurityClearance.TOP_SECRET)
+
+            for mission in [*self.missions, self.classified]:
+                for _ in range(2):
+                    MissionReport.objects.create(
+                        mission=mission, assigned_to=self.assignee, publish_date=timezone.now(),
+                        summary='Summary')
+
+        ReportJob.objects.create(mission=self.missions[0], assigned_to=self.assignee,
+                                 publish_date=timezone.now(), summary='Summary')
+        self.client.login(username='juan.mortyme', password='password')
+
+    def post(self, action, missions, **data):
+        """Run a bulk action on the given missions, committing it"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/mission/bulk', {
+                'action': action, 'missions': [mission.pk for mission in missions], **data})
+
+    def test_should_delete_visible_missions_with_their_reports(self):
+        """Test a bulk delete removes missions, reports and jobs in set-based statements"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('delete', [*self.missions, self.classified])
+
+        self.assertEqual(response.json(), {'action': 'delete', 'requested': 4, 'missions': 3,
+                                           'reports': 6, 'jobs': 1})
+        self.assertEqual(list(Mission.objects.all()), [self.classified])
+        self.assertEqual(MissionReport.objects.count(), 2)
+        self.assertFalse(ReportJob.objects.exists())
+        self.assertEqual(len([query for query in context.captured_queries if
+                              query['sql'].startswith('DELETE FROM "missions_missionreport"')]), 1)
+        self.assertEqual(Dashboard.objects.get(pk=self.assignee.pk).assigned_report_count, 2)
+        self.assertEqual(Dashboard.objects.get(pk=self.supervisor.pk).mission_count, 0)
+        self.assertNotContains(self.client.get('/search', {'q': 'Mission'}), 'Mission 1')
+
+    def test_should_reassign_and_reclassify(self):
+        """Test reassigning moves missions between dashboards, and clearance hides them"""
+        response = self.post('reassign', self.missions[:2], supervisor=self.other.pk,
+                             division=self.division.pk)
+
+        self.assertEqual(response.json(), {'action': 'reassign', 'requested': 2, 'missions': 2,
+                                           'reports': 4})
+        self.assertEqual(Mission.objects.filter(supervisor=self.other,
+                                                division=self.division).count(), 2)
+        self.assertEqual(Dashboard.objects.get(pk=self.other.pk).mission_count, 2)
+        self.assertEqual(Dashboard.objects.get(pk=self.supervisor.pk).mission_count, 1)
+
+        # ISS admins may act on every mission within their clearance
+        response = self.post('clearance', self.missions, security_clearance=4)
+
+        self.assertEqual(response.json()['missions'], 3)
+        self.assertEqual(self.client.get(f"/mission/{self.missions[0].pk}").status_code, 404)
+        self.assertEqual(Dashboard.objects.get(pk=self.other.pk).mission_count, 0)
+        self.assertEqual(Dashboard.objects.get(pk=self.supervisor.pk).mission_count, 0)
+
+    def test_should_validate_and_check_permissions(self):
+        """Test incomplete actions are rejected, and users without the permission denied"""
+        self.assertEqual(self.post('clearance', self.missions).status_code, 400)
+        self.assertEqual(self.post('reassign', self.missions).status_code, 400)
+        self.assertEqual(self.client.post('/mission/bulk', {
+            'action': 'delete', 'missions': ['x']}).status_code, 400)
+        self.assertEqual(self.client.get('/mission/bulk').status_code, 405)
+
+        self.client.login(username='ella.vader', password='password')
+
+        self.assertEqual(self.post('delete', self.missions).status_code, 403)
+        self.assertEqual(Mission.objects.count(), 4)
+
+    def test_should_run_admin_actions(self):
+        """Test the admin reclassifies and deletes selected missions in bulk"""
+        self.client.login(username='admin', password='password')
+        selected = [mission.pk for mission in self.missions]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/missions/mission/', {
+                'action': 'change_clearance', '_selected_action': selected,
+                'security_clearance': SecurityClearance.TOP_SECRET}, follow=True)
+
+        self.assertContains(response, 'Changed the clearance of 3 missions.')
+        self.assertEqual(Mission.objects.filter(
+            security_clearance=SecurityClearance.TOP_SECRET).count(), 4)
+
+        # The confirmation page counts what goes instead of listing every report
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/admin/missions/mission/', {
+                'action': 'delete_with_reports', '_selected_action': selected})
+
+        self.assertContains(response, 'Mission reports: 6')
+        self.assertContains(response, 'Report jobs: 1')
+        self.assertFalse([query for query in context.captured_queries if
+                          'FROM "missions_missionreport"' in query['sql'] and
+                          'COUNT(' not in query['sql']])
+        self.assertNotContains(self.client.get('/admin/missions/mission/'), 'delete_selected')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/missions/mission/', {
+                'action': 'delete_with_reports', '_selected_action': selected, 'post': 'yes'},
+                follow=True)
+
+        self.assertContains(response, 'Deleted 3 missions and 6 reports.')
+        self.assertEqual(list(Mission.objects.all()), [self.classified])
@@ -0,0 +1,417 @@
+"""Tests of the mission and mission report pages"""
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import (Mission, MissionReport, Employee, SecurityClearance, ISS_ADMIN_GROUP,
+                     NASA_ADMIN_GROUP)
+from .roles import get_roles
+from .testcases import StaffMixin
+
+
+class KeysetPaginationTestCase(StaffMixin, TestCase):
+    """Test cases for cursor based pagination of mission listings"""
+
+    def setUp(self):
+        """Set up a superuser with more missions and reports than fit on one page"""
+        caches['pages'].clear()
+        self.client = Client()
+
+        admin = self.create_superuser()
+        supervisor = Employee.objects.create(
+            user=admin,
+            security_clearance=SecurityClearance.TOP_SECRET
+        )
+
+        self.missions = Mission.objects.bulk_create([
+            Mission(
+                name=f"Mission {number}",
+                supervisor=supervisor,
+                security_clearance=SecurityClearance.BASELINE
+            )
+            for number in range(5)
+        ])
+
+        publish_date = timezone.now()
+        self.reports = MissionReport.objects.bulk_create([
+            MissionReport(
+                title=f"Report {number}",
+                mission=self.missions[0],
+                sequence=number + 1,
+                assigned_to=supervisor,
+                publish_date=publish_date - timedelta(days=number // 2),
+                summary='Summary'
+            )
+            for number in range(5)
+        ])
+
+        self.client.login(username='admin', password='password')
+
+    def test_should_walk_missions_forwards_and_backwards(self):
+        """Test that next and previous cursors visit every mission exactly once"""
+        first = self.client.get('/', {'page_size': 2}).context['missions']
+        self.assertEqual([m.name for m in first], ['Mission 0', 'Mission 1'])
+        self.assertFalse(first.has_previous)
+
+        second = self.client.get('/' + first.next_url).context['missions']
+        self.assertEqual([m.name for m in second], ['Mission 2', 'Mission 3'])
+
+        third = self.client.get('/' + second.next_url).context['missions']
+        self.assertEqual([m.name for m in third], ['Mission 4'])
+        self.assertFalse(third.has_next)
+
+        back = self.client.get('/' + third.previous_url).context['missions']
+        self.assertEqual([m.name for m in back], ['Mission 2', 'Mission 3'])
+
+    def test_should_order_reports_newest_first_across_equal_dates(self):
+        """Test that reports sharing a publish date are neither skipped nor repeated"""
+        seen = []
+        url = '/?page_size=2'
+
+        while url:
+            page = self.client.get(url).context['mission_reports']
+            seen.extend(report.title for report in page)
+            url = '/' + page.next_url if page.has_next else None
+
+        expected = [report.title for report in
+                    sorted(self.reports, key=lambda r: (r.publish_date, r.pk), reverse=True)]
+        self.assertEqual(seen, expected)
+
+    def test_should_ignore_invalid_cursor(self):
+        """Test that a tampered cursor falls back to the first page"""
+        response = self.client.get('/', {'missions_after': 'not-a-cursor', 'page_size': 2})
+
+        self.assertEqual([m.name for m in response.context['missions']],
+                         ['Mission 0', 'Mission 1'])
+
+    def test_should_paginate_reports_on_mission_details(self):
+        """Test that mission details only renders one page of reports"""
+        response = self.client.get(f"/mission/{self.missions[0].pk}", {'page_size': 3})
+
+        self.assertEqual(len(response.context['reports']), 3)
+        self.assertTrue(response.context['reports'].has_next)
+
+
+class MissionReportSequenceTestCase(StaffMixin, TestCase):
+    """Test cases for numbering reports from the per-mission counter"""
+
+    def setUp(self):
+        """Set up a mission and an ISS admin allowed to generate reports for it"""
+        self.client = Client()
+
+        juan, ella = self.create_staff(iss_permissions=['add_missionreport'])
+
+        supervisor = Employee.objects.create(
+            user=juan, security_clearance=SecurityClearance.TOP_SECRET)
+        self.assignee = Employee.objects.create(
+            user=ella, security_clearance=SecurityClearance.TOP_SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', supervisor=supervisor,
+            security_clearance=SecurityClearance.BASELINE)
+
+    def create_report(self, mission=None):
+        """Create a report the way the admin site would"""
+        return MissionReport.objects.create(
+            mission=mission or self.mission, assigned_to=self.assignee,
+            publish_date=timezone.now(), summary='Summary')
+
+    def test_should_number_reports_per_mission(self):
+        """Test that each mission numbers its own reports from one"""
+        other = Mission.objects.create(
+            name='Mission 2', supervisor=self.mission.supervisor,
+            security_clearance=SecurityClearance.BASELINE)
+
+        first, second = self.create_report(), self.create_report()
+        third = self.create_report(other)
+
+        self.assertEqual((first.sequence, second.sequence, third.sequence), (1, 2, 1))
+        self.assertEqual(second.title, 'Mission 1 Report 2')
+        self.mission.refresh_from_db()
+        self.assertEqual(self.mission.report_sequence, 2)
+
+    def test_should_not_rewind_counter_when_saving_stale_mission(self):
+        """Test that updating a mission loaded before a report was issued keeps the counter"""
+        stale = Mission.objects.get(pk=self.mission.pk)
+        self.create_report()
+
+        stale.name = 'Renamed'
+        stale.save()
+
+        self.assertEqual(self.create_report().sequence, 2)
+
+    def test_should_reject_duplicate_sequence(self):
+        """Test the database constraint on report numbers"""
+        report = self.create_report()
+
+        with self.assertRaises(IntegrityError):
+            MissionReport.objects.create(
+                mission=self.mission, sequence=report.sequence, title='Duplicate',
+                publish_date=timezone.now(), summary='Summary')
+
+    def test_should_title_generated_report_with_its_number(self):
+        """Test report generation through the view"""
+        self.create_report()
+        self.client.login(username='juan.mortyme', password='password')
+
+        response = self.client.post(f"/mission-report/generate/{self.mission.pk}", {
+            'assigned_to': self.assignee.pk,
+            'report_summary': 'Summary',
+        })
+        call_command('process_report_jobs', '--once', stdout=StringIO())
+
+        report = MissionReport.objects.get(mission=self.mission, sequence=2)
+        self.assertEqual(self.client.get(response.url).url, f"/mission-report/{report.pk}")
+        self.assertEqual(report.title, 'Mission 1 Report 2')
+
+
+@override_settings(MISSIONS_CHOICES_CACHE_TIMEOUT=300)
+class EmployeeChoicesTestCase(StaffMixin, TestCase):
+    """Test cases for the cached supervisor and assignee choices"""
+
+    def setUp(self):
+        """Set up an ISS admin and a few NASA admins to choose from"""
+        cache.clear()
+        caches['sessions'].clear()
+        self.client = Client()
+
+        self.iss_admins, _ = self.create_groups(
+            iss_permissions=['add_mission', 'view_mission', 'add_missionreport'],
+            nasa_permissions=['view_missionreport'])
+        juan = self.create_user('juan.mortyme', ISS_ADMIN_GROUP, first_name='Juan',
+                                last_name='Mortyme')
+        self.supervisor = Employee.objects.create(
+            user=juan, security_clearance=SecurityClearance.TOP_SECRET)
+
+        self.assignees = []
+        for number in range(5):
+            user = self.create_user(f"nasa.{number}", NASA_ADMIN_GROUP, first_name='Nasa',
+                                    last_name=str(number))
+            self.assignees.append(Employee.objects.create(
+                user=user, security_clearance=SecurityClearance.SECRET))
+
+        self.client.login(username='juan.mortyme', password='password')
+
+    @override_settings(MISSIONS_ROLE_CACHE_TIMEOUT=300)
+    def test_should_render_choices_without_per_employee_queries(self):
+        """Test a second form render reads the choices from the cache"""
+        self.client.get('/mission/create')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/mission/create')
+
+        self.assertContains(response, 'Juan Mortyme')
+        self.assertFalse([query for query in context.captured_queries
+                          if 'missions_employee' in query['sql']])
+
+    @override_settings(MISSIONS_ROLE_CACHE_TIMEOUT=300, MISSIONS_CHOICES_CACHE_TIMEOUT=0)
+    def test_should_query_choices_when_not_cached(self):
+        """Test choices are read on every render without a shared cache to keep them in"""
+        self.client.get('/mission/create')
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/mission/create')
+
+        self.assertTrue([query for query in context.captured_queries
+                         if 'missions_employee' in query['sql']])
+
+    def test_should_invalidate_choices_on_membership_and_name_changes(self):
+        """Test changes to groups and names show up in the next render"""
+        self.assertNotContains(self.client.get('/mission/create'), 'Nasa 0')
+
+        self.assignees[0].user.groups.add(self.iss_admins)
+        self.assertContains(self.client.get('/mission/create'), 'Nasa 0')
+
+        user = self.assignees[0].user
+        user.first_name = 'Ella'
+        user.save()
+        self.assertContains(self.client.get('/mission/create'), 'Ella 0')
+
+        self.iss_admins.name = 'Former_ISS_Admin_User'
+        self.iss_admins.save()
+        self.assertNotContains(self.client.get('/mission/create'), 'Juan Mortyme')
+
+    @override_settings(MISSIONS_TYPEAHEAD_THRESHOLD=2)
+    def test_should_offer_only_selected_choice_above_threshold(self):
+        """Test long choice lists defer to the type-ahead endpoint"""
+        mission = Mission.objects.create(
+            name='Mission 1', supervisor=self.supervisor,
+            security_clearance=SecurityClearance.BASELINE)
+
+        response = self.client.get(f"/mission/{mission.pk}")
+
+        self.assertContains(response, 'data-typeahead-url="/employees?role=assignee"')
+        self.assertNotContains(response, 'Nasa 0')
+
+    def test_should_page_through_matching_employees(self):
+        """Test the type-ahead endpoint searches and pages"""
+        response = self.client.get('/employees', {'role': 'assignee', 'q': 'nasa', 'page_size': 2})
+        page = response.json()
+
+        self.assertEqual(page['results'], [
+            {'id': self.assignees[0].pk, 'label': 'Nasa 0'},
+            {'id': self.assignees[1].pk, 'label': 'Nasa 1'},
+        ])
+
+        page = self.client.get(page['next']).json()
+
+        self.assertEqual([choice['label'] for choice in page['results']], ['Nasa 2', 'Nasa 3'])
+        self.assertEqual(self.client.get(
+            '/employees', {'role': 'assignee', 'q': 'nasa 4'}).json()['results'],
+            [{'id': self.assignees[4].pk, 'label': 'Nasa 4'}])
+
+    def test_should_refuse_unknown_roles_and_users_without_permission(self):
+        """Test the type-ahead endpoint checks the role and the permission"""
+        self.assertEqual(self.client.get('/employees', {'role': 'admin'}).status_code, 400)
+
+        self.client.login(username='nasa.0', password='password')
+
+        self.assertEqual(self.client.get('/employees', {'role': 'supervisor'}).status_code, 403)
+
+
+class VisibilityTestCase(StaffMixin, TestCase):
+    """Test cases for clearance and role scoping of missions and reports"""
+
+    def setUp(self):
+        """Set up a SECRET ISS admin and NASA admin, and missions either side of it"""
+        cache.clear()
+        caches['pages'].clear()
+        self.client = Client()
+
+        juan, ella = self.create_staff(
+            iss_permissions=['change_mission', 'delete_mission', 'view_mission',
+                             'view_missionreport'],
+            nasa_permissions=['view_missionreport'])
+        alan = self.create_user('al.beback', NASA_ADMIN_GROUP)
+
+        supervisor = Employee.objects.create(
+            user=juan, security_clearance=SecurityClearance.SECRET)
+        self.ella = Employee.objects.create(
+            user=ella, security_clearance=SecurityClearance.TOP_SECRET)
+        self.alan = Employee.objects.create(
+            user=alan, security_clearance=SecurityClearance.TOP_SECRET)
+
+        self.open = Mission.objects.create(
+            name='Open', supervisor=supervisor, security_clearance=SecurityClearance.SECRET)
+        self.classified = Mission.objects.create(
+            name='Classified', supervisor=supervisor,
+            security_clearance=SecurityClearance.TOP_SECRET)
+        self.open_report = MissionReport.objects.create(
+            mission=self.open, assigned_to=self.ella, publish_date=timezone.now(),
+            summary='Summary')
+        self.classified_report = MissionReport.objects.create(
+            mission=self.classified, assigned_to=self.ella, publish_date=timezone.now(),
+            summary='Summary')
+
+    def test_should_filter_in_a_single_query(self):
+        """Test the scoping is one SQL predicate rather than a check per row"""
+        roles = get_roles(User.objects.get(username='juan.mortyme'))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Mission.objects.visible_to(roles)), [self.open])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(MissionReport.objects.visible_to(roles)), [self.open_report])
+
+    def test_should_hide_missions_above_clearance(self):
+        """Test an ISS admin gets a 404 for missions and reports above their clearance"""
+        self.client.login(username='juan.mortyme', password='password')
+
+        self.assertEqual(self.client.get(f"/mission/{self.open.pk}").status_code, 200)
+        self.assertEqual(self.client.get(f"/mission/{self.classified.pk}").status_code, 404)
+        self.assertEqual(self.client.get(
+            f"/mission-report/{self.classified_report.pk}").status_code, 404)
+        self.assertEqual(self.client.get(
+            f"/mission/{self.classified.pk}/update").status_code, 404)
+        self.assertEqual(self.client.get(
+            f"/mission/{self.classified.pk}/delete").status_code, 404)
+        self.assertTrue(Mission.objects.filter(pk=self.classified.pk).exists())
+
+    def test_should_scope_reports_to_assignee(self):
+        """Test a NASA admin only sees the reports assigned to them"""
+        self.client.login(username='al.beback', password='password')
+
+        self.assertEqual(self.client.get(
+            f"/mission-report/{self.open_report.pk}").status_code, 404)
+
+        self.client.login(username='ella.vader', password='password')
+
+        self.assertEqual(self.client.get(
+            f"/mission-report/{self.open_report.pk}").status_code, 200)
+
+
+@override_settings(ROOT_URLCONF='missions.async_urls')
+class AsyncViewsTestCase(StaffMixin, TestCase):
+    """Test cases for the async views served under ASGI"""
+
+    def setUp(self):
+        """Set up a NASA admin with a report, logged in on the async client"""
+        cache.clear()
+        caches['pages'].clear()
+
+        self.create_groups(nasa_permissions=['view_mission', 'view_missionreport'])
+        ella = self.create_user('ella.vader', NASA_ADMIN_GROUP)
+        self.create_user('al.beback')
+
+        employee = Employee.objects.create(
+            user=ella, security_clearance=SecurityClearance.TOP_SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', supervisor=employee,
+            security_clearance=SecurityClearance.BASELINE)
+        self.report = MissionReport.objects.create(
+            mission=self.mission, assigned_to=employee,
+            publish_date=timezone.now(), summary='Docking went well')
+
+        self.async_client.force_login(ella)
+
+    async def test_should_list_assigned_reports_on_index(self):
+        """Test the index page resolves the user and roles without blocking"""
+        response = await self.async_client.get('/')
+
+        self.assertContains(response, 'Mission 1 Report 1')
+
+    async def test_should_show_mission_and_revalidate(self):
+        """Test the mission page renders and answers a matching ETag with a 304"""
+        # The first visit stores the CSRF secret the page's ETag depends on
+        await self.async_client.get(f"/mission/{self.mission.pk}")
+        response = await self.async_client.get(f"/mission/{self.mission.pk}")
+
+        self.assertContains(response, 'Mission 1')
+        self.assertIn('private', response['Cache-Control'])
+
+        response = await self.async_client.get(
+            f"/mission/{self.mission.pk}", headers={'If-None-Match': response['ETag']})
+
+        self.assertEqual(response.status_code, 304)
+
+    async def test_should_show_report(self):
+        """Test the report page renders from the async ORM"""
+        response = await self.async_client.get(f"/mission-report/{self.report.pk}")
+
+        self.assertContains(response, 'Docking went well')
+
+    async def test_should_redirect_anonymous_users_to_login(self):
+        """Test anonymous users are sent to the login page"""
+        await self.async_client.get('/logout')
+
+        response = await self.async_client.get(f"/mission/{self.mission.pk}")
+
+        self.assertRedirects(response, f"/login?next=/mission/{self.mission.pk}",
+                             fetch_redirect_response=False)
+
+    async def test_should_log_in_and_deny_missing_permissions(self):
+        """Test the async login flow and the permission check on the report page"""
+        await self.async_client.get('/logout')
+
+        response = await self.async_client.post(
+            '/login', {'username': 'al.beback', 'password': 'password'})
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+
+        response = await self.async_client.get(f"/mission-report/{self.report.pk}")
+        self.assertEqual(response.status_code, 403)
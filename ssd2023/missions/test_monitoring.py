@@ -0,0 +1,287 @@
+"""Tests of metrics, query profiling and login rate limits"""
+import re
+
+from io import StringIO
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import metrics, profiling, ratelimit
+from .models import Division, Mission, QueryFingerprint
+from .testcases import StaffMixin
+
+
+class PerformanceMetricsTestCase(StaffMixin, TestCase):
+    """Test cases for the per-request performance middleware and metrics endpoint"""
+
+    def setUp(self):
+        """Set up a superuser and an ISS admin, and empty histograms"""
+        metrics.registry.reset()
+        self.client = Client()
+
+        self.create_superuser()
+        self.create_user('juan.mortyme')
+
+    @override_settings(MISSIONS_SERVER_TIMING=True)
+    def test_should_time_queries_and_templates(self):
+        """Test a sampled request is logged and answered with a Server-Timing header"""
+        self.client.login(username='admin', password='password')
+
+        with self.assertLogs('ssd2023.performance') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+
+        timing = re.fullmatch(r'total;dur=[\d.]+, db;dur=[\d.]+;desc="(\d+) queries", '
+                              r'template;dur=([\d.]+)', response['Server-Timing'])
+
+        self.assertIsNotNone(timing)
+        self.assertEqual(int(timing.group(1)), len(queries))
+        self.assertGreater(float(timing.group(2)), 0)
+        self.assertIn('view=missions.views.index method=GET status=200', logs.output[0])
+        self.assertIn(f"bytes={len(response.content)}", logs.output[0])
+
+    def test_should_not_send_server_timing_by_default(self):
+        """Test timings are only measured, not shown to visitors, unless turned on"""
+        with self.assertLogs('ssd2023.performance'):
+            response = self.client.get('/login')
+
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(MISSIONS_METRICS_SAMPLE_RATE=0)
+    def test_should_skip_unsampled_requests(self):
+        """Test nothing is measured when sampling is off"""
+        response = self.client.get('/login')
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('missions.views.login_endpoint', metrics.registry.render())
+
+    @override_settings(MISSIONS_METRICS_TOKEN='scrape-token')
+    def test_should_expose_histograms_to_superusers_and_scrapers(self):
+        """Test the metrics endpoint is protected and in the Prometheus text format"""
+        self.client.get('/login')
+
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer wrong-token').status_code, 403)
+
+        self.client.login(username='juan.mortyme', password='password')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        self.client.logout()
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE missions_request_duration_seconds histogram')
+        self.assertContains(response, 'missions_request_duration_seconds_count'
+                                      '{view="missions.views.login_endpoint"} 1')
+        self.assertContains(response, 'missions_request_db_queries_bucket'
+                                      '{view="missions.views.login_endpoint",le="+Inf"} 1')
+
+
+class QueryProfilingTestCase(TestCase):
+    """Test cases for query fingerprinting, the slow query log and the query report"""
+
+    def setUp(self):
+        """Start from no pending timings"""
+        profiling.stats.take(force=True)
+        self.factory = RequestFactory()
+
+    def profile(self, view, *querysets):
+        """Evaluate querysets as if a view ran them, with profiling on"""
+        token = profiling._view.set(view)  # pylint: disable=protected-access
+
+        try:
+            with connection.execute_wrapper(profiling.profile_query):
+                for queryset in querysets:
+                    list(queryset)
+        finally:
+            profiling._view.reset(token)  # pylint: disable=protected-access
+
+    def test_should_normalise_literals_and_lists(self):
+        """Test statements differing only in their values share a fingerprint"""
+        first = profiling.normalise("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a''b'")
+        second = profiling.normalise("SELECT *  FROM t\nWHERE id IN (%s) AND name = %s")
+
+        self.assertEqual(first, "SELECT * FROM t WHERE id IN (...) AND name = ?")
+        self.assertEqual(first, second)
+        self.assertEqual(profiling.fingerprint(first), profiling.fingerprint(second))
+
+    @override_settings(MISSIONS_SLOW_QUERY_MS=100000)
+    def test_should_aggregate_statements_per_view(self):
+        """Test repeated statements are counted once per view and added up on flush"""
+        self.profile('missions.views.index', Division.objects.filter(pk=1),
+                     Division.objects.filter(pk=2))
+        self.profile('missions.views.search', Division.objects.filter(pk=3))
+        profiling.stats.flush(force=True)
+        self.profile('missions.views.index', Division.objects.filter(pk=4))
+        profiling.stats.flush(force=True)
+
+        rows = dict(QueryFingerprint.objects.values_list('view', 'count'))
+
+        self.assertEqual(rows, {'missions.views.index': 3, 'missions.views.search': 1})
+        self.assertEqual(QueryFingerprint.objects.values('fingerprint').distinct().count(), 1)
+
+    def test_should_ignore_queries_outside_profiled_requests(self):
+        """Test nothing is recorded without a view being profiled"""
+        with connection.execute_wrapper(profiling.profile_query):
+            list(Division.objects.all())
+
+        self.assertEqual(profiling.stats.take(force=True), {})
+
+    @override_settings(MISSIONS_SLOW_QUERY_MS=0)
+    def test_should_log_slow_selects_with_their_plan(self):
+        """Test statements over the threshold are logged with their query plan"""
+        with self.assertLogs('ssd2023.queries', 'WARNING') as logs:
+            self.profile('missions.views.index', Mission.objects.filter(supervisor_id=1))
+
+        self.assertIn('in missions.views.index: SELECT', logs.output[0])
+        self.assertIn('missions_mission', logs.output[0].split('\n', 1)[1])
+
+    @override_settings(MISSIONS_QUERY_PROFILING=True, MISSIONS_SLOW_QUERY_MS=100000)
+    def test_should_attribute_queries_to_the_resolved_view(self):
+        """Test the middleware names the view of the URL before any query runs"""
+        def get_response(request):  # pylint: disable=unused-argument
+            with connection.execute_wrapper(profiling.profile_query):
+                list(Division.objects.all())
+
+            return HttpResponse()
+
+        profiling.query_profiling_middleware(get_response)(self.factory.get('/search'))
+        profiling.stats.flush(force=True)
+
+        self.assertEqual(list(QueryFingerprint.objects.values_list('view', flat=True)),
+                         ['missions.views.search'])
+
+    def test_should_rank_statements_in_the_report(self):
+        """Test the report orders statements by total time and can reset them"""
+        now = timezone.now()
+        QueryFingerprint.objects.create(fingerprint='a' * 16, view='missions.views.index',
+                                        sql='SELECT 1', count=10, total_time=0.5,
+                                        max_time=0.1, last_seen=now)
+        QueryFingerprint.objects.create(fingerprint='b' * 16, view='missions.views.search',
+                                        sql='SELECT 2', count=1, total_time=2.0,
+                                        max_time=2.0, last_seen=now)
+        out = StringIO()
+
+        call_command('query_report', '--reset', stdout=out)
+        lines = out.getvalue().splitlines()
+
+        self.assertIn('missions.views.search', lines[1])
+        self.assertIn('[bbbbbbbbbbbbbbbb] SELECT 2', lines[2])
+        self.assertIn('missions.views.index', lines[3])
+        self.assertFalse(QueryFingerprint.objects.exists())
+
+        out = StringIO()
+        QueryFingerprint.objects.create(fingerprint='a' * 16, view='missions.views.index',
+                                        sql='SELECT 1', count=10, total_time=0.5,
+                                        max_time=0.1, last_seen=now)
+        call_command('query_report', '--order-by', 'count', '--view', 'missions.views.search',
+                     stdout=out)
+
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+
+class LoginRateLimitTestCase(StaffMixin, TestCase):
+    """Test cases for the sliding window limits on login attempts"""
+
+    def setUp(self):
+        """Start from no attempts and empty counters"""
+        caches['ratelimit'].clear()
+        metrics.registry.reset()
+        self.client = Client()
+
+        self.create_user('ella.vader')
+
+    def attempt(self, username, password='wrong'):
+        """Post the login form, returning the response and the user queries it ran"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/login', {'username': username, 'password': password})
+
+        return response, [query for query in queries if '"auth_user"' in query['sql']]
+
+    def test_should_slide_limits_over_time(self):
+        """Test a burst is allowed, and the next attempt once the window has slid past it"""
+        with override_settings(MISSIONS_LOGIN_RATE_LIMIT_USERNAME=(2, 6)):
+            self.assertEqual(ratelimit.take('username', 'ella', now=100), 0)
+            self.assertEqual(ratelimit.take('username', 'ella', now=100), 0)
+            self.assertAlmostEqual(ratelimit.take('username', 'ella', now=105), 25)
+            self.assertGreater(ratelimit.take('username', 'ella', now=129), 0)
+            self.assertEqual(ratelimit.take('username', 'ella', now=130), 0)
+            self.assertEqual(ratelimit.take('username', 'other', now=130), 0)
+
+    def test_should_not_count_rejected_attempts(self):
+        """Test attempts over the limit do not push the next allowed one further away"""
+        with override_settings(MISSIONS_LOGIN_RATE_LIMIT_USERNAME=(1, 6)):
+            ratelimit.take('username', 'ella', now=100)
+
+            for _ in range(5):
+                self.assertAlmostEqual(ratelimit.take('username', 'ella', now=101), 19)
+
+            self.assertEqual(ratelimit.take('username', 'ella', now=120), 0)
+
+    @override_settings(MISSIONS_LOGIN_RATE_LIMIT_USERNAME=(2, 1))
+    def test_should_reject_username_guesses_before_hashing(self):
+        """Test attempts over the username limit get a 429 without looking up the user"""
+        for _ in range(2):
+            response, queries = self.attempt('ella.vader')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(queries), 1)
+
+        response, queries = self.attempt('Ella.Vader', 'password')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(queries, [])
+        # Before the window of the two failures has slid past them
+        self.assertTrue(60 <= int(response['Retry-After']) <= 180)
+        self.assertContains(response, 'Too many login attempts', status_code=429)
+
+        rendered = metrics.registry.render()
+        self.assertIn('missions_login_attempts_total{outcome="failed"} 2', rendered)
+        self.assertIn('missions_login_attempts_total{outcome="limited_username"} 1', rendered)
+
+    @override_settings(MISSIONS_LOGIN_RATE_LIMIT_USERNAME=(1, 1))
+    def test_should_only_count_failed_attempts_per_username(self):
+        """Test logging in with the right password leaves the username's limit untouched"""
+        for _ in range(3):
+            self.client.logout()
+            response, _ = self.attempt('ella.vader', 'password')
+            self.assertRedirects(response, '/', fetch_redirect_response=False)
+
+        self.client.logout()
+        self.assertEqual(self.attempt('ella.vader')[0].status_code, 200)
+        self.assertEqual(self.attempt('ella.vader', 'password')[0].status_code, 429)
+
+    @override_settings(MISSIONS_LOGIN_RATE_LIMIT_IP=(2, 1))
+    def test_should_limit_attempts_from_one_address(self):
+        """Test an address trying many usernames is limited, and others are not"""
+        self.attempt('first')
+        self.attempt('second')
+
+        self.assertEqual(self.attempt('ella.vader', 'password')[0].status_code, 429)
+        self.assertIn('missions_login_attempts_total{outcome="limited_ip"} 1',
+                      metrics.registry.render())
+
+        response = self.client.post('/login', {'username': 'ella.vader', 'password': 'password'},
+                                    REMOTE_ADDR='192.0.2.1')
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+
+    @override_settings(MISSIONS_LOGIN_RATE_LIMIT_IP=(1, 1),
+                       MISSIONS_TRUSTED_PROXIES=['127.0.0.1', '10.0.0.0/8'])
+    def test_should_limit_clients_behind_trusted_proxies(self):
+        """Test clients of trusted proxies have their own limits, and others cannot spoof one"""
+        def status(remote_addr, forwarded_for):
+            return self.client.post('/login', {'username': 'first', 'password': 'wrong'},
+                                    REMOTE_ADDR=remote_addr,
+                                    HTTP_X_FORWARDED_FOR=forwarded_for).status_code
+
+        self.assertEqual(status('127.0.0.1', '192.0.2.1, 10.0.0.2'), 200)
+        self.assertEqual(status('127.0.0.1', '192.0.2.2'), 200)
+        self.assertEqual(status('127.0.0.1', '198.51.100.1, 192.0.2.1, 10.0.0.2'), 429)
+
+        self.assertEqual(status('192.0.2.9', '192.0.2.3'), 200)
+        self.assertEqual(status('192.0.2.9', '192.0.2.4'), 429)
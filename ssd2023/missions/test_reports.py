@@ -0,0 +1,527 @@
+"""Tests of report export, search, generation, notifications and statistics"""
+import csv
+import json
+
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, Client, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import jobs, notifications, stats
+from .models import (Division, Mission, MissionReport, Employee, ReportJob, SecurityClearance,
+                     ISS_ADMIN_GROUP, NASA_ADMIN_GROUP)
+from .roles import get_roles
+from .search import SearchBackend
+from .testcases import StaffMixin
+
+
+class MissionReportExportTestCase(StaffMixin, TestCase):
+    """Test cases for the streaming mission report export endpoint"""
+
+    def setUp(self):
+        """Set up two NASA admins with a report each"""
+        self.client = Client()
+
+        self.create_groups(nasa_permissions=['view_missionreport'])
+        ella = self.create_user('ella.vader', NASA_ADMIN_GROUP)
+        other = self.create_user('al.beback', NASA_ADMIN_GROUP)
+
+        self.assignee = Employee.objects.create(
+            user=ella, security_clearance=SecurityClearance.TOP_SECRET)
+        other_assignee = Employee.objects.create(
+            user=other, security_clearance=SecurityClearance.TOP_SECRET)
+        mission = Mission.objects.create(
+            name='Mission 1', supervisor=self.assignee,
+            security_clearance=SecurityClearance.BASELINE)
+
+        self.old = MissionReport.objects.create(
+            mission=mission, assigned_to=self.assignee,
+            publish_date=timezone.now() - timedelta(days=10), summary='Old')
+        self.new = MissionReport.objects.create(
+            mission=mission, assigned_to=self.assignee,
+            publish_date=timezone.now(), summary='New')
+        MissionReport.objects.create(
+            mission=mission, assigned_to=other_assignee,
+            publish_date=timezone.now(), summary='Not yours')
+
+    def export(self, **params):
+        """Fetch and decode an export"""
+        response = self.client.get('/mission-report/export', params)
+
+        self.assertTrue(response.streaming)
+
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_should_require_login(self):
+        """Test that the export is not available when logged out"""
+        response = self.client.get('/mission-report/export')
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_should_only_export_reports_assigned_to_user(self):
+        """Test that the export applies the same role scoping as the index page"""
+        self.client.login(username='ella.vader', password='password')
+
+        response, content = self.export()
+        rows = list(csv.DictReader(StringIO(content)))
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual({row['summary'] for row in rows}, {'Old', 'New'})
+
+    def test_should_filter_by_publish_date(self):
+        """Test the date range filter with NDJSON output"""
+        self.client.login(username='ella.vader', password='password')
+
+        published_after = (timezone.now() - timedelta(days=1)).isoformat()
+        _, content = self.export(format='ndjson', published_after=published_after)
+        rows = [json.loads(line) for line in content.splitlines()]
+
+        self.assertEqual([row['id'] for row in rows], [self.new.pk])
+
+    def test_should_reject_invalid_filters(self):
+        """Test that malformed filters are a bad request"""
+        self.client.login(username='ella.vader', password='password')
+
+        response = self.client.get('/mission-report/export', {'mission': 'abc'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTestCase(StaffMixin, TestCase):
+    """Test cases for full-text search over missions and reports"""
+
+    def setUp(self):
+        """Set up an ISS admin and a NASA admin with missions and reports to find"""
+        self.client = Client()
+
+        juan, ella = self.create_staff()
+        self.create_superuser()
+
+        supervisor = Employee.objects.create(
+            user=juan, security_clearance=SecurityClearance.SECRET)
+        assignee = Employee.objects.create(
+            user=ella, security_clearance=SecurityClearance.SECRET)
+
+        self.docking = Mission.objects.create(
+            name='Docking trials', description='Berthing the cargo module',
+            supervisor=supervisor, security_clearance=SecurityClearance.BASELINE)
+        self.cargo = Mission.objects.create(
+            name='Cargo resupply', description='Routine docking window',
+            supervisor=supervisor, security_clearance=SecurityClearance.BASELINE)
+        self.classified = Mission.objects.create(
+            name='Classified docking', supervisor=supervisor,
+            security_clearance=SecurityClearance.TOP_SECRET)
+
+        self.report = MissionReport.objects.create(
+            mission=self.cargo, assigned_to=assignee, publish_date=timezone.now(),
+            summary='Solar array docking clearance confirmed')
+        MissionReport.objects.create(
+            mission=self.docking, publish_date=timezone.now(),
+            summary='Docking report nobody was assigned')
+
+    def search(self, username, query):
+        """Search as a user and return the result titles"""
+        self.client.login(username=username, password='password')
+        response = self.client.get('/search', {'q': query})
+
+        self.assertEqual(response.status_code, 200)
+
+        return [result.title for result in response.context['results']]
+
+    def test_should_rank_title_matches_first(self):
+        """Test that a match in the name outranks a match in the description"""
+        results = self.search('juan.mortyme', 'docking')
+
+        self.assertEqual(results[0], 'Docking trials')
+        self.assertIn('Cargo resupply', results)
+
+    def test_should_hide_missions_above_clearance(self):
+        """Test that missions above the user's clearance are never returned"""
+        self.assertNotIn('Classified docking', self.search('juan.mortyme', 'docking'))
+        self.assertIn('Classified docking', self.search('admin', 'docking'))
+
+    def test_should_scope_reports_to_assignee(self):
+        """Test that a NASA admin only finds their own reports and no missions"""
+        self.assertEqual(self.search('ella.vader', 'docking'), [str(self.report)])
+
+    def test_should_ignore_query_syntax(self):
+        """Test that search operators in user input do not cause errors"""
+        self.assertEqual(self.search('admin', '"docking* (-'),
+                         self.search('admin', 'docking'))
+
+    def test_should_forget_deleted_and_renamed_objects(self):
+        """Test that the index follows updates and deletes"""
+        self.docking.name = 'Spacewalk rehearsal'
+        self.docking.save()
+        self.cargo.delete()
+
+        self.assertEqual(self.search('admin', 'resupply'), [])
+        self.assertIn('Spacewalk rehearsal', self.search('admin', 'spacewalk'))
+
+    def test_should_key_one_document_per_object(self):
+        """Test that saving objects again replaces their documents, found by rowid"""
+        self.docking.save()
+        self.report.save()
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM missions_search")
+            rowids = {rowid for rowid, in cursor.fetchall()}
+
+        self.assertEqual(rowids, {pk * 2 for pk in Mission.objects.values_list('pk', flat=True)} |
+                         {pk * 2 + 1 for pk in MissionReport.objects.values_list('pk', flat=True)})
+
+    def test_should_match_with_fallback_backend(self):
+        """Test the unindexed backend used on databases without full-text support"""
+        results = SearchBackend('default').search(
+            'cargo docking', Mission.objects.all(), MissionReport.objects.all(), limit=10)
+
+        self.assertEqual({result.title for result in results},
+                         {'Docking trials', 'Cargo resupply', 'Cargo resupply Report 1'})
+
+    def test_should_rebuild_index(self):
+        """Test that rows written without signals are found after a rebuild"""
+        Mission.objects.filter(pk=self.cargo.pk).update(name='Lunar gateway')
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(self.search('admin', 'gateway'), ['Lunar gateway'])
+
+
+class ReportJobTestCase(StaffMixin, TestCase):
+    """Test cases for the report generation queue and its worker"""
+
+    def setUp(self):
+        """Set up a mission, an ISS admin allowed to generate reports and a NASA admin"""
+        self.client = Client()
+
+        _, self.nasa_admins = self.create_groups(iss_permissions=['add_missionreport'])
+        juan = self.create_user('juan.mortyme', ISS_ADMIN_GROUP)
+        self.create_user('ron.tgen', ISS_ADMIN_GROUP)
+        self.ella = self.create_user('ella.vader', NASA_ADMIN_GROUP)
+
+        supervisor = Employee.objects.create(
+            user=juan, security_clearance=SecurityClearance.TOP_SECRET)
+        self.assignee = Employee.objects.create(
+            user=self.ella, security_clearance=SecurityClearance.TOP_SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', supervisor=supervisor,
+            security_clearance=SecurityClearance.BASELINE)
+
+        self.client.login(username='juan.mortyme', password='password')
+
+    def generate(self):
+        """Request a report through the view, returning the job page's path"""
+        response = self.client.post(f"/mission-report/generate/{self.mission.pk}", {
+            'assigned_to': self.assignee.pk,
+            'report_summary': 'Summary',
+        })
+
+        return response.url
+
+    def work(self):
+        """Run the worker until no job is due"""
+        call_command('process_report_jobs', '--once', stdout=StringIO())
+
+    def test_should_show_pending_job_until_generated(self):
+        """Test the view only enqueues, and the job page redirects once the worker ran"""
+        path = self.generate()
+        response = self.client.get(path)
+
+        self.assertFalse(MissionReport.objects.exists())
+        self.assertContains(response, 'Pending')
+        self.assertContains(response, 'http-equiv="refresh"')
+
+        self.work()
+        report = MissionReport.objects.get()
+
+        self.assertEqual(self.client.get(path).url, f"/mission-report/{report.pk}")
+        self.assertEqual((report.title, report.summary), ('Mission 1 Report 1', 'Summary'))
+        self.assertEqual(ReportJob.objects.get().report, report)
+
+    def test_should_hide_jobs_from_other_users(self):
+        """Test only the user who asked for a report sees its job"""
+        path = self.generate()
+        self.client.login(username='ron.tgen', password='password')
+
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+    @override_settings(MISSIONS_REPORT_JOB_MAX_ATTEMPTS=2)
+    def test_should_retry_failed_jobs_with_backoff(self):
+        """Test a failing job is retried later, and failed after its last attempt"""
+        self.generate()
+        # Take the number the job would be given, so that its insert fails
+        MissionReport.objects.create(mission=self.mission, sequence=1, title='Taken',
+                                     publish_date=timezone.now(), summary='Summary')
+
+        with self.assertLogs('ssd2023.jobs', 'ERROR'):
+            self.work()
+
+        job = ReportJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ReportJob.Status.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        # Only logged, as the database error is not for the user to see
+        self.assertEqual(job.last_error, '')
+
+        ReportJob.objects.update(run_after=timezone.now())
+
+        with self.assertLogs('ssd2023.jobs', 'ERROR'):
+            self.work()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ReportJob.Status.FAILED, 2))
+        response = self.client.get(f"/mission-report/job/{job.pk}")
+        self.assertContains(response, 'could not be generated.')
+        self.assertNotContains(response, 'UNIQUE')
+
+    def test_should_fail_jobs_for_non_nasa_assignees_without_retrying(self):
+        """Test an assignee who lost their NASA role fails the job at once"""
+        self.generate()
+        self.ella.groups.remove(self.nasa_admins)
+
+        with self.assertLogs('ssd2023.jobs', 'WARNING'):
+            self.work()
+
+        job = ReportJob.objects.get()
+        self.assertEqual(job.status, ReportJob.Status.FAILED)
+        self.assertFalse(MissionReport.objects.exists())
+        self.assertContains(self.client.get(f"/mission-report/job/{job.pk}"),
+                            'can only be assigned to a NASA admin')
+
+    def test_should_claim_each_job_once(self):
+        """Test a claimed job is not claimed again until its worker is presumed gone"""
+        self.generate()
+
+        self.assertIsNotNone(jobs.claim())
+        self.assertIsNone(jobs.claim())
+
+        ReportJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.claim().attempts, 2)
+
+    @override_settings(MISSIONS_REPORT_JOB_MAX_ATTEMPTS=1)
+    def test_should_fail_lost_jobs_without_attempts_left(self):
+        """Test a job whose worker stopped on its last attempt is failed, not run again"""
+        path = self.generate()
+        jobs.claim()
+        ReportJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertIsNone(jobs.claim())
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.Status.FAILED)
+        self.assertContains(self.client.get(path), jobs.LOST_ERROR)
+
+    @override_settings(MISSIONS_REPORT_QUEUE=False)
+    def test_should_leave_jobs_claimed_by_a_worker(self):
+        """Test a job a worker claims before the request does is left to that worker"""
+        def claim_first(sender, instance, created, **kwargs):  # pylint: disable=unused-argument
+            if created:
+                jobs.claim(instance.pk)
+
+        post_save.connect(claim_first, sender=ReportJob)
+
+        try:
+            job = jobs.enqueue(self.mission, self.assignee, 'Summary', self.ella)
+        finally:
+            post_save.disconnect(claim_first, sender=ReportJob)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ReportJob.Status.RUNNING, 1))
+        self.assertFalse(MissionReport.objects.exists())
+
+    @override_settings(MISSIONS_REPORT_QUEUE=False)
+    def test_should_generate_in_request_without_queue(self):
+        """Test reports are written by the view itself when the queue is off"""
+        path = self.generate()
+
+        self.assertEqual(self.client.get(path).url,
+                         f"/mission-report/{MissionReport.objects.get().pk}")
+
+
+@override_settings(ROOT_URLCONF='missions.async_urls', MISSIONS_NOTIFICATIONS_BROKER='memory',
+                   MISSIONS_REPORT_QUEUE=False)
+class NotificationsTestCase(StaffMixin, TestCase):
+    """Test cases for pushing new reports to their assignees"""
+
+    def setUp(self):
+        """Set up a NASA admin assigned to reports on two missions of different clearance"""
+        self.create_groups(nasa_permissions=['view_mission', 'view_missionreport'])
+        ella = self.create_user('ella.vader', NASA_ADMIN_GROUP)
+
+        self.employee = Employee.objects.create(
+            user=ella, security_clearance=SecurityClearance.SECRET)
+        self.mission = Mission.objects.create(
+            name='Mission 1', supervisor=self.employee,
+            security_clearance=SecurityClearance.BASELINE)
+        self.secret_mission = Mission.objects.create(
+            name='Mission 2', supervisor=self.employee,
+            security_clearance=SecurityClearance.TOP_SECRET)
+
+        self.async_client.force_login(ella)
+
+    def create_report(self, mission):
+        """Create and commit a report assigned to the NASA admin"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return MissionReport.objects.create(
+                mission=mission, assigned_to=self.employee,
+                publish_date=timezone.now(), summary='Summary')
+
+    def test_should_warn_of_in_process_broker_with_report_worker(self):
+        """Test serving the stream with worker generated reports needs a shared broker"""
+        with override_settings(MISSIONS_ASYNC_VIEWS=True, MISSIONS_REPORT_QUEUE=True):
+            with self.assertLogs('ssd2023.notifications', 'WARNING'):
+                notifications.check_broker()
+
+        for overrides in ({'MISSIONS_REPORT_QUEUE': False},
+                          {'MISSIONS_NOTIFICATIONS_BROKER': 'redis'},
+                          {'MISSIONS_ASYNC_VIEWS': False}):
+            with override_settings(**{'MISSIONS_ASYNC_VIEWS': True, 'MISSIONS_REPORT_QUEUE': True,
+                                      **overrides}):
+                with self.assertNoLogs('ssd2023.notifications'):
+                    notifications.check_broker()
+
+    @override_settings(MISSIONS_REPORT_QUEUE=True)
+    async def test_should_turn_stream_off_without_shared_broker(self):
+        """Test the dashboard does not subscribe, and the stream tells browsers to stop"""
+        self.assertNotContains(await self.async_client.get('/'), 'data-url="/notifications"')
+        self.assertEqual((await self.async_client.get('/notifications')).status_code, 204)
+
+    async def test_should_publish_new_reports_to_their_assignee(self):
+        """Test creating a report publishes it on the assignee's channel once committed"""
+        subscription = await notifications.get_broker().subscribe(
+            notifications.employee_channel(self.employee.pk))
+
+        try:
+            report = await sync_to_async(self.create_report)(self.mission)
+            message = json.loads(await subscription.get(1))
+
+            self.assertEqual(message['url'], f"/mission-report/{report.pk}")
+            self.assertEqual(message['title'], 'Mission 1 Report 1')
+            self.assertIsNone(await subscription.get(0.01))
+        finally:
+            await subscription.close()
+
+        self.assertEqual(notifications.get_broker().subscriptions, {})
+
+    async def test_should_stream_reports_within_clearance(self):
+        """Test the stream relays new reports as events, leaving out those above clearance"""
+        response = await self.async_client.get('/notifications')
+        events = aiter(response.streaming_content)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(await anext(events), b'retry: 5000\n\n')
+
+        await sync_to_async(self.create_report)(self.secret_mission)
+        report = await sync_to_async(self.create_report)(self.mission)
+        event = (await anext(events)).decode()
+        await events.aclose()
+
+        self.assertTrue(event.startswith(f"event: report\nid: {report.pk}\n"))
+        self.assertNotIn('security_clearance', event)
+
+    @override_settings(MISSIONS_NOTIFICATION_STREAM_SECONDS=0)
+    async def test_should_show_stream_on_dashboard(self):
+        """Test the dashboard subscribes, and expired streams end"""
+        self.assertContains(await self.async_client.get('/'), 'data-url="/notifications"')
+
+        response = await self.async_client.get('/notifications')
+
+        self.assertEqual([event async for event in response.streaming_content],
+                         [b'retry: 5000\n\n'])
+
+
+class StatisticsTestCase(StaffMixin, TestCase):
+    """Test cases for the grouped statistics endpoint and command"""
+
+    def setUp(self):
+        """Set up a SECRET ISS admin and reports over two divisions and weeks"""
+        cache.clear()
+        caches['pages'].clear()
+
+        self.create_groups()
+        juan = self.create_user('juan.mortyme', ISS_ADMIN_GROUP, first_name='Juan',
+                                last_name='Mortyme')
+        self.create_superuser()
+
+        self.operations = Division.objects.create(name='Operations')
+        self.science = Division.objects.create(name='Science')
+        self.supervisor = Employee.objects.create(
+            user=juan, security_clearance=SecurityClearance.SECRET)
+
+        now = timezone.now()
+        self.docking = Mission.objects.create(
+            name='Docking', division=self.operations, supervisor=self.supervisor,
+            start_date=now - timedelta(days=10), end_date=now,
+            security_clearance=SecurityClearance.BASELINE)
+        self.samples = Mission.objects.create(
+            name='Samples', division=self.science, supervisor=self.supervisor,
+            start_date=now - timedelta(days=30), security_clearance=SecurityClearance.SECRET)
+        classified = Mission.objects.create(
+            name='Classified', division=self.science, supervisor=self.supervisor,
+            security_clearance=SecurityClearance.TOP_SECRET)
+
+        for mission, age in ((self.docking, 0), (self.docking, 0), (self.docking, 7),
+                             (self.samples, 0), (classified, 0)):
+            MissionReport.objects.create(
+                mission=mission, assigned_to=self.supervisor, summary='Summary',
+                publish_date=now - timedelta(days=age))
+
+        self.client.login(username='juan.mortyme', password='password')
+
+    def test_should_group_within_clearance(self):
+        """Test the statistics count only what the user may see, grouped by the database"""
+        response = self.client.get('/stats', {'weeks': 1})
+        statistics = response.json()
+
+        self.assertEqual(set(statistics), set(stats.STATISTICS))
+        week = stats.week_start(timezone.now(), 1).date().isoformat()
+        self.assertEqual([(row['week'], row['division'], row['reports'])
+                          for row in statistics['reports-per-week']['rows']],
+                         [(week, 'Operations', 2), (week, 'Science', 1)])
+        self.assertEqual([(row['mission'], row['reports'])
+                          for row in statistics['reports-per-mission']['rows']],
+                         [('Docking', 3), ('Samples', 1)])
+        self.assertEqual(statistics['reports-per-assignee']['rows'], [
+            {'employee_id': self.supervisor.pk, 'employee': 'Juan Mortyme', 'reports': 4}])
+        self.assertEqual([(row['division'], row['missions'], row['completed'],
+                           row['average_days']) for row in statistics['mission-duration']['rows']],
+                         [('Operations', 1, 1, 10.0), ('Science', 1, 0, None)])
+        self.assertEqual([(row['label'], row['missions'], row['reports'])
+                          for row in statistics['clearance-distribution']['rows']],
+                         [('Baseline', 1, 3), ('Confidential', 0, 0), ('Secret', 1, 1),
+                          ('Top Secret', 0, 0)])
+
+        self.assertEqual(self.client.get('/stats', {'stat': 'nope'}).status_code, 400)
+
+    def test_should_cache_until_the_tables_read_change(self):
+        """Test cached statistics are served without queries until a table they read changes"""
+        roles = get_roles(User.objects.get(username='juan.mortyme'))
+        durations = stats.get_statistic('mission-duration', roles)
+        reports = stats.get_statistic('reports-per-division', roles)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_statistic('reports-per-division', roles), reports)
+
+        MissionReport.objects.create(mission=self.samples, publish_date=timezone.now(),
+                                     summary='Summary')
+
+        self.assertEqual(stats.get_statistic('mission-duration', roles), durations)
+        self.assertEqual([row['reports'] for row in
+                          stats.get_statistic('reports-per-division', roles)['rows']], [3, 2])
+
+        superuser = stats.get_statistic('reports-per-division', get_roles(
+            User.objects.get(username='admin')))
+        self.assertEqual([row['reports'] for row in superuser['rows']], [3, 3])
+
+    def test_should_print_statistics(self):
+        """Test the command prints every mission's statistics as JSON"""
+        out = StringIO()
+
+        call_command('mission_stats', '--stat', 'clearance-distribution', '--refresh',
+                     stdout=out)
+
+        rows = json.loads(out.getvalue())['clearance-distribution']['rows']
+        self.assertEqual([row['missions'] for row in rows], [1, 0, 1, 1])
@@ -0,0 +1,43 @@
+"""Users and groups shared by the test modules of the Missions App"""
+from django.contrib.auth.models import User, Group, Permission
+
+from .models import ISS_ADMIN_GROUP, NASA_ADMIN_GROUP
+
+
+class StaffMixin:
+    """
+    Creates the ISS and NASA admin groups and the users logging in to them,
+    all with the password 'password'
+    """
+
+    @staticmethod
+    def create_groups(iss_permissions=(), nasa_permissions=()):
+        """The ISS and NASA admin groups, granted the permissions with the given codenames"""
+        iss_admins = Group.objects.create(name=ISS_ADMIN_GROUP)
+        iss_admins.permissions.add(*Permission.objects.filter(codename__in=iss_permissions))
+        nasa_admins = Group.objects.create(name=NASA_ADMIN_GROUP)
+        nasa_admins.permissions.add(*Permission.objects.filter(codename__in=nasa_permissions))
+
+        return iss_admins, nasa_admins
+
+    @staticmethod
+    def create_user(username, group=None, **fields):
+        """A user in the group with the given name, if any"""
+        user = User.objects.create_user(username, f"{username}@test.com", 'password', **fields)
+
+        if group is not None:
+            user.groups.add(Group.objects.get(name=group))
+
+        return user
+
+    @staticmethod
+    def create_superuser():
+        """The superuser 'admin'"""
+        return User.objects.create_superuser('admin', 'admin@test.com', 'password')
+
+    def create_staff(self, iss_permissions=(), nasa_permissions=()):
+        """The groups, with juan.mortyme an ISS admin and ella.vader a NASA admin"""
+        self.create_groups(iss_permissions, nasa_permissions)
+
+        return (self.create_user('juan.mortyme', ISS_ADMIN_GROUP),
+                self.create_user('ella.vader', NASA_ADMIN_GROUP))
@@ -0,0 +1,266 @@
+"""Streaming import and export of missions data as CSV or newline-delimited JSON"""
+import csv
+import json
+
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Division, Employee, Mission, MissionReport
+from .choices import invalidate_employee_choices
+from .dashboards import rebuild as rebuild_dashboards
+from .roles import invalidate_roles
+from .search import get_backend as get_search_backend
+
+DEFAULT_BATCH_SIZE = 5000
+
+FORMATS = ('csv', 'ndjson')
+
+# Columns of each dataset; foreign keys are written as primary keys
+DATASETS = {
+    'divisions': (Division, ['id', 'name']),
+    'employees': (Employee, ['id', 'user__username', 'division', 'address', 'phone_number',
+                             'security_clearance']),
+    'missions': (Mission, ['id', 'name', 'description', 'division', 'supervisor',
+                           'start_date', 'end_date', 'security_clearance']),
+    'reports': (MissionReport, ['id', 'title', 'mission', 'assigned_to', 'publish_date',
+                                'summary', 'sequence']),
+}
+
+SSN_COLUMN = 'social_security_number'
+
+
+class TransferError(Exception):
+    """A row could not be imported"""
+
+
+def get_columns(dataset, include_ssn=False):
+    """Columns exported for a dataset"""
+    columns = list(DATASETS[dataset][1])
+
+    if dataset == 'employees' and include_ssn:
+        columns.append(SSN_COLUMN)
+
+    return columns
+
+
+def export_rows(dataset, queryset=None, include_ssn=False, chunk_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield the rows of a dataset as dictionaries.
+
+    Rows are read with values() over a server-side cursor where the database
+    supports one, so neither model instances nor the full result are held in
+    memory. Social security numbers are only selected (and so decrypted) when
+    include_ssn is set.
+    """
+    model, _ = DATASETS[dataset]
+    queryset = model.objects.all() if queryset is None else queryset
+    columns = get_columns(dataset, include_ssn)
+    rows = queryset.order_by('pk').values(*columns).iterator(chunk_size=chunk_size)
+
+    if SSN_COLUMN in columns:
+        return decrypt_ssns(rows, chunk_size)
+
+    return rows
+
+
+def decrypt_ssns(rows, chunk_size):
+    """Decrypt the social security numbers of exported rows a chunk at a time"""
+    field = Employee._meta.get_field(SSN_COLUMN)
+
+    for chunk in chunked(rows, chunk_size):
+        for row, ssn in zip(chunk, field.decrypt_many([row[SSN_COLUMN] for row in chunk])):
+            row[SSN_COLUMN] = ssn
+
+        yield from chunk
+
+
+def render_csv(rows, columns):
+    """Yield a header line then one CSV line per row"""
+    # writerow() returns what the file's write() does, here the line itself
+    writer = csv.writer(SimpleNamespace(write=lambda line: line))
+
+    yield writer.writerow(columns)
+
+    for row in rows:
+        yield writer.writerow(
+            ['' if row[column] is None else
+             row[column].isoformat() if hasattr(row[column], 'isoformat') else row[column]
+             for column in columns])
+
+
+def _json_default(value):
+    """Encode dates at full precision, unlike DjangoJSONEncoder which drops microseconds"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def render_ndjson(rows):
+    """Yield one JSON document per line"""
+    for row in rows:
+        yield json.dumps(row, default=_json_default) + '\n'
+
+
+def render(rows, columns, file_format):
+    """Yield the rows encoded in the given format"""
+    if file_format == 'csv':
+        return render_csv(rows, columns)
+
+    return render_ndjson(rows)
+
+
+def read_rows(stream, file_format):
+    """Yield dictionaries from a CSV or NDJSON text stream"""
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def chunked(rows, size):
+    """Group an iterable into lists of at most size items"""
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _field_value(field, value):
+    """Convert an exported value back to the Python type of a model field"""
+    if value in ('', None) and field.null:
+        return None
+
+    if field.is_relation:
+        return field.target_field.to_python(value)
+
+    return field.to_python('' if value is None else value)
+
+
+def build_instance(model, row, user_ids=None):
+    """Build an unsaved model instance from an exported row"""
+    instance = model()
+
+    for column, value in row.items():
+        if column == 'user__username':
+            instance.user_id = user_ids[value]
+            continue
+
+        field = model._meta.get_field(column)
+        setattr(instance, field.attname, _field_value(field, value))
+
+    return instance
+
+
+def _resolve_users(rows, using):
+    """Map the usernames of employee rows to user ids, creating missing users"""
+    usernames = {row['user__username'] for row in rows}
+    user_ids = dict(User.objects.using(using).filter(
+        username__in=usernames).values_list('username', 'pk'))
+
+    missing = usernames - user_ids.keys()
+
+    if missing:
+        # Imported staff cannot log in until a password is set by an administrator
+        User.objects.using(using).bulk_create(
+            [User(username=username, password='!') for username in missing])
+        user_ids.update(User.objects.using(using).filter(
+            username__in=missing).values_list('username', 'pk'))
+
+    return user_ids
+
+
+def encrypt_ssns(employees):
+    """Encrypt the social security numbers of a batch of employees before inserting them"""
+    field = Employee._meta.get_field(SSN_COLUMN)
+    ssns = field.encrypt_many([employee.social_security_number for employee in employees])
+
+    for employee, ssn in zip(employees, ssns):
+        employee.social_security_number = ssn
+
+
+def import_rows(dataset, rows, batch_size=DEFAULT_BATCH_SIZE, ignore_conflicts=False):
+    """
+    Insert exported rows in batches of bulk inserts and return the number read.
+
+    Each batch, with the users its employees need, is committed on its own so
+    memory use is bounded by the batch size. A batch that fails is rolled back
+    whole and raises TransferError, saying how many batches were committed
+    before it. Primary keys are preserved, so foreign keys in later datasets
+    keep pointing at the right rows; import divisions, employees, missions and
+    then reports.
+    """
+    model, _ = DATASETS[dataset]
+    using = router.db_for_write(model)
+    count = 0
+
+    for number, batch in enumerate(chunked(rows, batch_size)):
+        try:
+            with transaction.atomic(using=using):
+                user_ids = _resolve_users(batch, using) if dataset == 'employees' else None
+                instances = [build_instance(model, row, user_ids) for row in batch]
+
+                if model is Employee:
+                    encrypt_ssns(instances)
+
+                model.objects.using(using).bulk_create(
+                    instances, ignore_conflicts=ignore_conflicts)
+        except (ValidationError, KeyError, ValueError, IntegrityError) as error:
+            if count:
+                finish_import(model, using)
+
+            reason = f"missing column {error}" if isinstance(error, KeyError) else error
+            raise TransferError(
+                f"Could not import batch {number + 1} of {dataset}: {reason}. "
+                f"{number} batches ({count} rows) before it were committed") from error
+
+        # Bulk inserts do not send the signals that keep derived data fresh
+        if user_ids:
+            invalidate_roles(*user_ids.values())
+            invalidate_employee_choices()
+
+        if model in (Mission, MissionReport):
+            get_search_backend(using).index(model, model.objects.using(using).filter(
+                pk__in=[instance.pk for instance in instances]))
+
+        count += len(batch)
+
+    finish_import(model, using)
+
+    return count
+
+
+def finish_import(model, using):
+    """Restore state that bulk inserts with explicit primary keys bypass"""
+    connection = connections[using]
+
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+            cursor.execute(sql)
+
+    if model is MissionReport:
+        latest = MissionReport.objects.using(using).filter(
+            mission=OuterRef('pk')).values('mission').annotate(
+                latest=Max('sequence')).values('latest')
+
+        Mission.objects.using(using).update(
+            report_sequence=Coalesce(Subquery(latest), 0))
+
+    if model in (Employee, Mission, MissionReport):
+        rebuild_dashboards(using=using)
@@ -8,9 +8,16 @@ urlpatterns = [
     path("login", views.login_endpoint),
     path("logout", views.logout_endpoint),
     path("mission/create", views.mission_create),
+    path("mission/bulk", views.mission_bulk),
     path("mission/<int:mission_id>", views.mission_details),
     path("mission/<int:mission_id>/update", views.mission_update),
     path("mission/<int:mission_id>/delete", views.mission_delete),
     path("mission-report/generate/<int:mission_id>", views.mission_report_generate),
     path("mission-report/<int:mission_report_id>", views.mission_report_details),
+    path("mission-report/job/<int:job_id>", views.mission_report_job),
+    path("mission-report/export", views.mission_report_export),
+    path("search", views.search),
+    path("employees", views.employee_choices),
+    path("stats", views.statistics),
+    path("metrics", views.metrics_endpoint),
 ]
@@ -1,71 +1,332 @@
 """Functions for viewing objects when rendered"""
+import hashlib
+import hmac
 import logging
+import math
 
-from datetime import datetime
-
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.forms import AuthenticationForm
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
-
-from .models import Mission, MissionReport, Employee
-from .forms import MissionForm, GenerateReportForm
+from django.middleware.csrf import CSRF_SESSION_KEY
+from django.core.exceptions import PermissionDenied
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
+from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+
+from . import bulk, dashboards, jobs, metrics
+from .caching import cached_fragment
+from .choices import EMPLOYEE_ROLES, label_choices, search_employees
+from .models import Dashboard, Mission, MissionReport, ReportJob
+from .forms import BulkMissionForm, MissionForm, GenerateReportForm, MissionReportExportForm
+from .pagination import KeysetPaginator, get_page_size
+from .ratelimit import client_address, limit_login, login_failed
+from .roles import aget_roles, get_roles
+from .routers import pin_to_primary, read_from_replica
+from .search import get_backend as get_search_backend
+from .stats import (DEFAULT_LIMIT, DEFAULT_WEEKS, MAX_LIMIT, MAX_WEEKS, STATISTICS,
+                    get_int_param, get_statistic)
+from .transfer import export_rows, get_columns, render as render_rows
 
 logger = logging.getLogger("ssd2023")
 
+MISSION_ORDERING = ('pk',)
+MISSION_REPORT_ORDERING = ('-publish_date', '-pk')
+
+SEARCH_PAGE_SIZE = 20
+
+# Permissions that change what the mission details page shows
+MISSION_DETAILS_PERMISSIONS = (
+    'missions.change_mission',
+    'missions.delete_mission',
+    'missions.add_missionreport',
+)
+
+# Columns dating each detail page; a report page also shows its mission, which
+# visible_to() already joins
+UPDATED_AT_FIELDS = {
+    Mission: ('updated_at',),
+    MissionReport: ('updated_at', 'mission__updated_at'),
+}
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def paginate_missions(request, missions):
+    """Keyset paginate a mission queryset by primary key"""
+    paginator = KeysetPaginator(
+        missions, MISSION_ORDERING, page_size=get_page_size(request), prefix='missions_')
+
+    return paginator.get_page(request.GET)
+
+
+def paginate_mission_reports(request, mission_reports):
+    """Keyset paginate a mission report queryset, newest first"""
+    paginator = KeysetPaginator(
+        mission_reports, MISSION_REPORT_ORDERING, page_size=get_page_size(request),
+        prefix='reports_')
+
+    return paginator.get_page(request.GET)
+
+
+def get_dashboard_querysets(user, roles=None):
+    """
+    Missions and mission reports a user may list, based on access control.
+
+    Either may be None when the user's role gives no access to that list.
+    """
+    missions = None
+    mission_reports = None
+
+    # The employee profile of the current user
+    # For the superuser, this will be None
+    roles = get_roles(user) if roles is None else roles
+    employee = roles.employee_id
+
+    if roles.is_superuser:
+        return Mission.objects.visible_to(roles), MissionReport.objects.visible_to(roles)
+
+    if employee is not None:
+        if roles.is_nasa_admin:
+            mission_reports = MissionReport.objects.visible_to(roles).filter(
+                assigned_to=employee)
+
+        if roles.is_iss_admin:
+            missions = Mission.objects.visible_to(roles).filter(supervisor=employee)
+            mission_reports = MissionReport.objects.visible_to(roles).filter(
+                mission__in=missions)
+
+    return missions, mission_reports
+
+
+def get_dashboard_content(request, roles, dashboard):
+    """Index page lists served from an employee's dashboard, or None to query them"""
+    if dashboard is None:
+        return None
+
+    return dashboards.index_content(request, roles, dashboard, MISSION_ORDERING,
+                                    MISSION_REPORT_ORDERING)
+
+
+def latest(row):
+    """The latest of the modification times a detail page is dated by, or None"""
+    return None if row is None else max(row)
+
+
+def get_updated_at(request, model, object_id):
+    """Last modification time of a mission or report page, fetched at most once per request"""
+    key = (model, object_id)
+    cached = request.__dict__.setdefault('_missions_updated_at', {})
+
+    if key not in cached:
+        cached[key] = latest(model.objects.visible_to(get_roles(request.user)).filter(
+            pk=object_id).values_list(*UPDATED_AT_FIELDS[model]).first())
+
+    return cached[key]
+
+
+async def aget_updated_at(request, model, object_id):
+    """Like get_updated_at, using the async ORM"""
+    key = (model, object_id)
+    cached = request.__dict__.setdefault('_missions_updated_at', {})
+
+    if key not in cached:
+        cached[key] = latest(await model.objects.visible_to(
+            await aget_roles(request.user)).filter(pk=object_id).values_list(
+                *UPDATED_AT_FIELDS[model]).afirst())
+
+    return cached[key]
+
+
+def make_etag(updated_at, *parts):
+    """Strong entity tag over a modification time and whatever else the page varies on"""
+    if updated_at is None:
+        return None
+
+    digest = hashlib.sha256('|'.join([updated_at.isoformat(), *map(str, parts)]).encode())
+
+    return digest.hexdigest()[:32]
+
+
+def report_scope(roles):
+    """Which of a visible mission's reports the holder of the given roles sees"""
+    if roles.is_superuser or roles.is_iss_admin:
+        return 'all'
+
+    return roles.employee_id
+
+
+def mission_last_modified(request, mission_id):
+    """Last-Modified of the mission details page"""
+    return get_updated_at(request, Mission, mission_id)
+
+
+def mission_etag_parts(request):
+    """
+    What the mission details page varies on besides the mission itself.
+
+    That is the viewer's permissions, the page of reports and the session's
+    CSRF secret embedded in the report form.
+    """
+    return [
+        request.user.pk,
+        *(request.user.has_perm(perm) for perm in MISSION_DETAILS_PERMISSIONS),
+        request.GET.urlencode(),
+        request.session.get(CSRF_SESSION_KEY, ''),
+    ]
+
+
+def mission_etag(request, mission_id):
+    """ETag of the mission details page"""
+    return make_etag(get_updated_at(request, Mission, mission_id), *mission_etag_parts(request))
+
+
+def mission_report_last_modified(request, mission_report_id):
+    """Last-Modified of the mission report page"""
+    return get_updated_at(request, MissionReport, mission_report_id)
+
+
+def mission_report_etag(request, mission_report_id):
+    """ETag of the mission report page, which is the same for every viewer"""
+    return make_etag(get_updated_at(request, MissionReport, mission_report_id))
+
+
+def mission_permissions(user):
+    """Which of the mission details page's actions the user may take"""
+    return {
+        'can_update': user.has_perm("missions.change_mission"),
+        'can_delete': user.has_perm("missions.delete_mission"),
+        'can_add_report': user.has_perm("missions.add_missionreport"),
+    }
+
+
+def mission_fragment(request, roles, mission, permissions):
+    """
+    Versions and other values the cached details of a mission depend on,
+    as keyword arguments of cached_fragment()
+    """
+    return {
+        'depends_on': [('mission', mission.pk), ('division', mission.division_id),
+                       ('employee', mission.supervisor_id)],
+        'vary_on': [*permissions.values(), report_scope(roles), request.GET.urlencode()],
+    }
+
+
+def mission_content(mission, mission_details_html, permissions):
+    """Context of the mission details page around its cached details"""
+    return {
+        **permissions,
+        'mission': mission,
+        'mission_details': mission_details_html,
+        'generate_report_form': GenerateReportForm(),
+    }
+
+
+def mission_report_fragment(mission_report_id, keys):
+    """Versions the cached mission report page depends on"""
+    return [('report', mission_report_id), ('mission', keys['mission_id']),
+            ('employee', keys['assigned_to_id'])]
+
 
 @login_required(login_url='/login')
+@read_from_replica
 def index(request):
     """View of index page based on access control"""
     content = {
         'can_add_mission': request.user.has_perm("missions.add_mission"),
     }
+    roles = get_roles(request.user)
+    dashboard = None
 
-    # Get the employee object for the current user
-    # For the superuser, this will be None
-    employee = Employee.objects.filter(user=request.user).first()
+    # The first pages of an admin's lists are one primary key lookup away
+    if dashboards.covers(request, roles):
+        dashboard = Dashboard.objects.filter(pk=roles.employee_id).first()
 
-    if employee is not None:
-        if request.user.groups.filter(name='NASA_Admin_User').exists():
-            mission_reports = MissionReport.objects.filter(
-                assigned_to=employee)
+    dashboard_content = get_dashboard_content(request, roles, dashboard)
 
-            content['mission_reports'] = mission_reports
+    if dashboard_content is not None:
+        content.update(dashboard_content)
+        return render(request, 'index.html', content)
 
-        if request.user.groups.filter(name='ISS_Admin_User').exists():
-            missions = Mission.objects.filter(supervisor=employee)
-            mission_reports_from_missions = MissionReport.objects.filter(
-                mission__in=missions)
+    missions, mission_reports = get_dashboard_querysets(request.user, roles)
 
-            content['missions'] = missions
-            content['mission_reports'] = mission_reports_from_missions
+    if missions is not None:
+        content['missions'] = paginate_missions(request, missions)
 
-    if request.user.is_superuser:
-        content['missions'] = Mission.objects.all()
-        content['mission_reports'] = MissionReport.objects.all()
+    if mission_reports is not None:
+        content['mission_reports'] = paginate_mission_reports(request, mission_reports)
 
     return render(request, 'index.html', content)
 
 
+def login_rate_limited(request, username, retry_after):
+    """Login page answering an attempt over the rate limit with a 429"""
+    logger.warning("Login attempt for %s from %s is rate limited", username,
+                   client_address(request))
+
+    response = render(request, 'login.html', {
+        'form': AuthenticationForm(),
+        'rate_limited': True,
+    }, status=429)
+    response['Retry-After'] = str(math.ceil(retry_after))
+
+    return response
+
+
+def login_credentials(request):
+    """Username and password of a login attempt"""
+    username = request.POST.get('username', '')
+    logger.info("User %s is attempting to log in", username)
+
+    return username, request.POST.get('password', '')
+
+
+def login_succeeded(request, user):
+    """Log in an authenticated user and send them to the index page"""
+    login(request, user)
+    metrics.registry.count('login_attempts', 'succeeded')
+    logger.info("User %s has logged in successfully", user.get_username())
+
+    return HttpResponseRedirect("/")
+
+
+def login_rejected(username):
+    """Count a login attempt with the wrong password against the username"""
+    metrics.registry.count('login_attempts', 'failed')
+    login_failed(username)
+
+
+def login_page(request):
+    """Login page with an empty form"""
+    return render(request, 'login.html', {'form': AuthenticationForm()})
+
+
+@pin_to_primary
 def login_endpoint(request):
     """User login endpoint"""
     if request.method == 'POST':
-        username = request.POST.get('username', '')
-        password = request.POST.get('password', '')
+        username, password = login_credentials(request)
 
-        logger.info("User %s is attempting to log in", username)
+        # Checked before authenticate() so that rejected guesses cost no password hash
+        retry_after = limit_login(request, username)
+
+        if retry_after:
+            return login_rate_limited(request, username, retry_after)
 
         user = authenticate(request, username=username, password=password)
 
         if user is not None:
-            login(request, user)
-            logger.info("User %s has logged in successfully", username)
-            return HttpResponseRedirect("/")
+            return login_succeeded(request, user)
 
-    form = AuthenticationForm()
+        login_rejected(username)
 
-    return render(request, 'login.html', {'form': form})
+    return login_page(request)
 
 
 @login_required(login_url='/login')
@@ -78,28 +339,39 @@ def logout_endpoint(request):
 
 @login_required(login_url='/login')
 @permission_required('missions.view_mission', raise_exception=True)
+@read_from_replica
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=mission_etag, last_modified_func=mission_last_modified)
 def mission_details(request, mission_id):
     """View mission details"""
-    mission = Mission.objects.get(pk=mission_id)
-    mission_reports = mission.missionreport_set.all()
-    generate_report_form = GenerateReportForm()
-
-    can_update = request.user.has_perm("missions.change_mission")
-    can_delete = request.user.has_perm("missions.delete_mission")
-    can_add_report = request.user.has_perm("missions.add_missionreport")
-
-    return render(request, 'mission.html', {
-        'can_delete': can_delete,
-        'can_update': can_update,
-        'can_add_report': can_add_report,
-        'mission': mission,
-        'reports': mission_reports,
-        'generate_report_form': generate_report_form
-    })
+    roles = get_roles(request.user)
+    mission = get_object_or_404(
+        Mission.objects.visible_to(roles).only('pk', 'division_id', 'supervisor_id'),
+        pk=mission_id)
+    permissions = mission_permissions(request.user)
+
+    def render_details():
+        details = Mission.objects.select_related(
+            'division', 'supervisor__user').get(pk=mission_id)
+        mission_reports = paginate_mission_reports(
+            request, details.missionreport_set.visible_to(roles))
+
+        return render_to_string('includes/mission-details.html', {
+            'mission': details,
+            'reports': mission_reports,
+        }, request)
+
+    mission_details_html = cached_fragment(
+        'mission', render=render_details,
+        **mission_fragment(request, roles, mission, permissions))
+
+    return render(request, 'mission.html',
+                  mission_content(mission, mission_details_html, permissions))
 
 
 @login_required(login_url='/login')
 @permission_required('missions.add_mission', raise_exception=True)
+@pin_to_primary
 def mission_create(request):
     """Create mission"""
     if request.method == 'POST':
@@ -119,10 +391,13 @@ def mission_create(request):
 
 @login_required(login_url='/login')
 @permission_required('missions.change_mission', raise_exception=True)
+@pin_to_primary
 def mission_update(request, mission_id):
     """Update mission details"""
+    mission = get_object_or_404(
+        Mission.objects.visible_to(get_roles(request.user)), pk=mission_id)
+
     if request.method == 'POST':
-        mission = Mission.objects.get(pk=mission_id)
         form = MissionForm(request.POST, instance=mission)
 
         if form.is_valid():
@@ -130,7 +405,6 @@ def mission_update(request, mission_id):
 
             return HttpResponseRedirect("/mission/" + str(mission_id))
 
-    mission = Mission.objects.get(pk=mission_id)
     form = MissionForm(instance=mission)
 
     return render(request, 'mission-update.html', {'mission': mission, 'form': form})
@@ -138,16 +412,50 @@ def mission_update(request, mission_id):
 
 @login_required(login_url='/login')
 @permission_required('missions.delete_mission', raise_exception=True)
+@pin_to_primary
 def mission_delete(request, mission_id):
     """Delete mission"""
-    mission = Mission.objects.get(pk=mission_id)
+    mission = get_object_or_404(
+        Mission.objects.visible_to(get_roles(request.user)), pk=mission_id)
     mission.delete()
 
     return HttpResponseRedirect("/")
 
 
+@login_required(login_url='/login')
+@require_POST
+@pin_to_primary
+def mission_bulk(request):
+    """Delete, reassign or change the clearance of many missions, answering with the counts"""
+    form = BulkMissionForm(request.POST)
+
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    action = form.cleaned_data['action']
+    permission = 'missions.delete_mission' if action == 'delete' else 'missions.change_mission'
+
+    if not request.user.has_perm(permission):
+        raise PermissionDenied
+
+    missions = Mission.objects.visible_to(get_roles(request.user)).filter(
+        pk__in=form.cleaned_data['missions'])
+
+    if action == 'delete':
+        counts = bulk.delete_missions(missions)
+    else:
+        counts = bulk.update_missions(missions, **form.changes())
+
+    logger.info("User %s ran a bulk %s of %s missions", request.user.username, action,
+                counts['missions'])
+
+    return JsonResponse({'action': action, 'requested': len(form.cleaned_data['missions']),
+                         **counts})
+
+
 @login_required(login_url='/login')
 @permission_required('missions.add_missionreport', raise_exception=True)
+@pin_to_primary
 def mission_report_generate(request, mission_id):
     """Generate mission report"""
     if request.method != 'POST':
@@ -158,30 +466,171 @@ def mission_report_generate(request, mission_id):
     if not form.is_valid():
         return HttpResponseRedirect("/")
 
-    mission = Mission.objects.get(pk=mission_id)
-    mission_reports = mission.missionreport_set.all()
-    employee = Employee.objects.get(pk=form.data['assigned_to'])
+    mission = get_object_or_404(
+        Mission.objects.visible_to(get_roles(request.user)), pk=mission_id)
+    employee = form.cleaned_data['assigned_to']
 
-    if not employee.user.groups.filter(name='NASA_Admin_User').count():
+    if not get_roles(employee.user).is_nasa_admin:
         return HttpResponseRedirect("/")
 
-    mission_report = MissionReport(
-        title=f"{mission.name} Report {str(mission_reports.count() + 1)}",
-        mission=mission,
-        assigned_to=employee,
-        publish_date=datetime.now(),
-        summary=form.data['report_summary']
-    )
+    # The report is written by the report worker, see missions.jobs
+    job = jobs.enqueue(mission, employee, form.data['report_summary'], request.user)
+
+    return HttpResponseRedirect("/mission-report/job/" + str(job.pk))
+
+
+@login_required(login_url='/login')
+@permission_required('missions.add_missionreport', raise_exception=True)
+@pin_to_primary
+@cache_control(private=True, no_store=True)
+def mission_report_job(request, job_id):
+    """Show whether a requested report has been generated, and then redirect to it"""
+    job_requests = ReportJob.objects.select_related('mission')
+
+    if not request.user.is_superuser:
+        job_requests = job_requests.filter(requested_by=request.user)
 
-    mission_report.save()
+    job = get_object_or_404(job_requests, pk=job_id)
 
-    return HttpResponseRedirect("/mission-report/" + str(mission_report.pk))
+    if job.status == ReportJob.Status.DONE and job.report_id is not None:
+        return HttpResponseRedirect("/mission-report/" + str(job.report_id))
+
+    return render(request, 'mission-report-job.html', {
+        'job': job,
+        'refresh': job.status in (ReportJob.Status.PENDING, ReportJob.Status.RUNNING),
+    })
 
 
 @login_required(login_url='/login')
 @permission_required('missions.view_missionreport', raise_exception=True)
+@read_from_replica
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=mission_report_etag, last_modified_func=mission_report_last_modified)
 def mission_report_details(request, mission_report_id):
     """View mission report details"""
-    mission_report = MissionReport.objects.get(pk=mission_report_id)
+    keys = get_object_or_404(
+        MissionReport.objects.visible_to(get_roles(request.user)).values(
+            'mission_id', 'assigned_to_id'),
+        pk=mission_report_id)
+
+    def render_page():
+        mission_report = MissionReport.objects.select_related(
+            'mission', 'assigned_to__user').get(pk=mission_report_id)
+
+        return render_to_string('mission-report.html', {'mission_report': mission_report}, request)
+
+    return HttpResponse(cached_fragment(
+        'mission-report', mission_report_fragment(mission_report_id, keys), render_page))
+
+
+@login_required(login_url='/login')
+@permission_required('missions.view_missionreport', raise_exception=True)
+def mission_report_export(request):
+    """Stream the mission reports visible on the index page as CSV or NDJSON"""
+    form = MissionReportExportForm(request.GET)
+
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    _, mission_reports = get_dashboard_querysets(request.user)
+
+    if mission_reports is None:
+        mission_reports = MissionReport.objects.none()
+
+    file_format = form.cleaned_data['format'] or 'csv'
+    rows = export_rows('reports', queryset=form.filter(mission_reports))
+
+    response = StreamingHttpResponse(
+        render_rows(rows, get_columns('reports'), file_format),
+        content_type=EXPORT_CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="mission-reports.{file_format}"'
+
+    return response
+
+
+@login_required(login_url='/login')
+def search(request):
+    """Full-text search over the missions and reports the user may see"""
+    query = request.GET.get('q', '').strip()
+
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+
+    roles = get_roles(request.user)
+    missions = Mission.objects.visible_to(roles)
+    mission_reports = MissionReport.objects.visible_to(roles)
+
+    results = []
+
+    if query:
+        results = get_search_backend().search(
+            query, missions, mission_reports,
+            limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE)
+
+    return render(request, 'search.html', {
+        'query': query,
+        'results': results[:SEARCH_PAGE_SIZE],
+        'page': page,
+        'has_next': len(results) > SEARCH_PAGE_SIZE,
+    })
+
+
+@login_required(login_url='/login')
+@read_from_replica
+def employee_choices(request):
+    """Page through the supervisors or report assignees matching a type-ahead search"""
+    role = request.GET.get('role')
+
+    if role not in EMPLOYEE_ROLES:
+        return HttpResponseBadRequest("Unknown role")
+
+    _, permissions = EMPLOYEE_ROLES[role]
+
+    if not any(request.user.has_perm(permission) for permission in permissions):
+        raise PermissionDenied
+
+    paginator = KeysetPaginator(
+        search_employees(role, request.GET.get('q', '')), ('pk',),
+        page_size=get_page_size(request))
+    page = paginator.get_page(request.GET)
+    choices = label_choices(
+        (employee.pk, employee.user.first_name, employee.user.last_name, employee.user.username)
+        for employee in page)
+
+    return JsonResponse({
+        'results': [{'id': pk, 'label': label} for pk, label in choices],
+        'next': "/employees" + page.next_url if page.next_url else None,
+    })
+
+
+@login_required(login_url='/login')
+@read_from_replica
+def statistics(request):
+    """Grouped statistics over the missions and reports the user may see, as JSON for charts"""
+    names = request.GET.getlist('stat') or list(STATISTICS)
+
+    if any(name not in STATISTICS for name in names):
+        return HttpResponseBadRequest("Unknown statistic")
+
+    roles = get_roles(request.user)
+    weeks = get_int_param(request.GET, 'weeks', DEFAULT_WEEKS, MAX_WEEKS)
+    limit = get_int_param(request.GET, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+
+    return JsonResponse({name: get_statistic(name, roles, weeks=weeks, limit=limit)
+                         for name in names})
+
+
+def metrics_endpoint(request):
+    """Request metrics of this process in the Prometheus text format"""
+    token = getattr(settings, 'MISSIONS_METRICS_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+
+    # Scraped with the bearer token, or viewed by a superuser in the browser
+    if not (request.user.is_superuser or
+            (token and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()))):
+        raise PermissionDenied
 
-    return render(request, 'mission-report.html', {'mission_report': mission_report})
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
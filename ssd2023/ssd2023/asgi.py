@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ssd2023.settings')
+# Serve the async versions of the missions views, see missions/async_urls.py
+os.environ.setdefault('MISSIONS_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'missions.middleware.performance_middleware',
+    'missions.profiling.query_profiling_middleware',
     'csp.middleware.CSPMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -55,9 +57,51 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'ssd2023.urls'
 
+# Fraction of requests whose time, queries, template rendering and response size are
+# logged to 'ssd2023.performance' and aggregated at /metrics, which superusers or
+# requests with "Authorization: Bearer <token>" may read. MISSIONS_SERVER_TIMING=1 also
+# sends them back in a Server-Timing header; it is off by default, as it tells anyone
+# how much work each page does
+MISSIONS_METRICS_SAMPLE_RATE = float(os.getenv('MISSIONS_METRICS_SAMPLE_RATE', '1.0'))
+MISSIONS_METRICS_TOKEN = os.getenv('MISSIONS_METRICS_TOKEN', '')
+MISSIONS_SERVER_TIMING = os.getenv('MISSIONS_SERVER_TIMING', '0') == '1'
+
+# Opt-in query profiling: statements run by each view are fingerprinted and their
+# timings added to the QueryFingerprint table every few seconds, for query_report,
+# and statements slower than MISSIONS_SLOW_QUERY_MS are logged to 'ssd2023.queries'
+# with their query plan
+MISSIONS_QUERY_PROFILING = os.getenv('MISSIONS_QUERY_PROFILING', '0') == '1'
+MISSIONS_SLOW_QUERY_MS = float(os.getenv('MISSIONS_SLOW_QUERY_MS', '100'))
+MISSIONS_QUERY_PROFILE_FLUSH_SECONDS = int(os.getenv('MISSIONS_QUERY_PROFILE_FLUSH_SECONDS',
+                                                     '10'))
+
+# Mission reports are generated by the process_report_jobs worker, which retries a
+# failed job MISSIONS_REPORT_JOB_MAX_ATTEMPTS times, waiting MISSIONS_REPORT_JOB_RETRY_SECONDS
+# and then twice as long each time, and reclaims jobs running for longer than
+# MISSIONS_REPORT_JOB_TIMEOUT seconds. MISSIONS_REPORT_QUEUE=0 generates them in the request
+MISSIONS_REPORT_QUEUE = os.getenv('MISSIONS_REPORT_QUEUE', '1') == '1'
+MISSIONS_REPORT_JOB_MAX_ATTEMPTS = int(os.getenv('MISSIONS_REPORT_JOB_MAX_ATTEMPTS', '3'))
+MISSIONS_REPORT_JOB_RETRY_SECONDS = int(os.getenv('MISSIONS_REPORT_JOB_RETRY_SECONDS', '5'))
+MISSIONS_REPORT_JOB_TIMEOUT = int(os.getenv('MISSIONS_REPORT_JOB_TIMEOUT', '300'))
+
+# New reports are pushed to their assignee's dashboard under ASGI through an in-process
+# broker ('memory'), or 'redis' at MISSIONS_NOTIFICATIONS_REDIS_URL when reports are
+# saved by other processes such as the report worker. Serving the async views with
+# MISSIONS_REPORT_QUEUE on needs 'redis'; otherwise the stream is off, with a warning. Streams are
+# closed, and reopened by the browser, after MISSIONS_NOTIFICATION_STREAM_SECONDS
+MISSIONS_NOTIFICATIONS_BROKER = os.getenv('MISSIONS_NOTIFICATIONS_BROKER', 'memory')
+MISSIONS_NOTIFICATIONS_REDIS_URL = os.getenv('MISSIONS_NOTIFICATIONS_REDIS_URL',
+                                             'redis://127.0.0.1:6379')
+MISSIONS_NOTIFICATION_STREAM_SECONDS = int(os.getenv('MISSIONS_NOTIFICATION_STREAM_SECONDS',
+                                                     '300'))
+
+# Route the read-heavy missions pages to their async views; set by asgi.py
+MISSIONS_ASYNC_VIEWS = os.getenv('MISSIONS_ASYNC_VIEWS', '0') == '1'
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates, timed for the performance metrics
+        'BACKEND': 'missions.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -66,6 +110,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'missions.context_processors.roles',
             ],
         },
     },
@@ -82,6 +127,7 @@ CSP_STYLE_SRC = (
 CSP_FONT_SRC = ('data:',)
 CSP_SCRIPT_SRC = ("'self'", 'https://code.jquery.com/jquery-3.6.4.min.js',)
 CSP_IMG_SRC = ("'self'",)
+CSP_CONNECT_SRC = ("'self'",)
 CSP_FORM_ACTION = ("'self'",)
 CSP_FRAME_ANCESTORS = ("'none'",)
 
@@ -145,12 +191,216 @@ LOGGING = {
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# MISSIONS_DATABASE selects 'sqlite' (default) or 'postgres'. MISSIONS_DATABASE_REPLICAS
+# lists read replicas, comma separated: host names for Postgres or database files for
+# SQLite, which makes it possible to try a primary and replica locally.
+DATABASE_ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgres': 'django.db.backends.postgresql',
+}
+
+DATABASE_VENDOR = os.getenv('MISSIONS_DATABASE', 'sqlite')
+
+# Seconds to keep a connection open between requests; 0 closes it after each request.
+# Behind a transaction pooling PgBouncer, set MISSIONS_DATABASE_POOLER=1 as server side
+# cursors do not survive a pooled transaction.
+DATABASE_CONN_MAX_AGE = int(os.getenv('MISSIONS_DATABASE_CONN_MAX_AGE', '60'))
+
+
+def database(**overrides):
+    """Connection settings of the primary or a replica"""
+    if DATABASE_VENDOR == 'sqlite':
+        config = {
+            'ENGINE': DATABASE_ENGINES['sqlite'],
+            'NAME': os.getenv('MISSIONS_DATABASE_NAME', str(BASE_DIR / 'db.sqlite3')),
+            # Seconds a write waits for another connection's lock before failing
+            'OPTIONS': {'timeout': int(os.getenv('MISSIONS_SQLITE_TIMEOUT', '20'))},
+        }
+    else:
+        config = {
+            'ENGINE': DATABASE_ENGINES['postgres'],
+            'NAME': os.getenv('MISSIONS_DATABASE_NAME', 'missions'),
+            'USER': os.getenv('MISSIONS_DATABASE_USER', ''),
+            'PASSWORD': os.getenv('MISSIONS_DATABASE_PASSWORD', ''),
+            'HOST': os.getenv('MISSIONS_DATABASE_HOST', ''),
+            'PORT': os.getenv('MISSIONS_DATABASE_PORT', ''),
+            'OPTIONS': {'connect_timeout': 5},
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('MISSIONS_DATABASE_POOLER', '0') == '1',
+        }
+
+    config.update({
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DATABASE_CONN_MAX_AGE > 0,
+    }, **overrides)
+
+    return config
+
+
 DATABASES = {
+    'default': database(),
+}
+
+DATABASE_REPLICAS = [replica.strip() for replica in
+                     os.getenv('MISSIONS_DATABASE_REPLICAS', '').split(',') if replica.strip()]
+
+for number, replica in enumerate(DATABASE_REPLICAS, 1):
+    DATABASES[f'replica_{number}'] = database(
+        **{'NAME' if DATABASE_VENDOR == 'sqlite' else 'HOST': replica},
+        TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['missions.routers.PrimaryReplicaRouter']
+
+# Database aliases the read-only views may read from
+MISSIONS_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Seconds after a write during which the same browser reads from the primary, covering
+# replication lag so that a user sees their own changes
+MISSIONS_REPLICA_LAG = int(os.getenv('MISSIONS_REPLICA_LAG', '5'))
+
+# Journal SQLite in write-ahead log mode so reads do not block on a writer, and only sync
+# at checkpoints, which cannot corrupt the database in WAL mode
+MISSIONS_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+} if os.getenv('MISSIONS_SQLITE_WAL', '1') == '1' else {}
+
+
+# Pagination of mission and report listings
+
+MISSIONS_PAGE_SIZE = int(os.getenv('MISSIONS_PAGE_SIZE', '25'))
+MISSIONS_MAX_PAGE_SIZE = 100
+
+
+# Caching
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Rendered mission and report fragments live in the 'pages' cache, whose backend is
+# chosen with MISSIONS_PAGE_CACHE: 'locmem' (default), 'file' or 'redis'. Any server
+# speaking the Redis protocol on MISSIONS_PAGE_CACHE_LOCATION can back the latter.
+MISSIONS_PAGE_CACHE = os.getenv('MISSIONS_PAGE_CACHE', 'locmem')
+PAGE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'missions-pages',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('MISSIONS_PAGE_CACHE_LOCATION', str(BASE_DIR / '.page-cache')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('MISSIONS_PAGE_CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+    },
+}
+
+# Sessions, and the users of sessions, are only cached by default when the 'sessions'
+# cache is shared by every process ('redis'); a cache local to each process would let
+# other processes accept a session after logging out, or a user after deactivating them
+# or changing their password, until their cached copy expired
+MISSIONS_SESSION_CACHE = os.getenv('MISSIONS_SESSION_CACHE', 'locmem')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': PAGE_CACHE_BACKENDS[MISSIONS_PAGE_CACHE],
+    # Cached sessions; 'redis' at MISSIONS_SESSION_CACHE_LOCATION shares them across processes
+    'sessions': {
+        'locmem': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'missions-sessions',
+        },
+        'redis': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('MISSIONS_SESSION_CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+        },
+    }[MISSIONS_SESSION_CACHE],
+    # Login attempt counters; 'redis' at MISSIONS_RATE_LIMIT_CACHE_LOCATION shares them
+    'ratelimit': {
+        'locmem': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'missions-ratelimit',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+        'redis': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('MISSIONS_RATE_LIMIT_CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+        },
+    }[os.getenv('MISSIONS_RATE_LIMIT_CACHE', 'locmem')],
+}
+
+# Seconds to keep rendered mission and report fragments. The version tokens a change
+# bumps live in the same cache, so with 'locmem' a change is only seen by the process
+# that made it and the other workers serve their fragments until they expire: 60 by
+# default there, 3600 with a 'file' or 'redis' cache shared by every worker
+MISSIONS_PAGE_CACHE_TIMEOUT = int(os.getenv(
+    'MISSIONS_PAGE_CACHE_TIMEOUT', '60' if MISSIONS_PAGE_CACHE == 'locmem' else '3600'))
+
+# Most missions one bulk delete, reassignment or clearance change may act on
+MISSIONS_MAX_BULK_MISSIONS = int(os.getenv('MISSIONS_MAX_BULK_MISSIONS', '10000'))
+
+# Seconds to cache each statistic of the stats endpoint and command (0 disables); kept
+# in the 'pages' cache, so 60 by default with 'locmem' for the same reason
+MISSIONS_STATS_CACHE_TIMEOUT = int(os.getenv(
+    'MISSIONS_STATS_CACHE_TIMEOUT', '60' if MISSIONS_PAGE_CACHE == 'locmem' else '300'))
+
+# Seconds to cache each user's employee profile, groups and permissions between requests
+# in the 'sessions' cache; 0 (the default unless MISSIONS_SESSION_CACHE is 'redis') only
+# keeps them for the request, as changes could not invalidate other processes' copies
+MISSIONS_ROLE_CACHE_TIMEOUT = int(os.getenv(
+    'MISSIONS_ROLE_CACHE_TIMEOUT', '300' if MISSIONS_SESSION_CACHE == 'redis' else '0'))
+
+# Seconds to cache the supervisor and assignee choice lists in the MISSIONS_CHOICES_CACHE
+# cache ('sessions'), and the number of choices above which those selects are searched
+# instead of listed. 0, the default when that cache is local to each process, disables
+# it, as changes could not invalidate other processes' copies
+MISSIONS_CHOICES_CACHE = os.getenv('MISSIONS_CHOICES_CACHE', 'sessions')
+MISSIONS_CHOICES_CACHE_TIMEOUT = int(os.getenv('MISSIONS_CHOICES_CACHE_TIMEOUT', '0' if (
+    CACHES[MISSIONS_CHOICES_CACHE]['BACKEND'].endswith('LocMemCache')) else '300'))
+MISSIONS_TYPEAHEAD_THRESHOLD = int(os.getenv('MISSIONS_TYPEAHEAD_THRESHOLD', '500'))
+
+
+# Authentication
+
+AUTHENTICATION_BACKENDS = [
+    'missions.backends.RoleBackend',
+]
+
+# Login attempts are limited per client address and per username to (a burst, and then
+# a number per minute), counted over sliding windows in the 'ratelimit' cache; a burst
+# of 0 turns one off. The cache is local to each process, each allowing its own burst,
+# unless MISSIONS_RATE_LIMIT_CACHE is 'redis'
+MISSIONS_LOGIN_RATE_LIMIT_IP = (int(os.getenv('MISSIONS_LOGIN_RATE_LIMIT_IP_BURST', '20')),
+                                float(os.getenv('MISSIONS_LOGIN_RATE_LIMIT_IP_PER_MINUTE', '10')))
+MISSIONS_LOGIN_RATE_LIMIT_USERNAME = (
+    int(os.getenv('MISSIONS_LOGIN_RATE_LIMIT_USERNAME_BURST', '5')),
+    float(os.getenv('MISSIONS_LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE', '5')))
+
+# Reverse proxies, as comma separated addresses or networks, whose X-Forwarded-For header
+# gives the client address that login attempts are limited by; without them every client
+# behind a proxy would share its address's limit. Headers from other peers are ignored
+MISSIONS_TRUSTED_PROXIES = [proxy.strip() for proxy in
+                            os.getenv('MISSIONS_TRUSTED_PROXIES', '').split(',') if proxy.strip()]
+
+# Seconds to cache the user of each session in the 'sessions' cache, saving a query per
+# request; 0 (the default unless MISSIONS_SESSION_CACHE is 'redis') disables it
+MISSIONS_USER_CACHE_TIMEOUT = int(os.getenv(
+    'MISSIONS_USER_CACHE_TIMEOUT', '300' if MISSIONS_SESSION_CACHE == 'redis' else '0'))
+
+# Sessions are stored with MISSIONS_SESSION_ENGINE: 'db' in the database (the default
+# unless MISSIONS_SESSION_CACHE is 'redis'), 'cached_db' in the database and read from
+# the 'sessions' cache for up to MISSIONS_SESSION_CACHE_TIMEOUT seconds (the default
+# with 'redis'), or 'signed_cookies' in the browser, which needs no query but cannot be
+# revoked by logging out before it expires
+SESSION_ENGINES = {
+    'cached_db': 'missions.sessions',
+    'db': 'django.contrib.sessions.backends.db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
 }
+SESSION_ENGINE = SESSION_ENGINES[os.getenv(
+    'MISSIONS_SESSION_ENGINE', 'cached_db' if MISSIONS_SESSION_CACHE == 'redis' else 'db')]
+SESSION_CACHE_ALIAS = 'sessions'
+MISSIONS_SESSION_CACHE_TIMEOUT = int(os.getenv('MISSIONS_SESSION_CACHE_TIMEOUT', '300'))
 
 
 # Password validation
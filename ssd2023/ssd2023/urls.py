@@ -14,10 +14,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
-    path('', include("missions.urls")),
+    path('', include("missions.async_urls" if settings.MISSIONS_ASYNC_VIEWS else "missions.urls")),
     path('admin/', admin.site.urls),
 ]